@@ -1,6 +1,13 @@
-from ._api import MeterImageData, get_meter_values
+from ._api import (
+    MeterImageData, get_meter_values, get_meter_values_at,
+    get_meter_values_from_pack, get_meter_values_from_ring)
+from ._scheduler import Scheduler
 
 __all__ = [
     'MeterImageData',
+    'Scheduler',
     'get_meter_values',
+    'get_meter_values_at',
+    'get_meter_values_from_pack',
+    'get_meter_values_from_ring',
 ]
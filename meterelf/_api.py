@@ -1,9 +1,20 @@
-from typing import Dict, Iterable, Iterator, NamedTuple, Optional
+from typing import (
+    TYPE_CHECKING, Callable, Collection, Dict, Iterable, Iterator, List,
+    NamedTuple, Optional, Tuple)
 
-from . import _debug, _params
-from ._image import ImageFile
-from ._reading import get_meter_value
-from .exceptions import ImageProcessingError
+from . import _debug, _metrics
+from .exceptions import FrameOverrunError, ImageProcessingError
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+    from datetime import datetime, timedelta
+
+    from ._calibration import IncrementalCalibrator
+    from ._frame_ring import Frame
+    from ._params import Params as _Params
+    from ._query import QueryResult
+    from ._sharding import Shard
+    from ._types import Image as _Image
 
 
 class MeterImageData(NamedTuple):
@@ -11,23 +22,370 @@ class MeterImageData(NamedTuple):
     value: Optional[float]
     error: Optional[ImageProcessingError]
     meter_values: Dict[str, float]
+    meter: Optional[str] = None
+    tier: Optional[int] = None
 
 
 def get_meter_values(
         params_file: str,
         filenames: Iterable[str],
+        calibrator: Optional['IncrementalCalibrator'] = None,
+        shard: Optional['Shard'] = None,
+        meter_workers: int = 1,
+        dials: Optional[Collection[str]] = None,
+) -> Iterator[MeterImageData]:
+    """
+    Get meter values from image files.
+
+    If the parameters file describes several meters, each image is
+    decoded once and a result is yielded for each meter in the order
+    of the parameters.  With `meter_workers` larger than one, the
+    meters of an image are processed concurrently in threads.
+
+    If `dials` is given, only the named dials are read, e.g. the finest
+    dial for detecting leaks.  The results then have the positions of
+    those dials in `meter_values`, but no value unless all dials were
+    given.  The angular velocity of the finest given dial since the
+    previous readable image is added to `meter_values` as
+    'angular_velocity' in degrees per second, using the timestamps in
+    the filenames.
+    """
+    from . import _filenames, _params  # Imported lazily for fast startup
+
+    meters = _params.load_meters(params_file)
+    tracker = _DialVelocityTracker(dials) if dials is not None else None
+
+    if shard is not None:
+        filenames = shard.filter(filenames)
+
+    with _MeterProcessor(
+            meters, calibrator, meter_workers, dials) as processor:
+        for filename in filenames:
+            results = processor.process(filename)
+            if tracker is not None:
+                tracker.add(results, _filenames.get_timestamp(filename))
+            yield from _record_results(results)
+
+
+def get_meter_values_from_ring(
+        params_file: str,
+        ring_file: str,
+        *,
+        follow: bool = False,
+        start_at: str = 'oldest',
+        calibrator: Optional['IncrementalCalibrator'] = None,
+        on_dropped: Optional[Callable[['Frame'], None]] = None,
+        meter_workers: int = 1,
+        dials: Optional[Collection[str]] = None,
+) -> Iterator[MeterImageData]:
+    """
+    Get meter values from the frames of a frame ring buffer file.
+
+    The frames are processed without copying or decoding them.  The
+    filename of the results is the name of the frame, which contains
+    the frame timestamp and sequence number.  Frames overwritten by the
+    writer while they are processed get a FrameOverrunError.  If
+    frames were lost before a frame, `on_dropped` is called with it.
+
+    Only the named `dials` are read, if given, as in `get_meter_values`.
+    The angular velocity is then calculated from the precise frame
+    timestamps, so that it is available also for frame rates above
+    one frame per second.
+    """
+    from datetime import datetime
+
+    from . import _params
+    from ._frame_ring import FrameRingReader
+
+    meters = _params.load_meters(params_file)
+    tracker = _DialVelocityTracker(dials) if dials is not None else None
+
+    with FrameRingReader(ring_file, start_at=start_at) as reader, \
+            _MeterProcessor(
+                meters, calibrator, meter_workers, dials) as processor:
+        for frame in reader.iter_frames(follow=follow):
+            if frame.dropped and on_dropped is not None:
+                on_dropped(frame)
+            results = processor.process(frame.name, frame.image)
+            if not reader.is_intact(frame):
+                results = [
+                    processor.make_error_result(
+                        frame.name, data.meter, FrameOverrunError(frame.name))
+                    for data in results]
+            if tracker is not None:
+                tracker.add(results, datetime.fromtimestamp(frame.timestamp))
+            yield from _record_results(results)
+
+
+def get_meter_values_from_pack(
+        params_file: str,
+        pack_file: str,
+        *,
+        start: Optional['datetime'] = None,
+        end: Optional['datetime'] = None,
+        calibrator: Optional['IncrementalCalibrator'] = None,
+        shard: Optional['Shard'] = None,
+        meter_workers: int = 1,
+        dials: Optional[Collection[str]] = None,
 ) -> Iterator[MeterImageData]:
-    params = _params.load(params_file)
+    """
+    Get meter values from the images of an image pack file.
+
+    The images are processed in the order they were added to the pack
+    and the filename of the results is the name of the entry.  Entries
+    outside the time range from `start` to `end` or outside the shard
+    are skipped without decoding them.  The other arguments are as in
+    `get_meter_values`.
+    """
+    from . import _params
+    from ._image_pack import ImagePackReader
+
+    meters = _params.load_meters(params_file)
+    tracker = _DialVelocityTracker(dials) if dials is not None else None
+
+    with ImagePackReader(pack_file) as reader, \
+            _MeterProcessor(
+                meters, calibrator, meter_workers, dials) as processor:
+        for entry in reader.iter_entries(start, end):
+            if shard is not None and not shard.contains(entry.name):
+                continue
+            results = processor.process(
+                entry.name, loader=lambda: reader.load_image(entry))
+            if tracker is not None:
+                tracker.add(results, entry.timestamp)
+            yield from _record_results(results)
+
+
+def get_meter_values_at(
+        params_file: str,
+        target_times: Iterable['datetime'],
+        *,
+        filenames: Optional[Iterable[str]] = None,
+        meter: Optional[str] = None,
+        interpolate: bool = False,
+        max_distance: Optional['timedelta'] = None,
+        max_tries: int = 10,
+) -> Iterator['QueryResult']:
+    """
+    Get meter values at target times reading only the needed images.
 
-    for filename in filenames:
+    The image files, which default to the files matching the image_glob
+    of the parameters, are indexed by the timestamps in their names.
+    For each target time the nearest image is read, or if that fails,
+    its neighbours in the order of their distance to the target.  With
+    `interpolate` the value is interpolated between the nearest
+    readings before and after the target.
+    """
+    from . import _filenames, _params
+    from ._query import SparseQuery, TimeIndex
+
+    params = _params.load(params_file, meter)
+    if filenames is None:
+        filenames = _filenames.scan_image_files(params.image_glob)
+
+    with _MeterProcessor([params], None, 1) as processor:
+        query = SparseQuery(
+            TimeIndex(filenames),
+            lambda filename: _record_results(processor.process(filename))[0],
+            interpolate=interpolate, max_distance=max_distance,
+            max_tries=max_tries)
+        for target in target_times:
+            yield query.query(target)
+
+
+def _record_results(results: List[MeterImageData]) -> List[MeterImageData]:
+    for data in results:
+        _metrics.record_result(data)
+    return results
+
+
+def get_angular_velocity(
+        position1: float,
+        position2: float,
+        seconds: float,
+) -> float:
+    """
+    Get angular velocity of a dial in degrees per second.
+
+    The positions are in the range from 0 to 10 and the needle is
+    assumed to have turned less than half a round between them.
+
+    >>> round(get_angular_velocity(2.0, 2.5, 2.0), 6)
+    9.0
+    >>> round(get_angular_velocity(9.5, 0.5, 1.0), 6)
+    36.0
+    >>> round(get_angular_velocity(0.5, 9.5, 4.0), 6)
+    -9.0
+    """
+    turns = ((position2 - position1) / 10.0 + 0.5) % 1.0 - 0.5
+    return turns * 360.0 / seconds
+
+
+class _DialVelocityTracker:
+    """
+    Tracker of the angular velocity of the finest dial of the meters.
+
+    The finest dial is the first of the dial names in sorted order, as
+    in `determine_value_by_dial_positions`.
+    """
+    def __init__(self, dial_names: Collection[str]) -> None:
+        self.dial = min(dial_names)
+        self._previous: Dict[Optional[str], Tuple['datetime', float]] = {}
+
+    def add(
+            self,
+            results: List[MeterImageData],
+            timestamp: Optional['datetime'],
+    ) -> None:
+        """
+        Add angular velocities to the meter values of the results.
+
+        The velocity is calculated from the previous readable result of
+        the same meter.  Results without a timestamp are skipped.
+        """
+        if timestamp is None:
+            return
+        for data in results:
+            position = data.meter_values.get(self.dial)
+            if position is None:
+                continue
+            previous = self._previous.get(data.meter)
+            self._previous[data.meter] = (timestamp, position)
+            if previous is None:
+                continue
+            seconds = (timestamp - previous[0]).total_seconds()
+            if seconds > 0:
+                data.meter_values['angular_velocity'] = get_angular_velocity(
+                    previous[1], position, seconds)
+
+
+class _MeterProcessor:
+    def __init__(
+            self,
+            meters: List['_Params'],
+            calibrator: Optional['IncrementalCalibrator'],
+            workers: int,
+            dial_names: Optional[Collection[str]] = None,
+    ) -> None:
+        if calibrator is not None and len(meters) > 1:
+            raise ValueError('Calibrator can be used only with one meter')
+        if dial_names is not None:
+            if not dial_names:
+                raise ValueError('No dials given')
+            for params in meters:
+                for name in dial_names:
+                    if name not in params.dial_centers:
+                        raise ValueError(f'Unknown dial: {name}')
+        self.meters = meters
+        self.calibrator = calibrator
+        self.dial_names = dial_names
+        self._executor: Optional['Executor'] = None
+        if workers > 1 and len(meters) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(workers)
+
+    def __enter__(self) -> '_MeterProcessor':
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def process(
+            self,
+            filename: str,
+            image: Optional['_Image'] = None,
+            loader: Optional[Callable[[], '_Image']] = None,
+    ) -> List[MeterImageData]:
+        """
+        Process all meters of an image.
+
+        The image is loaded from the file, or with the loader if given,
+        unless the image is given.
+        """
+        # Image processing modules import OpenCV and NumPy, which are
+        # slow to load, so defer importing them until there is an image
+        # to process.  After the first call these are just sys.modules
+        # lookups.
+        from ._image import crop_meter, load_image
+
+        _metrics.IMAGES.inc()
+        if image is None:
+            try:
+                with _metrics.STAGE_DURATION.time('load'):
+                    image = (
+                        loader() if loader is not None else
+                        load_image(filename))
+            except ImageProcessingError as error:
+                _debug.reraise_if_debug_on()
+                return [
+                    self.make_error_result(filename, params.name, error)
+                    for params in self.meters]
+
+        jobs = [
+            (filename, params, crop_meter(image, params))
+            for params in self.meters]
+        if self._executor is None:
+            return [self._process_meter(*job) for job in jobs]
+        futures = [self._executor.submit(self._process_meter, *job)
+                   for job in jobs]
+        return [future.result() for future in futures]
+
+    def make_error_result(
+            self,
+            filename: str,
+            meter: Optional[str],
+            error: ImageProcessingError,
+    ) -> MeterImageData:
+        return MeterImageData(filename, None, error, {}, meter)
+
+    def _process_meter(
+            self,
+            filename: str,
+            params: '_Params',
+            bgr_image: '_Image',
+    ) -> MeterImageData:
         meter_values: Dict[str, float] = {}
+        tier: Optional[int] = None
         error: Optional[ImageProcessingError] = None
-        imgf = ImageFile(filename, params)
         try:
-            meter_values = get_meter_value(imgf)
+            with _metrics.STAGE_DURATION.time('meter'):
+                (meter_values, tier) = _get_meter_value(
+                    filename, params, self.calibrator, bgr_image,
+                    self.dial_names)
         except ImageProcessingError as e:
             error = e
             _debug.reraise_if_debug_on()
 
         value = meter_values.get('value')
-        yield MeterImageData(filename, value, error, meter_values)
+        return MeterImageData(
+            filename, value, error, meter_values, params.name, tier)
+
+
+def _get_meter_value(
+        filename: str,
+        params: '_Params',
+        calibrator: Optional['IncrementalCalibrator'] = None,
+        bgr_image: Optional['_Image'] = None,
+        dial_names: Optional[Collection[str]] = None,
+) -> Tuple[Dict[str, float], Optional[int]]:
+    from ._image import ImageFile
+    from ._reading import get_meter_value
+
+    imgf = ImageFile(filename, params, bgr_image)
+    try:
+        meter_values = get_meter_value(imgf, dial_names=dial_names)
+    except ImageProcessingError as error:
+        # Feed also the images whose dials could not be read, since a
+        # drifted camera is a likely reason for that, but keep the
+        # reading error as the result
+        if calibrator is not None and imgf.dials_located:
+            try:
+                calibrator.add_image(imgf)
+            except Exception:
+                raise error
+        raise
+    else:
+        if calibrator is not None:
+            calibrator.add_image(imgf)
+    return (meter_values, imgf.reading_tier)
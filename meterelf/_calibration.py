@@ -1,16 +1,20 @@
 import glob
+import math
 import random
-from typing import Iterable, Iterator, List, Union
+from typing import (
+    Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional,
+    Union)
 
 import cv2
 
-from . import _debug
+from . import _debug, _debug_output
 from ._image import ImageFile
 from ._params import Params as _Params
 from ._types import DialCenter, Image
 from ._utils import (
     calculate_average_of_norm_images, convert_to_bgr, denormalize_image,
     get_mask_by_color, normalize_image)
+from .exceptions import ImageProcessingError
 
 
 def find_dial_centers(
@@ -42,8 +46,8 @@ def find_dial_centers_from_image(
         debug_img = convert_to_bgr(params, dials_hls)
         color_mask = cv2.merge((needles_mask, needles_mask, needles_mask * 0))
         debug_img = cv2.addWeighted(debug_img, 1, color_mask, 0.50, 0)
-        cv2.imshow('debug', debug_img)
-        cv2.waitKey(0)
+        _debug_output.show('debug', debug_img)
+        _debug_output.wait()
     (_bw, contours, _hier) = cv2.findContours(
         needles_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
     dial_centers = []
@@ -64,21 +68,135 @@ def get_average_meter_image(params: _Params, files: Iterable[str]) -> Image:
 
 
 def get_norm_images(params: _Params, files: Iterable[str]) -> Iterator[Image]:
-    return (
-        normalize_image(ImageFile(x, params).get_bgr_image_t())
-        for x in files)
+    """
+    Get normalized aligned images of the files.
+
+    Files whose dials cannot be located are skipped.
+    """
+    for filename in files:
+        try:
+            bgr_image_t = ImageFile(filename, params).get_bgr_image_t()
+        except ImageProcessingError:
+            continue
+        yield normalize_image(bgr_image_t)
 
 
 def get_image_filenames(params: _Params) -> List[str]:
-    return [
-        path for path in glob.glob(params.image_glob)
-        if all(bad_filename not in path for bad_filename in [
-                '20180814021309-01-e01.jpg',
-                '20180814021310-00-e02.jpg',
-        ])
-    ]
+    return glob.glob(params.image_glob)
 
 
 def get_needles_mask_by_color(params: _Params, hls_image: Image) -> Image:
     return get_mask_by_color(hls_image, params.needle_color,
                              params.needle_color_range)
+
+
+class DriftAlert(NamedTuple):
+    image_count: int
+    offsets: Dict[str, float]  # Distance moved by each dial center
+    proposed_centers: Dict[str, DialCenter]
+
+    def get_needle_data(self) -> List[Dict[str, Any]]:
+        """
+        Get proposed centers in the format of needle_data in params.
+        """
+        return [
+            {
+                'name': name,
+                'center': [round(x, 1) for x in dial_center.center],
+                'diameter': dial_center.diameter,
+            }
+            for (name, dial_center) in self.proposed_centers.items()]
+
+
+class IncrementalCalibrator:
+    """
+    Calibrator which estimates dial centers from a stream of images.
+
+    Keeps a running average of the aligned meter images and
+    re-estimates the dial centers from it after every
+    `update_interval` images.  When any of the centers has moved more
+    than `tolerance` pixels from the reference centers, a `DriftAlert`
+    is emitted and the proposed centers become the new reference.
+
+    The average is a plain mean of the first `window` images and after
+    that an exponentially weighted mean, which lets old images fade
+    out so that a nudged camera is eventually detected.
+    """
+    def __init__(
+            self,
+            *,
+            update_interval: int = 25,
+            tolerance: float = 2.0,
+            window: int = 100,
+            reference_centers: Optional[Dict[str, DialCenter]] = None,
+            on_drift: Optional[Callable[[DriftAlert], None]] = None,
+    ) -> None:
+        if update_interval < 1 or window < 1:
+            raise ValueError('Update interval and window must be positive')
+        self.update_interval = update_interval
+        self.tolerance = tolerance
+        self.window = window
+        self.reference_centers = reference_centers
+        self.on_drift = on_drift
+        self.image_count = 0
+        self._avg_image: Optional[Image] = None
+
+    def add_image(self, imgf: ImageFile) -> Optional[DriftAlert]:
+        if self.reference_centers is None:
+            self.reference_centers = dict(imgf.params.dial_centers)
+
+        norm_img = normalize_image(imgf.get_bgr_image_t())
+        self.image_count += 1
+        weight = max(1.0 / self.image_count, 1.0 / self.window)
+        if self._avg_image is None:
+            self._avg_image = norm_img
+        else:
+            self._avg_image = (
+                self._avg_image * (1.0 - weight) + norm_img * weight)
+
+        if self.image_count % self.update_interval != 0:
+            return None
+        return self.check_drift(imgf.params)
+
+    def check_drift(self, params: _Params) -> Optional[DriftAlert]:
+        assert self.reference_centers is not None
+        centers = self.estimate_dial_centers(params)
+        if centers is None:
+            return None
+
+        offsets = {
+            name: math.hypot(
+                centers[name].center[0] - reference.center[0],
+                centers[name].center[1] - reference.center[1])
+            for (name, reference) in self.reference_centers.items()}
+        if max(offsets.values()) <= self.tolerance:
+            return None
+
+        alert = DriftAlert(self.image_count, offsets, centers)
+        self.reference_centers = centers
+        if self.on_drift:
+            self.on_drift(alert)
+        return alert
+
+    def estimate_dial_centers(
+            self,
+            params: _Params,
+    ) -> Optional[Dict[str, DialCenter]]:
+        """
+        Estimate dial centers from the current average image.
+
+        Return None if there are no images yet or if the centers
+        cannot be reliably determined from the average image.
+        """
+        if self._avg_image is None or self.reference_centers is None:
+            return None
+        avg_meter = denormalize_image(self._avg_image)
+        try:
+            dial_centers = find_dial_centers_from_image(params, avg_meter)
+        except (ImageProcessingError, ValueError):
+            return None
+        if len(dial_centers) != len(self.reference_centers):
+            return None
+        reference = self.reference_centers
+        names = sorted(reference, key=(lambda x: reference[x].center[0]))
+        return dict(zip(names, dial_centers))
@@ -1,4 +1,6 @@
 import os
+import warnings
+from typing import Tuple
 
 DEBUG = {
     x for x in os.getenv('DEBUG', '').replace(',', ' ').split()
@@ -8,6 +10,48 @@ DEBUG = {
 if 'all' in DEBUG:
     DEBUG = {'masks'}
 
+# Directory to write the debug images to.  When set, the debug images
+# are written there from a background thread instead of showing them
+# with cv2.imshow.
+DEBUG_DIR = os.getenv('DEBUG_DIR') or None
+
+
+def parse_debug_sample(value: str) -> Tuple[float, bool]:
+    """
+    Parse the DEBUG_SAMPLE setting.
+
+    The setting is either a fraction of the images to sample, from 0
+    to 1, or "failures" to sample only the images which could not be
+    processed.  An invalid setting is warned about and all images are
+    sampled.
+
+    >>> parse_debug_sample('0.01')
+    (0.01, False)
+    >>> parse_debug_sample('failures')
+    (1.0, True)
+
+    :return: the sample rate and whether to sample only failures
+    """
+    if value == 'failures':
+        return (1.0, True)
+    try:
+        sample_rate = float(value)
+    except ValueError:
+        sample_rate = -1.0
+    if not 0.0 <= sample_rate <= 1.0:
+        warnings.warn(
+            f'Invalid DEBUG_SAMPLE {value!r}, sampling all images: '
+            f'Must be "failures" or a number from 0 to 1')
+        return (1.0, False)
+    return (sample_rate, False)
+
+
+# Which images to write to DEBUG_DIR: Either a fraction of the images
+# to sample (e.g. "0.01") or "failures" to write only the images which
+# could not be processed
+(DEBUG_SAMPLE_RATE, DEBUG_FAILURES_ONLY) = parse_debug_sample(
+    os.getenv('DEBUG_SAMPLE', '1'))
+
 
 def reraise_if_debug_on() -> None:
     if DEBUG:
@@ -0,0 +1,119 @@
+import atexit
+import os
+import queue
+import re
+import threading
+import zlib
+from typing import Optional, Tuple
+
+import cv2
+
+from . import _debug
+from ._types import Image
+from ._utils import scale_image
+
+_QueueItem = Optional[Tuple[str, Image, int]]
+
+
+class DebugImageSink:
+    """
+    Writer of debug images to a directory.
+
+    The images are written by a background thread, which is fed
+    through a bounded queue.  Submitting never blocks: If the queue is
+    full, the image is dropped and counted to `dropped_count`.
+
+    Only a `sample_rate` fraction of the processed images is annotated
+    and written, or if `failures_only` is set, only the images which
+    could not be processed.  The sampling is based on a hash of the
+    filename, so that the same images are picked on every run.
+    """
+    def __init__(
+            self,
+            directory: str,
+            *,
+            sample_rate: float = 1.0,
+            failures_only: bool = False,
+            queue_size: int = 32,
+    ) -> None:
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.failures_only = failures_only
+        self.dropped_count = 0
+        self._queue: 'queue.Queue[_QueueItem]' = queue.Queue(queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def wants_image(self, filename: str, failed: bool = False) -> bool:
+        if self.failures_only:
+            return failed
+        checksum = zlib.crc32(filename.encode('utf-8', 'surrogateescape'))
+        return checksum / 0xffffffff < self.sample_rate
+
+    def submit(self, name: str, image: Image, scale: int = 1) -> bool:
+        try:
+            self._queue.put_nowait((name, image.copy(), scale))
+        except queue.Full:
+            self.dropped_count += 1
+            return False
+        return True
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            (name, image, scale) = item
+            if scale != 1:
+                image = scale_image(image, scale)
+            basename = re.sub(r'[^\w.-]+', '_', name).strip('_') + '.png'
+            cv2.imwrite(os.path.join(self.directory, basename), image)
+
+
+_sink: Optional[DebugImageSink] = None
+
+
+def get_sink() -> Optional[DebugImageSink]:
+    global _sink
+    if _sink is None and _debug.DEBUG_DIR:
+        os.makedirs(_debug.DEBUG_DIR, exist_ok=True)
+        _sink = DebugImageSink(
+            _debug.DEBUG_DIR,
+            sample_rate=_debug.DEBUG_SAMPLE_RATE,
+            failures_only=_debug.DEBUG_FAILURES_ONLY)
+        atexit.register(_sink.close)
+    return _sink
+
+
+def wants_image(filename: str, failed: bool = False) -> bool:
+    """
+    Check if debug images should be generated for given image file.
+    """
+    sink = get_sink()
+    if sink is not None:
+        return sink.wants_image(filename, failed)
+    return bool(_debug.DEBUG) and not failed
+
+
+def show(name: str, image: Image, scale: int = 1) -> None:
+    """
+    Show a debug image or write it to the debug directory.
+    """
+    sink = get_sink()
+    if sink is not None:
+        sink.submit(name, image, scale)
+    else:
+        cv2.imshow(name, scale_image(image, scale) if scale != 1 else image)
+
+
+def wait() -> None:
+    """
+    Wait for a key press, if the debug images are shown interactively.
+    """
+    if get_sink() is None:
+        cv2.waitKey(0)
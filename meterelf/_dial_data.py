@@ -1,21 +1,26 @@
+import math
 from typing import Dict
+from weakref import WeakKeyDictionary
 
 import cv2
 import numpy
 
-from . import _debug
+from . import _debug, _debug_output
 from ._params import Params as _Params
-from ._types import DialData
-from ._utils import float_point_to_int
+from ._colors import HlsColor
+from ._types import DialData, FloatPoint, Image, PolarGrid, Rect
+from ._utils import crop_rect, float_point_to_int
 
-_dial_data_map: Dict[int, Dict[str, DialData]] = {}
+# Cached by the parameters object, which is not kept alive by the cache
+_dial_data_map: 'WeakKeyDictionary[_Params, Dict[str, DialData]]' = (
+    WeakKeyDictionary())
 
 
 def get_dial_data(params: _Params) -> Dict[str, DialData]:
-    dial_data = _dial_data_map.get(id(params))
+    dial_data = _dial_data_map.get(params)
     if dial_data is None:
         dial_data = _get_dial_data(params)
-        _dial_data_map[id(params)] = dial_data
+        _dial_data_map[params] = dial_data
     return dial_data
 
 
@@ -45,11 +50,53 @@ def _get_dial_data(params: _Params) -> Dict[str, DialData]:
 
         # Fill also the center circle in the mask image
         cv2.floodFill(mask, fill_mask, center, 255)
-        result[name] = DialData(name, dial_center.center, mask, circle_mask)
+        polar_grid = _make_polar_grid(
+            dial_center.center, start_radius + circle_thickness - 1,
+            circle_thickness, params.polar_angle_bins)
+        result[name] = DialData(
+            name, dial_center.center, mask, circle_mask, polar_grid)
 
         if 'masks' in _debug.DEBUG:
-            cv2.imshow('mask of ' + name, mask)
-            cv2.imshow('circle_mask of ' + name, circle_mask)
+            _debug_output.show('mask of ' + name, mask)
+            _debug_output.show('circle_mask of ' + name, circle_mask)
     if 'masks' in _debug.DEBUG:
-        cv2.waitKey(0)
+        _debug_output.wait()
     return result
+
+
+def get_dial_color(dials_hls: Image, dial_data: DialData) -> HlsColor:
+    (c_x, c_y) = dial_data.center
+    (x, y) = (int(c_x), int(c_y))
+    dial_core = crop_rect(dials_hls, Rect((x - 2, y - 2), (x + 3, y + 3)))
+    mean_color = cv2.mean(dial_core)
+    (h, l, s) = mean_color[0:3]  # type: ignore
+    return HlsColor(int(round(h)), int(round(l)), int(round(s)))
+
+
+def _make_polar_grid(
+        center: FloatPoint,
+        outer_radius: int,
+        ring_thickness: int,
+        angle_bins: int,
+) -> PolarGrid:
+    """
+    Make grid for unwrapping a dial to polar coordinates.
+
+    The rows of the grid are the radii from 1 to the outer radius of
+    the needle circle and the columns are the angles, starting from
+    the top and going clockwise, like in `get_angle_by_vector`.
+    """
+    radii = numpy.arange(1, outer_radius + 1, dtype=numpy.float32)
+    angles = numpy.arange(angle_bins) * (2 * math.pi / angle_bins)
+    dx = radii[:, None] * numpy.sin(angles)[None, :]
+    dy = -radii[:, None] * numpy.cos(angles)[None, :]
+    remap = numpy.dstack([center[0] + dx, center[1] + dy])
+    # A sample represents an area proportional to its radius
+    area = radii[:, None]
+    ring_weights = dx**2 + dy**2
+    ring_weights[:-ring_thickness] = 0
+    return PolarGrid(
+        remap.astype(numpy.float32),
+        (area * numpy.sign(dx) * dx**2).astype(numpy.float32),
+        (area * numpy.sign(dy) * dy**2).astype(numpy.float32),
+        ring_weights.astype(numpy.float32))
@@ -0,0 +1,172 @@
+"""
+Fast first tier of the tiered dial reading.
+
+The needle angles are estimated with vectorized operations on the
+pixels of the dial areas, optionally from a downscaled dials image.
+Each estimate comes with an uncertainty and a confidence score, which
+are used to decide which dials have to be read again with the full
+method.  See `get_dial_positions_tiered` in the reading module.
+"""
+import math
+from typing import Collection, Dict, NamedTuple, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+import cv2
+import numpy
+
+from ._colors import HlsColor
+from ._dial_data import get_dial_color, get_dial_data
+from ._params import Params as _Params
+from ._types import Image
+
+# Number of needle points on the ring at which the point count score
+# is at the default acceptance limit of 0.5
+MIN_POINTS = 5
+
+# Uncertainties (in dial units from 0 to 10) at which the precision
+# score is at the default acceptance limit of 0.5.  The position of the
+# finest dial is part of the meter value and must be as precise as the
+# printed value, but for the other dials it is enough to get the digit
+# right.
+MAX_UNCERTAINTY_FINEST = 0.05
+MAX_UNCERTAINTY = 0.25
+
+
+class FastDialReading(NamedTuple):
+    position: float
+    uncertainty: float
+    point_count: int
+    confidence: float
+
+
+class _FastDialData(NamedTuple):
+    # Pixel coordinates of the dial area in the (scaled) dials image
+    ys: numpy.ndarray
+    xs: numpy.ndarray
+    # Offsets of the pixels from the dial center in unscaled pixels
+    dx: numpy.ndarray
+    dy: numpy.ndarray
+    # Which pixels are on the needle circle and their angles (0 to 1)
+    on_ring: numpy.ndarray
+    angles: numpy.ndarray
+
+
+def get_fast_dial_readings(
+        params: _Params,
+        dials_hls: Image,
+        dial_names: Optional[Collection[str]] = None,
+) -> Dict[str, FastDialReading]:
+    """
+    Estimate the dial positions with the fast method.
+
+    Only the dials of `dial_names` are read, if given.  Dials without
+    any needle points on the needle circle are left out of the result.
+    """
+    scale = params.fast_reading_scale
+    scaled = _scale_down(dials_hls, scale)
+    finest_dial = min(params.dial_centers)
+    dial_data_map = get_dial_data(params)
+    result = {}
+    for (name, data) in _get_fast_dial_data(params).items():
+        if dial_names is not None and name not in dial_names:
+            continue
+        max_uncertainty = (
+            MAX_UNCERTAINTY_FINEST if name == finest_dial else
+            MAX_UNCERTAINTY)
+        dial_color = get_dial_color(dials_hls, dial_data_map[name])
+        reading = _read_dial(params, name, data, dial_color, scaled)
+        if reading is not None:
+            (position, uncertainty, point_count) = reading
+            count_score = 0.5 * point_count / MIN_POINTS
+            precision_score = 1.0 - 0.5 * uncertainty / max_uncertainty
+            confidence = max(min(count_score, precision_score, 1.0), 0.0)
+            result[name] = FastDialReading(
+                position, uncertainty, point_count, confidence)
+    return result
+
+
+def _read_dial(
+        params: _Params,
+        name: str,
+        data: _FastDialData,
+        dial_color: HlsColor,
+        scaled: Image,
+) -> Optional[Tuple[float, float, int]]:
+    (color_min, color_max) = dial_color.get_range(
+        params.dial_color_range[name])
+    pixels = scaled[data.ys, data.xs]
+    is_needle = numpy.all((pixels >= color_min) & (pixels <= color_max), 1)
+
+    # Use the momentum of the needle points to find out which end of
+    # the needle is the tip, like in the full method
+    dx = data.dx[is_needle]
+    dy = data.dy[is_needle]
+    mom_sign = -1 if name in params.negative_momentum_dials else 1
+    momentum_x = mom_sign * float(numpy.sum(numpy.sign(dx) * dx**2))
+    momentum_y = mom_sign * float(numpy.sum(numpy.sign(dy) * dy**2))
+    if momentum_x == 0 and momentum_y == 0:
+        return None
+    momentum_angle = math.atan2(momentum_x, -momentum_y) / (2 * math.pi)
+
+    on_ring = is_needle & data.on_ring
+    # Angle differences to the momentum angle, wrapped to -0.5..0.5
+    diffs = (data.angles[on_ring] - momentum_angle + 0.5) % 1.0 - 0.5
+    near = numpy.abs(diffs) < 0.25
+    diffs = diffs[near]
+    if not len(diffs):
+        return None
+    weights = (data.dx[on_ring]**2 + data.dy[on_ring]**2)[near]
+    weight_sum = float(numpy.sum(weights))
+    mean_diff = float(numpy.sum(weights * diffs)) / weight_sum
+    spread = math.sqrt(
+        float(numpy.sum(weights * (diffs - mean_diff)**2)) / weight_sum)
+
+    angle = momentum_angle + mean_diff
+    fixed_angle = angle - (params.needle_angles_of_zero[name] / 360.0)
+    position = (10.0 * fixed_angle) % 10.0
+    # The spread of the angles underestimates the error of downscaled
+    # images, since a scaled pixel covers a larger sector of the circle
+    scale = params.fast_reading_scale
+    uncertainty = 10.0 * scale * spread / math.sqrt(len(diffs))
+    return (position, uncertainty, len(diffs))
+
+
+def _scale_down(image: Image, scale: int) -> Image:
+    if scale == 1:
+        return image
+    (h, w) = image.shape[0:2]
+    return cv2.resize(
+        image, (w // scale, h // scale), interpolation=cv2.INTER_AREA)
+
+
+_fast_dial_data_map: (
+    'WeakKeyDictionary[_Params, Dict[str, _FastDialData]]') = (
+        WeakKeyDictionary())
+
+
+def _get_fast_dial_data(params: _Params) -> Dict[str, _FastDialData]:
+    fast_dial_data = _fast_dial_data_map.get(params)
+    if fast_dial_data is None:
+        fast_dial_data = {
+            name: _make_fast_dial_data(
+                dial_data.center, dial_data.mask, dial_data.circle_mask,
+                params.fast_reading_scale)
+            for (name, dial_data) in get_dial_data(params).items()}
+        _fast_dial_data_map[params] = fast_dial_data
+    return fast_dial_data
+
+
+def _make_fast_dial_data(
+        center: Tuple[float, float],
+        mask: Image,
+        circle_mask: Image,
+        scale: int,
+) -> _FastDialData:
+    scaled_mask = _scale_down(mask, scale) >= 128
+    scaled_circle_mask = _scale_down(circle_mask, scale) >= 128
+    (ys, xs) = numpy.nonzero(scaled_mask)
+    # Centers of the scaled pixels in the unscaled coordinates
+    dx = (xs + 0.5) * scale - 0.5 - center[0]
+    dy = (ys + 0.5) * scale - 0.5 - center[1]
+    angles = (numpy.arctan2(dx, -dy) / (2 * math.pi)) % 1.0
+    return _FastDialData(ys, xs, dx, dy, scaled_circle_mask[ys, xs], angles)
@@ -0,0 +1,133 @@
+import fnmatch
+import glob
+import os
+import re
+from datetime import datetime
+from typing import Iterable, Iterator, Optional, TextIO, Tuple
+
+# Matches timestamps of filenames like "20180814021357-00-e01.jpg" or
+# "20181001_005430-01-e255.jpg"
+_TIMESTAMP_RE = re.compile(r'^(\d{8})_?(\d{6})')
+
+_TIME_ARG_FORMATS = [
+    '%Y-%m-%d',
+    '%Y-%m-%dT%H:%M',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y%m%d',
+    '%Y%m%d%H%M%S',
+]
+
+
+def get_timestamp(filename: str) -> Optional[datetime]:
+    """
+    Get timestamp embedded in the name of an image file.
+
+    >>> get_timestamp('images/20180814021357-00-e01.jpg')
+    datetime.datetime(2018, 8, 14, 2, 13, 57)
+    >>> get_timestamp('20181001_005430-01-e255.jpg')
+    datetime.datetime(2018, 10, 1, 0, 54, 30)
+    >>> get_timestamp('dials_gray.png') is None
+    True
+    """
+    match = _TIMESTAMP_RE.match(os.path.basename(filename))
+    if not match:
+        return None
+    try:
+        return datetime.strptime(''.join(match.groups()), '%Y%m%d%H%M%S')
+    except ValueError:
+        return None
+
+
+def parse_time(text: str) -> datetime:
+    """
+    Parse time given on the command line.
+
+    >>> parse_time('2018-08-14')
+    datetime.datetime(2018, 8, 14, 0, 0)
+    >>> parse_time('2018-08-14T02:13')
+    datetime.datetime(2018, 8, 14, 2, 13)
+    >>> parse_time('20180814021357')
+    datetime.datetime(2018, 8, 14, 2, 13, 57)
+    """
+    for time_format in _TIME_ARG_FORMATS:
+        try:
+            return datetime.strptime(text, time_format)
+        except ValueError:
+            pass
+    raise ValueError(f'Invalid time: {text}')
+
+
+def read_filenames(fp: TextIO) -> Iterator[str]:
+    """
+    Read filenames from a file with one filename per line.
+    """
+    for line in fp:
+        filename = line.rstrip('\r\n')
+        if filename:
+            yield filename
+
+
+def scan_image_files(
+        image_glob: str,
+        *,
+        sort_by_time: bool = False,
+) -> Iterator[str]:
+    """
+    Scan the files matching given glob.
+
+    The files are yielded while scanning, unless sorting is requested,
+    in which case the filenames are collected and sorted by the
+    timestamps in their names first.  Files without a timestamp are
+    sorted last.
+    """
+    filenames = _scan(image_glob)
+    if not sort_by_time:
+        return filenames
+    return iter(sorted(filenames, key=_get_time_sort_key))
+
+
+def _get_time_sort_key(filename: str) -> Tuple[bool, datetime, str]:
+    timestamp = get_timestamp(filename)
+    return (timestamp is None, timestamp or datetime.min, filename)
+
+
+def _scan(image_glob: str) -> Iterator[str]:
+    (directory, pattern) = os.path.split(image_glob)
+    if glob.has_magic(directory):
+        yield from glob.iglob(image_glob)
+        return
+    include_hidden = pattern.startswith('.')
+    with os.scandir(directory or os.curdir) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') and not include_hidden:
+                continue
+            if fnmatch.fnmatch(entry.name, pattern) and entry.is_file():
+                yield os.path.join(directory, entry.name)
+
+
+def filter_by_time(
+        filenames: Iterable[str],
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+) -> Iterator[str]:
+    """
+    Filter filenames by the timestamps in their names.
+
+    Files with a timestamp earlier than start or later than or equal
+    to end are dropped.  Files without a timestamp are dropped when
+    either of the limits is given.
+    """
+    for filename in filenames:
+        if start is None and end is None:
+            yield filename
+            continue
+        timestamp = get_timestamp(filename)
+        if timestamp is None:
+            continue
+        if start is not None and timestamp < start:
+            continue
+        if end is not None and timestamp >= end:
+            continue
+        yield filename
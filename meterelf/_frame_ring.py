@@ -0,0 +1,280 @@
+"""
+Memory-mapped ring buffer of raw BGR frames.
+
+A capture process writes frames to a ring buffer file with
+`FrameRingWriter` and a reader process consumes them with
+`FrameRingReader` as NumPy views to the mapped file, without copying or
+decoding.
+
+The file starts with a header describing the frame geometry, the
+number of slots and the sequence number of the last written frame.  It
+is followed by the slots, each having a small header with a sequence
+number and a timestamp, and the pixel data.  The sequence number of a
+slot is written twice, before and after the pixel data, so that the
+reader can detect frames which are being written or have been
+overwritten.
+"""
+import mmap
+import os
+import struct
+import time
+from datetime import datetime
+from typing import Iterator, NamedTuple, Optional, Tuple, TypeVar
+
+import numpy
+
+from ._types import Image
+
+MAGIC = b'MEFRING\0'
+VERSION = 1
+
+# magic, version, width, height, channels, slot count, slot size
+_FILE_HEADER = struct.Struct('<8sIIIIIQ')
+_LAST_SEQUENCE_OFFSET = 40
+_FILE_HEADER_SIZE = 64
+
+# sequence at start of write, timestamp, sequence at end of write
+_SLOT_HEADER = struct.Struct('<QdQ')
+_SLOT_END_SEQUENCE_OFFSET = 16
+_SLOT_HEADER_SIZE = 64
+
+_ALIGNMENT = 64
+
+_SEQUENCE = struct.Struct('<Q')
+
+_R = TypeVar('_R', bound='_FrameRing')
+
+
+class RingFormatError(Exception):
+    pass
+
+
+class Frame(NamedTuple):
+    sequence: int
+    timestamp: float
+    image: Image
+    dropped: int  # Number of frames lost just before this frame
+
+    @property
+    def name(self) -> str:
+        """
+        Name of the frame with a timestamp like in image filenames.
+        """
+        time_str = datetime.fromtimestamp(self.timestamp).strftime(
+            '%Y%m%d%H%M%S')
+        return f'{time_str}-frame{self.sequence:010d}'
+
+
+class _RingGeometry(NamedTuple):
+    width: int
+    height: int
+    channels: int
+    slot_count: int
+    slot_size: int
+
+    @property
+    def frame_shape(self) -> Tuple[int, int, int]:
+        return (self.height, self.width, self.channels)
+
+    @property
+    def frame_size(self) -> int:
+        return self.width * self.height * self.channels
+
+    @property
+    def file_size(self) -> int:
+        return _FILE_HEADER_SIZE + self.slot_count * self.slot_size
+
+    def get_slot_offset(self, sequence: int) -> int:
+        slot = (sequence - 1) % self.slot_count
+        return _FILE_HEADER_SIZE + slot * self.slot_size
+
+
+class _FrameRing:
+    def __init__(self, filename: str, writable: bool) -> None:
+        self.filename = filename
+        mode = 'r+b' if writable else 'rb'
+        with open(filename, mode) as fp:
+            header = fp.read(_FILE_HEADER.size)
+            if len(header) < _FILE_HEADER.size:
+                raise RingFormatError(f'Not a frame ring file: {filename}')
+            (magic, version, *geometry_values) = _FILE_HEADER.unpack(header)
+            if magic != MAGIC:
+                raise RingFormatError(f'Not a frame ring file: {filename}')
+            if version != VERSION:
+                raise RingFormatError(
+                    f'Unsupported frame ring version {version}: {filename}')
+            self.geometry = _RingGeometry(*geometry_values)
+            if os.fstat(fp.fileno()).st_size < self.geometry.file_size:
+                raise RingFormatError(f'Truncated frame ring: {filename}')
+            access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+            self._mmap = mmap.mmap(
+                fp.fileno(), self.geometry.file_size, access=access)
+
+    def close(self) -> None:
+        try:
+            self._mmap.close()
+        except BufferError:
+            # There are still frames referring to the mapping, so it
+            # is unmapped only when they are garbage collected
+            pass
+
+    def __enter__(self: _R) -> _R:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def get_last_sequence(self) -> int:
+        return int(_SEQUENCE.unpack_from(self._mmap, _LAST_SEQUENCE_OFFSET)[0])
+
+    def _get_slot_header(self, sequence: int) -> Tuple[int, float, int]:
+        offset = self.geometry.get_slot_offset(sequence)
+        return _SLOT_HEADER.unpack_from(self._mmap, offset)
+
+    def _get_frame_view(self, sequence: int) -> Image:
+        offset = self.geometry.get_slot_offset(sequence) + _SLOT_HEADER_SIZE
+        data: Image = numpy.frombuffer(
+            self._mmap, dtype=numpy.uint8, count=self.geometry.frame_size,
+            offset=offset)
+        return data.reshape(self.geometry.frame_shape)
+
+
+class FrameRingWriter(_FrameRing):
+    """
+    Writer of frames to a ring buffer file.
+
+    Only a single writer may write to a ring at a time.
+    """
+    def __init__(self, filename: str) -> None:
+        super().__init__(filename, writable=True)
+        self._last_sequence = self.get_last_sequence()
+
+    @classmethod
+    def create(
+            cls,
+            filename: str,
+            width: int,
+            height: int,
+            slot_count: int,
+            channels: int = 3,
+    ) -> 'FrameRingWriter':
+        """
+        Create a new ring buffer file, replacing an existing one.
+        """
+        if min(width, height, slot_count, channels) < 1:
+            raise ValueError('Invalid frame ring geometry')
+        frame_size = width * height * channels
+        slot_size = _SLOT_HEADER_SIZE + _align(frame_size)
+        header = _FILE_HEADER.pack(
+            MAGIC, VERSION, width, height, channels, slot_count, slot_size)
+        with open(filename, 'wb') as fp:
+            fp.write(header)
+            fp.truncate(_FILE_HEADER_SIZE + slot_count * slot_size)
+        return cls(filename)
+
+    def write(self, image: Image, timestamp: Optional[float] = None) -> int:
+        """
+        Write a frame to the next slot.
+
+        :return: sequence number of the written frame
+        """
+        if image.shape != self.geometry.frame_shape:
+            raise ValueError('Frame shape {} does not match ring {}'.format(
+                image.shape, self.geometry.frame_shape))
+        sequence = self._last_sequence + 1
+        offset = self.geometry.get_slot_offset(sequence)
+        if timestamp is None:
+            timestamp = time.time()
+        _SLOT_HEADER.pack_into(self._mmap, offset, sequence, timestamp, 0)
+        numpy.copyto(self._get_frame_view(sequence), image, casting='no')
+        _SEQUENCE.pack_into(
+            self._mmap, offset + _SLOT_END_SEQUENCE_OFFSET, sequence)
+        _SEQUENCE.pack_into(self._mmap, _LAST_SEQUENCE_OFFSET, sequence)
+        self._last_sequence = sequence
+        return sequence
+
+
+class FrameRingReader(_FrameRing):
+    """
+    Reader of frames from a ring buffer file.
+
+    The frames are returned as read-only views to the mapped file, so
+    the writer may overwrite a frame while it is being processed, if
+    the reader falls more than the slot count behind.  Use `is_intact`
+    after processing a frame to check that it was not overwritten.
+    Frames which were overwritten before they could be read are
+    skipped and counted to `dropped_count`.
+    """
+    def __init__(self, filename: str, *, start_at: str = 'oldest') -> None:
+        super().__init__(filename, writable=False)
+        if start_at not in ('oldest', 'latest'):
+            raise ValueError(f'Invalid start position: {start_at}')
+        last_sequence = self.get_last_sequence()
+        if start_at == 'latest':
+            self._next_sequence = max(last_sequence, 1)
+        else:
+            oldest = last_sequence - self.geometry.slot_count + 1
+            self._next_sequence = max(oldest, 1)
+        self.dropped_count = 0
+        self._unreported_drops = 0
+
+    def read(self) -> Optional[Frame]:
+        """
+        Read the next frame, or return None if there is no new frame.
+        """
+        while True:
+            last_sequence = self.get_last_sequence()
+            if self._next_sequence > last_sequence:
+                return None
+            oldest = last_sequence - self.geometry.slot_count + 1
+            if self._next_sequence < oldest:
+                self._drop(oldest - self._next_sequence)
+                self._next_sequence = oldest
+            sequence = self._next_sequence
+            self._next_sequence += 1
+            (start_seq, timestamp, end_seq) = self._get_slot_header(sequence)
+            if start_seq == end_seq == sequence:
+                image = self._get_frame_view(sequence)
+                dropped = self._unreported_drops
+                self._unreported_drops = 0
+                return Frame(sequence, timestamp, image, dropped)
+            # The writer has lapped the reader after the last sequence
+            # was read, so this frame is lost too
+            self._drop(1)
+
+    def _drop(self, count: int) -> None:
+        self.dropped_count += count
+        self._unreported_drops += count
+
+    def is_intact(self, frame: Frame) -> bool:
+        """
+        Check that a frame has not been overwritten since it was read.
+        """
+        (start_seq, _timestamp, _end_seq) = self._get_slot_header(
+            frame.sequence)
+        return start_seq == frame.sequence
+
+    def iter_frames(
+            self,
+            *,
+            follow: bool = False,
+            poll_interval: float = 0.01,
+    ) -> Iterator[Frame]:
+        """
+        Iterate the frames.
+
+        Without `follow` the iteration stops when there are no new
+        frames, otherwise new frames are waited for by polling.
+        """
+        while True:
+            frame = self.read()
+            if frame is not None:
+                yield frame
+            elif follow:
+                time.sleep(poll_interval)
+            else:
+                return
+
+
+def _align(size: int) -> int:
+    return (size + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
@@ -1,11 +1,14 @@
-from typing import Dict, Optional
+from typing import Optional, Tuple
+from weakref import WeakKeyDictionary
 
 import cv2
 import numpy
 
 from ._params import Params as _Params
+from ._template_matching import match_template
 from ._types import Image, TemplateMatchResult
-from ._utils import convert_to_hls, crop_rect, match_template
+from ._utils import convert_to_hls, crop_rect
+from ._workspace import Workspace, get_workspace
 from .exceptions import DialsNotFoundError, ImageLoadingError
 
 
@@ -19,22 +22,43 @@ class ImageFile:
         self.filename = filename
         self.params = params
         self.bgr_image = bgr_image
+        self._hls_image: Optional[Image] = None
+        # Workspace and use count of the buffer of the HLS image
+        self._hls_buffer_use: Optional[Tuple[Workspace, int]] = None
+        self._dials_match: Optional[TemplateMatchResult] = None
+        # Highest tier used by the last tiered reading of the image
+        self.reading_tier: Optional[int] = None
+
+    @property
+    def dials_located(self) -> bool:
+        return self._dials_match is not None
 
     def get_dials_hls(self) -> Image:
         hls_image = self.get_hls_image()
-        match_result = self._find_dials(hls_image)
+        match_result = self._get_dials_match()
         dials_hls = crop_rect(hls_image, match_result.rect)
         return dials_hls
 
     def get_hls_image(self) -> Image:
-        bgr_image = self.get_bgr_image()
-        hls_image = convert_to_hls(bgr_image, self.params.hue_shift)
-        return hls_image
+        """
+        Get the HLS image of the meter.
+
+        The image is stored in a workspace buffer, so it is converted
+        again if the buffer has been used for another image since.
+        """
+        workspace = get_workspace(self.params)
+        buffer_use = (workspace, workspace.get_use_count('hls'))
+        if self._hls_image is None or self._hls_buffer_use != buffer_use:
+            bgr_image = self.get_bgr_image()
+            buffer = workspace.get('hls', bgr_image.shape[0:2], 3)
+            self._hls_image = convert_to_hls(
+                bgr_image, self.params.hue_shift, buffer)
+            self._hls_buffer_use = (workspace, workspace.get_use_count('hls'))
+        return self._hls_image
 
     def get_bgr_image_t(self) -> Image:
         bgr_image = self.get_bgr_image()
-        hls_image = convert_to_hls(bgr_image, self.params.hue_shift)
-        dials = self._find_dials(hls_image)
+        dials = self._get_dials_match()
         tl = dials.rect.top_left
         m = numpy.array([
             [1, 0, 30 - tl[0]],
@@ -46,18 +70,17 @@ class ImageFile:
     def get_bgr_image(self) -> Image:
         if self.bgr_image is not None:
             return self.bgr_image
-        img = cv2.imread(self.filename)
-        if img is None:
-            raise ImageLoadingError(self.filename)
-        return self._crop_meter(img)
+        img = load_image(self.filename)
+        self.bgr_image = crop_meter(img, self.params)
+        return self.bgr_image
 
-    def _crop_meter(self, img: Image) -> Image:
-        return crop_rect(img, self.params.meter_rect)
+    def _get_dials_match(self) -> TemplateMatchResult:
+        if self._dials_match is None:
+            self._dials_match = self._find_dials(self.get_hls_image())
+        return self._dials_match
 
     def _find_dials(self, img_hls: Image) -> TemplateMatchResult:
-        template = _get_dials_template(self.params)
-        lightness = cv2.split(img_hls)[1]
-        match_result = match_template(lightness, template)
+        match_result = self.match_dials_template(img_hls)
 
         if match_result.max_val < self.params.dials_match_threshold:
             raise DialsNotFoundError(
@@ -65,17 +88,44 @@ class ImageFile:
 
         return match_result
 
+    def match_dials_template(
+            self,
+            img_hls: Optional[Image] = None,
+    ) -> TemplateMatchResult:
+        """
+        Match the dials template without checking the match threshold.
+        """
+        if img_hls is None:
+            img_hls = self.get_hls_image()
+        template = _get_dials_template(self.params)
+        lightness = cv2.extractChannel(
+            img_hls, 1, get_workspace(self.params).get(
+                'lightness', img_hls.shape[0:2]))
+        return match_template(lightness, template, self.params)
+
+
+def load_image(filename: str) -> Image:
+    img = cv2.imread(filename)
+    if img is None:
+        raise ImageLoadingError(filename)
+    return img
+
+
+def crop_meter(img: Image, params: _Params) -> Image:
+    return crop_rect(img, params.meter_rect)
+
 
-_dials_template_map: Dict[int, Image] = {}
+_dials_template_map: 'WeakKeyDictionary[_Params, Image]' = (
+    WeakKeyDictionary())
 
 
 def _get_dials_template(params: _Params) -> Image:
-    dials_template = _dials_template_map.get(id(params))
+    dials_template = _dials_template_map.get(params)
     if dials_template is None:
         dials_template = cv2.imread(params.dials_file, cv2.IMREAD_GRAYSCALE)
         if dials_template is None:
             raise IOError(
                 "Cannot read dials template: {}".format(params.dials_file))
-        _dials_template_map[id(params)] = dials_template
+        _dials_template_map[params] = dials_template
     assert dials_template.shape == params.dials_template_size
     return dials_template
@@ -0,0 +1,321 @@
+"""
+Packed archive of encoded images with a timestamp index.
+
+Reading a large archive of small image files is dominated by opening
+and reading each file, especially on networked storage.  An image pack
+stores the encoded images, e.g. JPEG, concatenated to a single file,
+from which `ImagePackReader` decodes them through a memory mapping
+without opening any other files.
+
+The file starts with a header pointing to the index, which is at the
+end of the file and lists the name, timestamp and location of each
+entry.  Each entry is stored as a record with a small header followed
+by the name and the encoded image.  New entries are appended by
+`ImagePackWriter` over the old index, after which a new index is
+written and the header is updated to point to it.  The header has a
+checksum of the index, so if appending is interrupted, the index is
+found to be invalid and the entries are recovered by scanning the
+records instead.
+"""
+import mmap
+import os
+import struct
+import zlib
+from datetime import datetime, timedelta
+from typing import IO, Iterable, Iterator, List, NamedTuple, Optional, TypeVar
+
+import cv2
+import numpy
+
+from ._filenames import get_timestamp
+from ._types import Image
+from .exceptions import ImageLoadingError
+
+MAGIC = b'MEFPACK\0'
+VERSION = 1
+
+# magic, version, entry count, index offset, index size, index checksum
+_FILE_HEADER = struct.Struct('<8sIIQQI')
+_FILE_HEADER_SIZE = 64
+
+# magic, timestamp, data size, name size
+_RECORD_HEADER = struct.Struct('<4sdIH')
+_RECORD_MAGIC = b'MEFE'
+
+# record offset, timestamp, data size, name size
+_INDEX_ENTRY = struct.Struct('<QdIH')
+
+_EPOCH = datetime(1970, 1, 1)
+
+_P = TypeVar('_P', bound='_ImagePack')
+
+
+class PackFormatError(Exception):
+    pass
+
+
+class PackEntry(NamedTuple):
+    name: str
+    timestamp: Optional[datetime]
+    offset: int  # Offset of the record in the file
+    size: int  # Size of the encoded image
+
+    @property
+    def data_offset(self) -> int:
+        return (
+            self.offset + _RECORD_HEADER.size + len(self.name.encode('utf-8')))
+
+
+class _ImagePack:
+    def __init__(self, filename: str, fp: IO[bytes]) -> None:
+        self.filename = filename
+        self._fp = fp
+        self.entries: List[PackEntry] = []
+        self.data_end = _FILE_HEADER_SIZE
+        self._load_entries()
+
+    def close(self) -> None:
+        self._fp.close()
+
+    def __enter__(self: _P) -> _P:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def _load_entries(self) -> None:
+        fp = self._fp
+        fp.seek(0)
+        header = fp.read(_FILE_HEADER.size)
+        if len(header) < _FILE_HEADER.size:
+            raise PackFormatError(f'Not an image pack file: {self.filename}')
+        (magic, version, count, index_offset, index_size, checksum) = (
+            _FILE_HEADER.unpack(header))
+        if magic != MAGIC:
+            raise PackFormatError(f'Not an image pack file: {self.filename}')
+        if version != VERSION:
+            raise PackFormatError(
+                f'Unsupported image pack version {version}: {self.filename}')
+        fp.seek(index_offset)
+        index = fp.read(index_size)
+        if len(index) == index_size and zlib.crc32(index) == checksum:
+            self.entries = list(_parse_index(index, count))
+            self.data_end = index_offset
+        else:
+            self._scan_records()
+
+    def _scan_records(self) -> None:
+        """
+        Recover the entries by scanning the records.
+
+        The scan stops at the first incomplete record, which is left
+        over from an interrupted append.
+        """
+        fp = self._fp
+        file_size = os.fstat(fp.fileno()).st_size
+        offset = _FILE_HEADER_SIZE
+        self.entries = []
+        while offset + _RECORD_HEADER.size <= file_size:
+            fp.seek(offset)
+            (magic, timestamp, size, name_size) = _RECORD_HEADER.unpack(
+                fp.read(_RECORD_HEADER.size))
+            end = offset + _RECORD_HEADER.size + name_size + size
+            if magic != _RECORD_MAGIC or end > file_size:
+                break
+            name = fp.read(name_size).decode('utf-8')
+            self.entries.append(
+                PackEntry(name, _to_datetime(timestamp), offset, size))
+            offset = end
+        self.data_end = offset
+
+
+class ImagePackWriter(_ImagePack):
+    """
+    Writer of images to a pack file.
+
+    An existing pack is appended to.  The new entries are readable
+    only after the writer is closed.  Only a single writer may write
+    to a pack at a time.
+    """
+    def __init__(self, filename: str) -> None:
+        if not os.path.exists(filename):
+            with open(filename, 'wb') as fp:
+                _write_header(fp, 0, _FILE_HEADER_SIZE, b'')
+        super().__init__(filename, open(filename, 'r+b'))
+        self._fp.seek(self.data_end)
+        self._fp.truncate()
+
+    def close(self) -> None:
+        if not self._fp.closed:
+            self._write_index()
+        super().close()
+
+    def add(
+            self,
+            name: str,
+            data: bytes,
+            timestamp: Optional[datetime] = None,
+    ) -> PackEntry:
+        """
+        Add an encoded image to the pack.
+        """
+        name_bytes = name.encode('utf-8')
+        entry = PackEntry(name, timestamp, self.data_end, len(data))
+        self._fp.seek(self.data_end)
+        self._fp.write(_RECORD_HEADER.pack(
+            _RECORD_MAGIC, _to_seconds(timestamp), len(data),
+            len(name_bytes)))
+        self._fp.write(name_bytes)
+        self._fp.write(data)
+        self.data_end = self._fp.tell()
+        self.entries.append(entry)
+        return entry
+
+    def add_file(self, filename: str) -> PackEntry:
+        """
+        Add an image file to the pack.
+
+        The entry is named by the base name of the file and gets the
+        timestamp in the name.
+        """
+        with open(filename, 'rb') as fp:
+            data = fp.read()
+        name = os.path.basename(filename)
+        return self.add(name, data, get_timestamp(name))
+
+    def _write_index(self) -> None:
+        index = b''.join(
+            _INDEX_ENTRY.pack(
+                entry.offset, _to_seconds(entry.timestamp), entry.size,
+                len(entry.name.encode('utf-8'))) + entry.name.encode('utf-8')
+            for entry in self.entries)
+        self._fp.seek(self.data_end)
+        self._fp.write(index)
+        self._fp.truncate()
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._fp.seek(0)
+        _write_header(self._fp, len(self.entries), self.data_end, index)
+        self._fp.flush()
+
+
+class ImagePackReader(_ImagePack):
+    """
+    Reader of images from a pack file.
+
+    The images are decoded directly from the memory mapped file.
+    """
+    def __init__(self, filename: str) -> None:
+        super().__init__(filename, open(filename, 'rb'))
+        self._mmap = mmap.mmap(
+            self._fp.fileno(), self.data_end, access=mmap.ACCESS_READ)
+
+    def close(self) -> None:
+        try:
+            self._mmap.close()
+        except BufferError:
+            # There is still an image view referring to the mapping,
+            # so it is unmapped when the view is garbage collected
+            pass
+        super().close()
+
+    def iter_entries(
+            self,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+    ) -> Iterator[PackEntry]:
+        """
+        Iterate the entries in the order they were added.
+
+        Entries with a timestamp earlier than start or later than or
+        equal to end are skipped.  Entries without a timestamp are
+        skipped when either of the limits is given.
+        """
+        for entry in self.entries:
+            if start is None and end is None:
+                yield entry
+                continue
+            if entry.timestamp is None:
+                continue
+            if start is not None and entry.timestamp < start:
+                continue
+            if end is not None and entry.timestamp >= end:
+                continue
+            yield entry
+
+    def get_data(self, entry: PackEntry) -> Image:
+        """
+        Get the encoded image of an entry as a view to the mapping.
+        """
+        data: Image = numpy.frombuffer(
+            self._mmap, dtype=numpy.uint8, count=entry.size,
+            offset=entry.data_offset)
+        return data
+
+    def load_image(self, entry: PackEntry) -> Image:
+        image = cv2.imdecode(self.get_data(entry), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ImageLoadingError(entry.name)
+        return image
+
+
+def pack_images(pack_file: str, filenames: Iterable[str]) -> int:
+    """
+    Append image files to a pack file, creating it if needed.
+
+    :return: number of images added
+    """
+    count = 0
+    with ImagePackWriter(pack_file) as writer:
+        for filename in filenames:
+            writer.add_file(filename)
+            count += 1
+    return count
+
+
+def _write_header(
+        fp: IO[bytes],
+        count: int,
+        index_offset: int,
+        index: bytes,
+) -> None:
+    header = _FILE_HEADER.pack(
+        MAGIC, VERSION, count, index_offset, len(index), zlib.crc32(index))
+    fp.write(header.ljust(_FILE_HEADER_SIZE, b'\0'))
+
+
+def _parse_index(index: bytes, count: int) -> Iterator[PackEntry]:
+    position = 0
+    for _i in range(count):
+        (offset, timestamp, size, name_size) = _INDEX_ENTRY.unpack_from(
+            index, position)
+        position += _INDEX_ENTRY.size
+        name = index[position:position + name_size].decode('utf-8')
+        position += name_size
+        yield PackEntry(name, _to_datetime(timestamp), offset, size)
+
+
+def _to_seconds(timestamp: Optional[datetime]) -> float:
+    """
+    Convert timestamp to seconds since epoch, or to NaN if missing.
+
+    >>> _to_seconds(datetime(2018, 8, 14, 2, 13, 57))
+    1534212837.0
+    """
+    if timestamp is None:
+        return float('nan')
+    return (timestamp - _EPOCH).total_seconds()
+
+
+def _to_datetime(seconds: float) -> Optional[datetime]:
+    """
+    Convert seconds since epoch to timestamp, or None if NaN.
+
+    >>> _to_datetime(1534212837.0)
+    datetime.datetime(2018, 8, 14, 2, 13, 57)
+    >>> _to_datetime(float('nan')) is None
+    True
+    """
+    if seconds != seconds:
+        return None
+    return _EPOCH + timedelta(seconds=seconds)
@@ -1,22 +1,608 @@
+import argparse
+import os
 import sys
-from typing import Sequence
+from datetime import datetime, timedelta
+from typing import (
+    TYPE_CHECKING, Iterable, Iterator, List, Optional, Sequence)
 
-from . import _debug
-from ._api import get_meter_values
+from . import _debug, _filenames, _metrics, _sharding
+from ._api import (
+    MeterImageData, get_meter_values, get_meter_values_at,
+    get_meter_values_from_pack, get_meter_values_from_ring)
+
+if TYPE_CHECKING:
+    from ._frame_ring import Frame as _Frame
+    from ._store import StoredReading as _StoredReading
+
+
+# Subcommands querying a readings store
+STORE_COMMANDS = ['readings', 'latest', 'consumption']
 
 
 def main(argv: Sequence[str] = sys.argv) -> None:
-    if len(argv) < 2:
-        raise SystemExit('Usage: {} PARAMETERS_FILE [IMAGE_FILE...]'.format(
-            argv[0] if argv else 'meterelf'))
-    params_file = argv[1]
-    filenames = argv[2:]
+    if len(argv) > 1 and argv[1] == 'merge':
+        return merge_main(argv)
+    if len(argv) > 1 and argv[1] == 'sweep':
+        return sweep_main(argv)
+    if len(argv) > 1 and argv[1] == 'query':
+        return query_main(argv)
+    if len(argv) > 1 and argv[1] == 'synth':
+        return synth_main(argv)
+    if len(argv) > 1 and argv[1] == 'pack':
+        return pack_main(argv)
+    if len(argv) > 1 and argv[1] in STORE_COMMANDS:
+        return store_main(argv)
+
+    args = parse_args(argv)
+
+    metrics_writer = None
+    metrics_server = None
+    if args.metrics_file:
+        metrics_writer = _metrics.MetricsFileWriter(
+            args.metrics_file, args.metrics_interval)
+        metrics_writer.start()
+    if args.metrics_port is not None:
+        metrics_server = _metrics.start_metrics_server(args.metrics_port)
+    try:
+        process_images(args)
+    finally:
+        if metrics_server is not None:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+        if metrics_writer is not None:
+            metrics_writer.stop()
+
+
+def process_images(args: argparse.Namespace) -> None:
+    if args.ring:
+        results = get_meter_values_from_ring(
+            args.params_file, args.ring, follow=args.follow,
+            on_dropped=_report_dropped_frames,
+            meter_workers=args.meter_workers, dials=args.dials)
+    elif args.pack:
+        results = get_meter_values_from_pack(
+            args.params_file, args.pack, start=args.start, end=args.end,
+            shard=args.shard, meter_workers=args.meter_workers,
+            dials=args.dials)
+    else:
+        filenames = _filenames.filter_by_time(
+            get_filenames(args), args.start, args.end)
+        results = get_meter_values(
+            args.params_file, filenames, shard=args.shard,
+            meter_workers=args.meter_workers, dials=args.dials)
+
+    if args.store:
+        from ._store import ReadingsStore
+
+        with ReadingsStore(args.store) as store:
+            output_results(
+                args, store.record(results, args.params_file))
+    else:
+        output_results(args, results)
+
+
+def output_results(
+        args: argparse.Namespace,
+        results: Iterable[MeterImageData],
+) -> None:
+    if args.output:
+        with open(args.output, 'wt') as fp:
+            _sharding.write_partial(
+                fp, results, args.shard, args.params_file)
+    else:
+        print_results(results, args.dials)
+
+
+def merge_main(argv: Sequence[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog=f'{argv[0]} merge',
+        description=(
+            'Merge partial result files of all shards and print the '
+            'results ordered by time.'))
+    parser.add_argument('partial_files', metavar='PARTIAL_FILE', nargs='+')
+    args = parser.parse_args(argv[2:])
+    try:
+        results = _sharding.merge_partials(args.partial_files)
+    except _sharding.MergeError as error:
+        for problem in error.problems:
+            print(f'Error: {problem}', file=sys.stderr)  # noqa
+        raise SystemExit(1)
+    print_results(results)
+
+
+def query_main(argv: Sequence[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog=f'{argv[0]} query',
+        description=(
+            'Print meter values at given times reading only the images '
+            'nearest to them.'))
+    parser.add_argument('params_file', metavar='PARAMETERS_FILE')
+    parser.add_argument(
+        '--at', type=_parse_time_arg, metavar='TIME', action='append',
+        default=[], help='target time; may be given several times')
+    parser.add_argument(
+        '--start', type=_parse_time_arg, metavar='TIME',
+        help='first target time of a series, used with --every')
+    parser.add_argument(
+        '--end', type=_parse_time_arg, metavar='TIME',
+        help='last target time of a series, used with --every')
+    parser.add_argument(
+        '--every', type=_parse_duration_arg, metavar='DURATION',
+        help='interval of the target times, e.g. "1d", "6h" or "15m"')
+    parser.add_argument(
+        '--interpolate', '-i', action='store_true',
+        help='interpolate between the readings around the target times')
+    parser.add_argument(
+        '--max-distance', type=_parse_duration_arg, metavar='DURATION',
+        help='do not use images farther than DURATION from the target')
+    parser.add_argument(
+        '--max-tries', type=int, default=10, metavar='N',
+        help='number of images to try per target (default: 10)')
+    parser.add_argument(
+        '--meter', metavar='NAME',
+        help='name of the meter, if the parameters have several')
+    args = parser.parse_args(argv[2:])
+    if args.every and not (args.start and args.end):
+        parser.error('argument --every: requires --start and --end')
+    if not args.at and not args.every:
+        parser.error('give target times with --at or --every')
+
+    from ._query import get_target_times
+
+    target_times = list(args.at)
+    if args.every:
+        target_times.extend(
+            get_target_times(args.start, args.end, args.every))
+    results = get_meter_values_at(
+        args.params_file, target_times, meter=args.meter,
+        interpolate=args.interpolate, max_distance=args.max_distance,
+        max_tries=args.max_tries)
+    for result in results:
+        time_str = result.target.strftime('%Y-%m-%d %H:%M:%S')
+        if result.value is None:
+            print(f'{time_str}: UNKNOWN No readable images')  # noqa
+            continue
+        sources = ' .. '.join(
+            os.path.basename(x.data.filename) for x in result.readings)
+        print(f'{time_str}: {result.value:07.3f} ({sources})')  # noqa
+
+
+def sweep_main(argv: Sequence[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog=f'{argv[0]} sweep',
+        description=(
+            'Read images with variants of the parameters, compare the '
+            'results to expected values and write the best parameters.'))
+    parser.add_argument('params_file', metavar='PARAMETERS_FILE')
+    parser.add_argument(
+        'expected_file', metavar='EXPECTED_FILE',
+        help='expected results of the images in the output format')
+    parser.add_argument(
+        '--vary', '-v', metavar='KEY=VALUES', action='append', default=[],
+        help=(
+            'values of a parameter to try, either comma separated or as '
+            'an inclusive range START:STOP:STEP; needle parameters are '
+            'given like needle_data/0.01/circle_thickness, where "*" as '
+            'the needle name changes all needles'))
+    parser.add_argument(
+        '--meter', metavar='NAME',
+        help='name of the meter, if the parameters have several')
+    parser.add_argument(
+        '--image-dir', metavar='DIR',
+        help='directory of the images (default: parameters directory)')
+    parser.add_argument(
+        '--cache', metavar='NPY_FILE',
+        help='cache the located dials to NPY_FILE and reuse them')
+    parser.add_argument(
+        '--random', type=int, metavar='N',
+        help='try N random combinations instead of all combinations')
+    parser.add_argument('--seed', type=int, help='seed of --random')
+    parser.add_argument(
+        '--workers', '-j', type=int, default=1, metavar='N',
+        help='evaluate the variants in N processes (default: 1)')
+    parser.add_argument(
+        '--top', type=int, default=3, metavar='K',
+        help='number of best parameter files to write (default: 3)')
+    parser.add_argument(
+        '--output-dir', '-o', metavar='DIR',
+        help='directory of the written parameter files (default: none)')
+    args = parser.parse_args(argv[2:])
+
+    from . import _sweep  # Imported lazily to keep the startup fast
+
+    try:
+        variations = [_sweep.Variation.parse(x) for x in args.vary]
+    except ValueError as error:
+        parser.error(f'argument --vary: {error}')
+    try:
+        results = _sweep.run_sweep(
+            args.params_file, args.expected_file, variations,
+            meter=args.meter, image_dir=args.image_dir,
+            cache_file=args.cache, random_count=args.random,
+            seed=args.seed, workers=args.workers)
+    except _sweep.SweepError as error:
+        print(f'Error: {error}', file=sys.stderr)  # noqa
+        raise SystemExit(1)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    for (rank, result) in enumerate(results[:args.top], 1):
+        filename = ''
+        if args.output_dir:
+            filename = os.path.join(args.output_dir, f'params-{rank}.yml')
+            _sweep.write_params_file(
+                filename, args.params_file, result.changes, args.meter)
+        print(f'{rank}: {result.matches}/{result.total} '  # noqa
+              f'error={result.error_sum:.3f} '
+              f'{result.describe_changes()}'
+              + (f' -> {filename}' if filename else ''))
+
+
+def synth_main(argv: Sequence[str]) -> None:
+    from . import _synthetic  # Imported lazily to keep the startup fast
+
+    defaults = _synthetic.Variation()
+    parser = argparse.ArgumentParser(
+        prog=f'{argv[0]} synth',
+        description=(
+            'Generate synthetic images of a meter with known values, '
+            'e.g. for benchmarks.  The ground truth is written to '
+            f'{_synthetic.EXPECTED_FILENAME} and matching parameters to '
+            f'{_synthetic.PARAMS_FILENAME} of the output directory.'))
+    parser.add_argument('params_file', metavar='PARAMETERS_FILE')
+    parser.add_argument('output_dir', metavar='OUTPUT_DIR')
+    parser.add_argument(
+        '--count', '-n', type=int, default=100, metavar='N',
+        help='number of images to generate (default: 100)')
+    parser.add_argument(
+        '--meter', metavar='NAME',
+        help='name of the meter, if the parameters have several')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='seed of the random values and variations (default: 0)')
+    parser.add_argument(
+        '--start', type=_parse_time_arg, metavar='TIME',
+        default=_synthetic.DEFAULT_START,
+        help='timestamp of the first image (default: 2018-01-01)')
+    parser.add_argument(
+        '--every', type=_parse_duration_arg, metavar='DURATION',
+        default=timedelta(minutes=1),
+        help='interval of the image timestamps (default: 1m)')
+    parser.add_argument(
+        '--workers', '-j', type=int, default=1, metavar='N',
+        help='generate the images in N processes (default: 1)')
+    parser.add_argument(
+        '--max-shift', type=int, default=defaults.max_shift, metavar='PX',
+        help=f'maximum offset of the dials (default: {defaults.max_shift})')
+    parser.add_argument(
+        '--max-lighting', type=float, default=defaults.max_lighting,
+        metavar='FRACTION', help=(
+            'maximum relative change of the brightness and of its '
+            f'gradient (default: {defaults.max_lighting})'))
+    parser.add_argument(
+        '--max-noise', type=float, default=defaults.max_noise,
+        metavar='STDDEV', help=(
+            'maximum standard deviation of the noise '
+            f'(default: {defaults.max_noise})'))
+    parser.add_argument(
+        '--max-blur', type=float, default=defaults.max_blur,
+        metavar='SIGMA', help=(
+            f'maximum sigma of the blur (default: {defaults.max_blur})'))
+    parser.add_argument(
+        '--min-quality', type=int, default=defaults.min_quality,
+        metavar='Q', help=(
+            f'lowest JPEG quality (default: {defaults.min_quality})'))
+    args = parser.parse_args(argv[2:])
+    if not 0 <= args.min_quality <= 100:
+        parser.error('argument --min-quality: must be from 0 to 100')
+
+    variation = _synthetic.Variation(
+        args.max_shift, args.max_lighting, args.max_noise, args.max_blur,
+        args.min_quality)
+    try:
+        images = list(_synthetic.generate_corpus(
+            args.params_file, args.output_dir, args.count, meter=args.meter,
+            seed=args.seed, start=args.start, interval=args.every,
+            variation=variation, workers=args.workers))
+    except ValueError as error:
+        print(f'Error: {error}', file=sys.stderr)  # noqa
+        raise SystemExit(1)
+    print(f'Generated {len(images)} images to {args.output_dir}')  # noqa
+
+
+def pack_main(argv: Sequence[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog=f'{argv[0]} pack',
+        description=(
+            'Pack image files to an image pack file, which can be '
+            'processed faster than the separate files with --pack.  An '
+            'existing pack file is appended to.'))
+    parser.add_argument('pack_file', metavar='PACK_FILE')
+    parser.add_argument('image_files', metavar='IMAGE_FILE', nargs='*')
+    parser.add_argument(
+        '--files-from', '-f', metavar='LIST_FILE', action='append',
+        default=[], help=(
+            'read names of image files from LIST_FILE, one per line; '
+            'use "-" to read them from standard input'))
+    args = parser.parse_args(argv[2:])
 
-    for data in get_meter_values(params_file, filenames):
+    from . import _image_pack  # Imported lazily to keep the startup fast
+
+    filenames = list(args.image_files)
+    for list_file in args.files_from:
+        filenames.extend(_read_list_file(list_file))
+    try:
+        count = _image_pack.pack_images(args.pack_file, filenames)
+    except (OSError, _image_pack.PackFormatError) as error:
+        print(f'Error: {error}', file=sys.stderr)  # noqa
+        raise SystemExit(1)
+    print(f'Packed {count} images to {args.pack_file}')  # noqa
+
+
+def store_main(argv: Sequence[str]) -> None:
+    command = argv[1]
+    descriptions = {
+        'readings': 'Print the stored readings of a time range.',
+        'latest': 'Print the latest stored reading with a value.',
+        'consumption': (
+            'Print consumption per interval calculated from the stored '
+            'readings.'),
+    }
+    parser = argparse.ArgumentParser(
+        prog=f'{argv[0]} {command}', description=descriptions[command])
+    parser.add_argument(
+        'store_file', metavar='STORE_FILE',
+        help='readings store written with --store')
+    parser.add_argument(
+        '--meter', metavar='NAME',
+        help='name of the meter, if the parameters have several')
+    if command in ('readings', 'consumption'):
+        required = (command == 'consumption')
+        parser.add_argument(
+            '--start', type=_parse_time_arg, metavar='TIME',
+            required=required, help='start of the time range')
+        parser.add_argument(
+            '--end', type=_parse_time_arg, metavar='TIME',
+            required=required, help=(
+                'end of the time range, exclusive for readings and '
+                'inclusive for consumption'))
+    if command == 'readings':
+        parser.add_argument(
+            '--valid-only', action='store_true',
+            help='print only readings with a value')
+    if command == 'consumption':
+        parser.add_argument(
+            '--every', type=_parse_duration_arg, metavar='DURATION',
+            required=True,
+            help='length of the intervals, e.g. "1d", "6h" or "15m"')
+    args = parser.parse_args(argv[2:])
+
+    from ._store import ReadingsStore, StoreError
+
+    try:
+        store = ReadingsStore(args.store_file)
+    except StoreError as error:
+        print(f'Error: {error}', file=sys.stderr)  # noqa
+        raise SystemExit(1)
+    with store:
+        if command == 'readings':
+            for reading in store.iter_range(
+                    args.start, args.end, args.meter,
+                    valid_only=args.valid_only):
+                _print_stored_reading(reading)
+        elif command == 'latest':
+            latest = store.get_latest(args.meter)
+            if latest is None:
+                print('No readings', file=sys.stderr)  # noqa
+                raise SystemExit(1)
+            _print_stored_reading(latest)
+        else:
+            for item in store.get_consumption(
+                    args.start, args.end, args.every, args.meter):
+                amount_str = (
+                    f'{item.amount:.3f}' if item.amount is not None
+                    else 'UNKNOWN Not enough readings')
+                print(f'{item.start:%Y-%m-%d %H:%M:%S} .. '  # noqa
+                      f'{item.end:%Y-%m-%d %H:%M:%S}: {amount_str}')
+
+
+def _print_stored_reading(reading: '_StoredReading') -> None:
+    assert reading.timestamp is not None
+    value_str = (
+        f'{reading.value:07.3f}' if reading.value is not None
+        else f'UNKNOWN {reading.error or "No value"}')
+    filename = os.path.basename(reading.filename)
+    print(f'{reading.timestamp:%Y-%m-%d %H:%M:%S}: '  # noqa
+          f'{value_str} ({filename})')
+
+
+def _report_dropped_frames(frame: '_Frame') -> None:
+    print(f'Dropped {frame.dropped} frames before {frame.name}',  # noqa
+          file=sys.stderr)
+
+
+def print_results(
+        results: Iterable[MeterImageData],
+        dials: Optional[Sequence[str]] = None,
+) -> None:
+    for data in results:
         print(data.filename, end='')  # noqa
+        if data.meter is not None:
+            print(f' [{data.meter}]', end='')  # noqa
         value_str = '{:07.3f}'.format(data.value) if data.value else ''
+        if dials and not data.error:
+            value_str = _format_dial_positions(data, dials)
         error_str = (
             'UNKNOWN {}'.format(data.error.get_message()) if data.error
             else '')
         extra = ' {!r}'.format(data.meter_values) if _debug.DEBUG else ''
         print(f': {value_str}{error_str}{extra}')  # noqa
+
+
+def _format_dial_positions(
+        data: MeterImageData,
+        dials: Sequence[str],
+) -> str:
+    """
+    Format positions of the read dials and the angular velocity.
+
+    >>> _format_dial_positions(MeterImageData('x.jpg', None, None, {
+    ...     '0.0001': 3.4561, '0.001': 7.0, 'angular_velocity': 12.5}),
+    ...     ['0.0001', '0.001'])
+    '0.0001=3.456 0.001=7.000 (+12.50 deg/s)'
+    """
+    parts = [f'{name}={data.meter_values[name]:.3f}' for name in dials]
+    velocity = data.meter_values.get('angular_velocity')
+    if velocity is not None:
+        parts.append(f'({velocity:+.2f} deg/s)')
+    return ' '.join(parts)
+
+
+def parse_args(argv: Sequence[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog=(argv[0] if argv else 'meterelf'),
+        description='Read values of dial meters from images.')
+    parser.add_argument('params_file', metavar='PARAMETERS_FILE')
+    parser.add_argument('image_files', metavar='IMAGE_FILE', nargs='*')
+    parser.add_argument(
+        '--files-from', '-f', metavar='LIST_FILE', action='append',
+        default=[], help=(
+            'read names of image files from LIST_FILE, one per line; '
+            'use "-" to read them from standard input'))
+    parser.add_argument(
+        '--scan', '-s', action='store_true',
+        help='process the files matching image_glob of the parameters')
+    parser.add_argument(
+        '--sort-by-time', '-t', action='store_true',
+        help='sort the scanned files by the timestamps in their names')
+    parser.add_argument(
+        '--start', type=_parse_time_arg, metavar='TIME',
+        help='skip files with a timestamp earlier than TIME')
+    parser.add_argument(
+        '--end', type=_parse_time_arg, metavar='TIME',
+        help='skip files with a timestamp later than or equal to TIME')
+    parser.add_argument(
+        '--ring', metavar='RING_FILE',
+        help=(
+            'process raw frames from a frame ring buffer file instead of '
+            'image files'))
+    parser.add_argument(
+        '--follow', action='store_true',
+        help='keep waiting for new frames to the ring buffer')
+    parser.add_argument(
+        '--pack', metavar='PACK_FILE',
+        help=(
+            'process the images of an image pack file instead of image '
+            'files; see the pack subcommand'))
+    parser.add_argument(
+        '--meter-workers', '-j', type=int, default=1, metavar='N',
+        help=(
+            'process the meters of an image in N threads, when the '
+            'parameters describe several meters (default: 1)'))
+    parser.add_argument(
+        '--dials', type=_parse_dials_arg, metavar='NAMES',
+        help=(
+            'read only the comma separated dials, e.g. the finest dial '
+            'to detect leaks, and print their positions and the angular '
+            'velocity of the finest of them'))
+    parser.add_argument(
+        '--shard', metavar='I/N',
+        help=(
+            'process only the I:th of N shards of the files, where I is '
+            'from 1 to N; see also the merge subcommand'))
+    parser.add_argument(
+        '--shard-by', choices=_sharding.SHARD_METHODS, default='hash',
+        help=(
+            'partition the files by a hash of their names or by splitting '
+            'the time range from --start to --end (default: hash)'))
+    parser.add_argument(
+        '--output', '-o', metavar='PARTIAL_FILE',
+        help=(
+            'write the results to a self-describing partial result file '
+            'instead of printing them'))
+    parser.add_argument(
+        '--store', metavar='STORE_FILE',
+        help=(
+            'record the results also to a readings store STORE_FILE; see '
+            'the readings, latest and consumption subcommands'))
+    parser.add_argument(
+        '--metrics-file', metavar='PROM_FILE',
+        help=(
+            'write runtime metrics in the Prometheus text format to '
+            'PROM_FILE periodically and at exit'))
+    parser.add_argument(
+        '--metrics-interval', type=float, default=15.0, metavar='SECONDS',
+        help='interval of writing the metrics file (default: 15)')
+    parser.add_argument(
+        '--metrics-port', type=int, metavar='PORT',
+        help='serve runtime metrics over HTTP on localhost port PORT')
+    args = parser.parse_args(argv[1:])
+    if args.ring and (
+            args.image_files or args.files_from or args.scan or args.shard):
+        parser.error('argument --ring: not allowed with image files')
+    if args.pack and (
+            args.image_files or args.files_from or args.scan or args.ring):
+        parser.error('argument --pack: not allowed with image files')
+    if args.follow and not args.ring:
+        parser.error('argument --follow: allowed only with --ring')
+    if args.shard is not None:
+        try:
+            args.shard = _sharding.Shard.parse(
+                args.shard, args.shard_by, args.start, args.end)
+        except ValueError as error:
+            parser.error(f'argument --shard: {error}')
+    if args.sort_by_time and not args.scan:
+        parser.error('argument --sort-by-time: allowed only with --scan')
+    args.meters = None
+    if args.scan or args.dials:
+        from . import _params  # Imported lazily to keep the startup fast
+
+        args.meters = _params.load_meters(args.params_file)
+    if args.dials:
+        unknown = [
+            name for name in args.dials
+            if any(name not in x.dial_centers for x in args.meters)]
+        if unknown:
+            parser.error(
+                f'argument --dials: unknown dials: {", ".join(unknown)}')
+    return args
+
+
+def _parse_time_arg(text: str) -> datetime:
+    try:
+        return _filenames.parse_time(text)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+def _parse_dials_arg(text: str) -> List[str]:
+    names = [x.strip() for x in text.split(',') if x.strip()]
+    if not names:
+        raise argparse.ArgumentTypeError('no dial names given')
+    return names
+
+
+def _parse_duration_arg(text: str) -> timedelta:
+    from ._query import parse_duration
+
+    try:
+        return parse_duration(text)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+def get_filenames(args: argparse.Namespace) -> Iterator[str]:
+    yield from args.image_files
+    for list_file in args.files_from:
+        yield from _read_list_file(list_file)
+    if args.scan:
+        yield from _filenames.scan_image_files(
+            args.meters[0].image_glob, sort_by_time=args.sort_by_time)
+
+
+def _read_list_file(filename: str) -> Iterator[str]:
+    if filename == '-':
+        yield from _filenames.read_filenames(sys.stdin)
+        return
+    with open(filename, 'rt') as fp:
+        yield from _filenames.read_filenames(fp)
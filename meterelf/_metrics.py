@@ -0,0 +1,421 @@
+"""
+Registry of runtime metrics with Prometheus text format export.
+
+The metrics are updated by the API while images are processed.  They
+can be written periodically to a file, e.g. for the textfile collector
+of the Prometheus node exporter, or served over HTTP on a local port.
+
+Updating a metric takes a lock and a dictionary update, so that the
+overhead is negligible compared to processing an image.  The updates
+of a thread can also be captured instead of applied, e.g. to leave out
+repeated work or to apply the updates of a worker process in the
+parent.
+"""
+import abc
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import (
+    TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple,
+    Type)
+
+if TYPE_CHECKING:
+    from http.server import HTTPServer
+    from types import TracebackType
+
+    from ._api import MeterImageData
+
+# Upper bounds of the latency histogram buckets in seconds
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+Labels = Tuple[str, ...]
+
+# Captured update: metric name, method ("inc", "set" or "observe"),
+# labels and value
+Update = Tuple[str, str, Labels, float]
+
+_local = threading.local()
+
+
+class _Metric(abc.ABC):
+    type_name = ''
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            label_names: Sequence[str] = (),
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.type_name}'
+        yield from self._render_samples()
+
+    @abc.abstractmethod
+    def _render_samples(self) -> Iterator[str]:
+        pass
+
+    def _capture(self, method: str, labels: Labels, value: float) -> bool:
+        """
+        Capture an update if capturing is on in this thread.
+
+        :return: whether the update was captured
+        """
+        updates: Optional[List[Update]] = getattr(_local, 'updates', None)
+        if updates is None:
+            return False
+        updates.append((self.name, method, labels, value))
+        return True
+
+    def _check_labels(self, labels: Labels) -> None:
+        if len(labels) != len(self.label_names):
+            raise ValueError('{} takes labels: {}'.format(
+                self.name, ', '.join(self.label_names)))
+
+    def _format_labels(self, labels: Labels, extra: str = '') -> str:
+        items = [
+            f'{name}="{_escape(value)}"'
+            for (name, value) in zip(self.label_names, labels)]
+        if extra:
+            items.append(extra)
+        return '{' + ','.join(items) + '}' if items else ''
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            label_names: Sequence[str] = (),
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._check_labels(labels)
+        if self._capture('inc', labels, amount):
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def _render_samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for (labels, value) in items:
+            yield f'{self.name}{self._format_labels(labels)} {value:g}'
+
+
+class Gauge(Counter):
+    """
+    Metric whose value can go up and down.
+    """
+    type_name = 'gauge'
+
+    def set(self, value: float, *labels: str) -> None:
+        self._check_labels(labels)
+        if self._capture('set', labels, value):
+            return
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            label_names: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Non-cumulative bucket counts, the last one for +Inf
+        self._counts: Dict[Labels, List[int]] = {}
+        self._sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        self._check_labels(labels)
+        if self._capture('observe', labels, value):
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(labels)
+            if counts is None:
+                counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self._sums[labels] = self._sums.get(labels, 0.0) + value
+
+    def time(self, *labels: str) -> '_Timer':
+        """
+        Get a context manager which observes its duration.
+        """
+        self._check_labels(labels)
+        return _Timer(self, labels)
+
+    def get_count(self, *labels: str) -> int:
+        return sum(self._counts.get(labels, []))
+
+    def _render_samples(self) -> Iterator[str]:
+        with self._lock:
+            items = sorted(
+                (labels, list(counts), self._sums[labels])
+                for (labels, counts) in self._counts.items())
+        for (labels, counts, total) in items:
+            cumulative = 0
+            bounds = [f'{x:g}' for x in self.buckets] + ['+Inf']
+            for (bound, count) in zip(bounds, counts):
+                cumulative += count
+                label_str = self._format_labels(labels, f'le="{bound}"')
+                yield f'{self.name}_bucket{label_str} {cumulative}'
+            label_str = self._format_labels(labels)
+            yield f'{self.name}_sum{label_str} {total:g}'
+            yield f'{self.name}_count{label_str} {cumulative}'
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Labels) -> None:
+        self._histogram = histogram
+        self._labels = labels
+        self._start = 0.0
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter()
+
+    def __exit__(
+            self,
+            exc_type: Optional[Type[BaseException]],
+            exc_value: Optional[BaseException],
+            traceback: Optional['TracebackType'],
+    ) -> None:
+        duration = time.perf_counter() - self._start
+        self._histogram.observe(duration, *self._labels)
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def counter(
+            self,
+            name: str,
+            documentation: str,
+            label_names: Sequence[str] = (),
+    ) -> Counter:
+        metric = Counter(name, documentation, label_names)
+        self._register(metric)
+        return metric
+
+    def gauge(
+            self,
+            name: str,
+            documentation: str,
+            label_names: Sequence[str] = (),
+    ) -> Gauge:
+        metric = Gauge(name, documentation, label_names)
+        self._register(metric)
+        return metric
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            label_names: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name, documentation, label_names, buckets)
+        self._register(metric)
+        return metric
+
+    def _register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f'Duplicate metric: {metric.name}')
+        self._metrics[metric.name] = metric
+
+    def apply(self, updates: Iterable[Update]) -> None:
+        """
+        Apply captured updates to the metrics.
+        """
+        for (name, method, labels, value) in updates:
+            metric = self._metrics[name]
+            if method == 'inc':
+                assert isinstance(metric, Counter)
+                metric.inc(*labels, amount=value)
+            elif method == 'set':
+                assert isinstance(metric, Gauge)
+                metric.set(value, *labels)
+            else:
+                assert isinstance(metric, Histogram)
+                metric.observe(value, *labels)
+
+    def render(self) -> str:
+        """
+        Render the metrics in the Prometheus text format.
+        """
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return ''.join(line + '\n' for line in lines)
+
+    def write_file(self, filename: str) -> None:
+        """
+        Write the metrics to a file atomically.
+        """
+        tmp_filename = f'{filename}.tmp'
+        with open(tmp_filename, 'wt') as fp:
+            fp.write(self.render())
+        os.replace(tmp_filename, filename)
+
+
+REGISTRY = MetricsRegistry()
+
+IMAGES = REGISTRY.counter(
+    'meterelf_images_total', 'Number of processed images.')
+READINGS = REGISTRY.counter(
+    'meterelf_readings_total', 'Number of successfully read meter values.',
+    ['meter'])
+ERRORS = REGISTRY.counter(
+    'meterelf_errors_total', 'Number of failed readings by error class.',
+    ['meter', 'error'])
+UNREADABLE_DIALS = REGISTRY.counter(
+    'meterelf_unreadable_dials_total',
+    'Number of times a dial could not be read.', ['meter', 'dial'])
+TIERED_READINGS = REGISTRY.counter(
+    'meterelf_tiered_readings_total',
+    'Number of tiered readings by the highest tier used.', ['meter', 'tier'])
+# Stages: "load" (decoding), "locate_dials", "read_dials" and "meter"
+# (all processing of a meter after decoding)
+STAGE_DURATION = REGISTRY.histogram(
+    'meterelf_stage_duration_seconds',
+    'Duration of the processing stages of an image.', ['stage'])
+SCHEDULER_QUEUE_DEPTH = REGISTRY.gauge(
+    'meterelf_scheduler_queue_depth',
+    'Number of images waiting in the queues of the scheduler.',
+    ['feed', 'priority'])
+SCHEDULER_WAIT = REGISTRY.histogram(
+    'meterelf_scheduler_wait_seconds',
+    'Time images waited in the queues of the scheduler.',
+    ['feed', 'priority'],
+    buckets=[0.01, 0.1, 1.0, 10.0, 60.0, 600.0, 3600.0])
+
+
+@contextmanager
+def capture() -> Iterator[List[Update]]:
+    """
+    Capture the metric updates of this thread instead of applying them.
+
+    The captured updates are collected to the yielded list, from which
+    they can be applied with `MetricsRegistry.apply`, or discarded.
+    """
+    previous = getattr(_local, 'updates', None)
+    updates: List[Update] = []
+    _local.updates = updates
+    try:
+        yield updates
+    finally:
+        _local.updates = previous
+
+
+def record_result(data: 'MeterImageData') -> None:
+    meter = data.meter or ''
+    if data.error is not None:
+        ERRORS.inc(meter, type(data.error).__name__)
+    elif data.value is not None:
+        READINGS.inc(meter)
+
+
+class MetricsFileWriter:
+    """
+    Writer of the metrics to a file periodically in a background thread.
+
+    The file is written also when the writer is stopped.
+    """
+    def __init__(
+            self,
+            filename: str,
+            interval: float = 15.0,
+            registry: MetricsRegistry = REGISTRY,
+    ) -> None:
+        self.filename = filename
+        self.interval = interval
+        self.registry = registry
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._thread.join()
+        self.registry.write_file(self.filename)
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.registry.write_file(self.filename)
+
+
+def start_metrics_server(
+        port: int,
+        address: str = '127.0.0.1',
+        registry: MetricsRegistry = REGISTRY,
+) -> 'HTTPServer':
+    """
+    Serve the metrics over HTTP in a background thread.
+
+    :return: the server, which can be stopped with its shutdown method
+    """
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:  # noqa: N802
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header(
+                'Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: object) -> None:
+            pass
+
+    server = Server((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def _escape(value: str) -> str:
+    r"""
+    Escape a label value.
+
+    >>> print(_escape('a"b\\c\nd'))
+    a\"b\\c\nd
+    """
+    return (
+        value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
@@ -1,14 +1,24 @@
 import os
-from typing import Any, Dict, List, Optional, Type, TypeVar
+from typing import (
+    Any, Dict, List, Optional, Sequence, Tuple, Type, TypeVar)
 
 import yaml
 
 from ._colors import HlsColor
 from ._types import DialCenter, FloatPoint, Rect, Size
 
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:  # pragma: no cover (LibYAML bindings not available)
+    from yaml import SafeLoader as _YamlLoader  # type: ignore
+
 T = TypeVar('T', bound='Params')
 _T = TypeVar('_T')
 
+TEMPLATE_MATCH_METHODS = ['ccoeff', 'normed', 'pyramid', 'spectrum']
+
+READING_METHODS = ['full', 'tiered', 'polar']
+
 
 class LoadError(Exception):
     pass
@@ -16,26 +26,60 @@ class LoadError(Exception):
 
 class Params:
     @classmethod
-    def load(cls: Type[T], filename: str) -> T:
-        try:
-            with open(filename, 'rt') as fp:
-                data = yaml.load(fp)
-        except Exception as error:
-            message = 'Cannot load YAML data from {}'.format(filename)
-            raise LoadError(message) from error
-        if not isinstance(data, dict):
-            raise LoadError(f'Not a valid parameters file: {filename}')
-        return cls(os.path.dirname(filename), data)
-
-    def __init__(self, base_dir: str, data: Dict[Any, Any]) -> None:
+    def load(cls: Type[T], filename: str, meter: Optional[str] = None) -> T:
+        """
+        Load parameters of a meter from a file.
+
+        If the file has parameters of several meters, the meter must be
+        selected by its name.
+        """
+        meters = cls.load_meters(filename)
+        if meter is None:
+            if len(meters) > 1:
+                names = ', '.join(x.name or '' for x in meters)
+                raise LoadError(f'Select one of the meters in {filename}: '
+                                f'{names}')
+            return meters[0]
+        for meter_params in meters:
+            if meter_params.name == meter:
+                return meter_params
+        raise LoadError(f'No meter named {meter} in {filename}')
+
+    @classmethod
+    def load_meters(cls: Type[T], filename: str) -> List[T]:
+        """
+        Load parameters of all meters from a file.
+
+        The file may list several meters in "meters".  Each item of the
+        list has a name and overrides the parameters given on the top
+        level, so that the common parameters need to be given only once.
+        Files without "meters" describe a single meter without a name.
+        """
+        base_dir = os.path.dirname(filename)
+        return [
+            cls(base_dir, data, name)
+            for (name, data) in load_meter_data(filename)]
+
+    def __init__(
+            self,
+            base_dir: str,
+            data: Dict[Any, Any],
+            name: Optional[str] = None,
+    ) -> None:
+        self.name = name
         d = TypeCheckedGetter(data, base_dir=base_dir)
         self.image_glob: str = d.glob('image_glob')
 
         self.meter_rect: Rect = d.rect('meter_rect')
 
         self.dials_file: str = d.filename('dials_template')
-        self.dials_match_threshold: int = d.integer(
-            'dials_template_match_threshold')
+        self.dials_match_method: str = d.choice(
+            'dials_template_match_method', TEMPLATE_MATCH_METHODS,
+            default='ccoeff')
+        self.dials_match_threshold: float = (
+            d.float_num('dials_template_match_threshold')
+            if self.dials_match_method == 'normed' else
+            d.integer('dials_template_match_threshold'))
         self.dials_template_size: Size = d.size('dials_template_size')
 
         self.hue_shift: int = d.integer('hue_shift')
@@ -63,9 +107,59 @@ class Params:
         self.dial_centers: Dict[str, DialCenter] = {
             x.name: DialCenter(x.center, x.diameter) for x in needles}
 
-
-def load(filename: str) -> Params:
-    return Params.load(filename)
+        self.reading_method: str = d.choice(
+            'reading_method', READING_METHODS, default='full')
+        self.fast_reading_scale: int = d.integer(
+            'fast_reading_scale', default=1)
+        if self.fast_reading_scale < 1:
+            raise LoadError('fast_reading_scale must be at least 1')
+        self.fast_reading_min_confidence: float = d.float_num(
+            'fast_reading_min_confidence', default=0.5)
+        self.polar_angle_bins: int = d.integer(
+            'polar_angle_bins', default=360)
+        if self.polar_angle_bins < 36:
+            raise LoadError('polar_angle_bins must be at least 36')
+
+
+def load(filename: str, meter: Optional[str] = None) -> Params:
+    return Params.load(filename, meter)
+
+
+def load_meters(filename: str) -> List[Params]:
+    return Params.load_meters(filename)
+
+
+def load_meter_data(
+        filename: str,
+) -> List[Tuple[Optional[str], Dict[Any, Any]]]:
+    """
+    Load the parameter data of all meters from a file.
+
+    :return: list of meter names and their data, with the common
+      parameters merged to the data of each meter
+    """
+    try:
+        with open(filename, 'rt') as fp:
+            data = yaml.load(fp, Loader=_YamlLoader)
+    except Exception as error:
+        message = 'Cannot load YAML data from {}'.format(filename)
+        raise LoadError(message) from error
+    if not isinstance(data, dict):
+        raise LoadError(f'Not a valid parameters file: {filename}')
+    if 'meters' not in data:
+        return [(None, data)]
+
+    meter_dicts = TypeCheckedGetter(data).list('meters', dict)
+    if not meter_dicts:
+        raise LoadError('Must have data of at least one meter')
+    names = [TypeCheckedGetter(x).text('name') for x in meter_dicts]
+    for name in names:
+        if names.count(name) > 1:
+            raise LoadError(f'Duplicate meter name: {name}')
+    common_data = {k: v for (k, v) in data.items() if k != 'meters'}
+    return [
+        (name, dict(common_data, **meter_data))
+        for (name, meter_data) in zip(names, meter_dicts)]
 
 
 class _Needle:
@@ -97,11 +191,28 @@ class TypeCheckedGetter:
     def boolean(self, name: str) -> bool:
         return self._get_value(bool, name)
 
-    def integer(self, name: str) -> int:
-        return self._get_value(int, name)
+    def integer(self, name: str, default: Optional[int] = None) -> int:
+        return self._get_value(int, name, default)
 
-    def float_num(self, name: str) -> float:
-        return self._get_value(float, name)
+    def float_num(
+            self,
+            name: str,
+            default: Optional[float] = None,
+    ) -> float:
+        return self._get_value(float, name, default)
+
+    def choice(
+            self,
+            name: str,
+            choices: Sequence[str],
+            default: Optional[str] = None,
+    ) -> str:
+        if default is not None and name not in self.data:
+            return default
+        value = self.text(name)
+        if value not in choices:
+            raise LoadError(f'{name} must be one of: {", ".join(choices)}')
+        return value
 
     def list(
             self,
@@ -148,7 +259,14 @@ class TypeCheckedGetter:
         saturation = hls_data.integer('s')
         return HlsColor(hue, lightness, saturation)
 
-    def _get_value(self, tp: Type[_T], name: str) -> _T:
+    def _get_value(
+            self,
+            tp: Type[_T],
+            name: str,
+            default: Optional[_T] = None,
+    ) -> _T:
+        if default is not None and name not in self.data:
+            return default
         value = self.data[name]
         if not isinstance(value, tp):
             raise LoadError(f'{name} is not {tp.__name__}')
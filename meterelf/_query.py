@@ -0,0 +1,245 @@
+"""
+Sparse queries of meter values at given times.
+
+The image files are indexed by the timestamps in their names and only
+the images nearest to the target times are processed.  If an image
+cannot be read, its neighbours are tried in the order of their
+distance to the target.
+"""
+import bisect
+import itertools
+import re
+from datetime import datetime, timedelta
+from typing import (
+    TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, NamedTuple,
+    Optional)
+
+from ._filenames import get_timestamp
+
+if TYPE_CHECKING:
+    from ._api import MeterImageData
+
+# Meter values wrap around to zero after this
+VALUE_RANGE = 1000.0
+
+_DURATION_RE = re.compile(r'^(\d+(?:\.\d*)?)([smhdw])$')
+
+_DURATION_UNITS = {
+    's': timedelta(seconds=1),
+    'm': timedelta(minutes=1),
+    'h': timedelta(hours=1),
+    'd': timedelta(days=1),
+    'w': timedelta(weeks=1),
+}
+
+
+class TimedReading(NamedTuple):
+    timestamp: datetime
+    data: 'MeterImageData'
+
+
+class QueryResult(NamedTuple):
+    target: datetime
+    value: Optional[float]
+    readings: List[TimedReading]  # The readings the value is based on
+
+    @property
+    def interpolated(self) -> bool:
+        return len(self.readings) > 1
+
+
+class TimeIndex:
+    """
+    Index of image files by the timestamps in their names.
+
+    Files without a timestamp are ignored.
+    """
+    def __init__(self, filenames: Iterable[str]) -> None:
+        entries = sorted(
+            (timestamp, filename) for (timestamp, filename) in (
+                (get_timestamp(x), x) for x in filenames)
+            if timestamp is not None)
+        self.timestamps: List[datetime] = [x[0] for x in entries]
+        self.filenames: List[str] = [x[1] for x in entries]
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def iter_nearest(self, target: datetime) -> Iterator[int]:
+        """
+        Iterate indices of the files in the order of distance to target.
+        """
+        after = bisect.bisect_left(self.timestamps, target)
+        before = after - 1
+        while before >= 0 or after < len(self.timestamps):
+            if after >= len(self.timestamps) or (
+                    before >= 0 and
+                    target - self.timestamps[before] <=
+                    self.timestamps[after] - target):
+                yield before
+                before -= 1
+            else:
+                yield after
+                after += 1
+
+    def iter_at_or_before(self, target: datetime) -> Iterator[int]:
+        start = bisect.bisect_right(self.timestamps, target) - 1
+        return iter(range(start, -1, -1))
+
+    def iter_at_or_after(self, target: datetime) -> Iterator[int]:
+        start = bisect.bisect_left(self.timestamps, target)
+        return iter(range(start, len(self.timestamps)))
+
+
+class SparseQuery:
+    """
+    Query of meter values at target times.
+
+    Each image is processed at most once, even if it is near several
+    targets.  At most `max_tries` images are tried per target (and per
+    side when interpolating) and images farther than `max_distance`
+    from the target are not used.
+    """
+    def __init__(
+            self,
+            index: TimeIndex,
+            read_image: Callable[[str], 'MeterImageData'],
+            *,
+            interpolate: bool = False,
+            max_distance: Optional[timedelta] = None,
+            max_tries: int = 10,
+    ) -> None:
+        self.index = index
+        self.read_image = read_image
+        self.interpolate = interpolate
+        self.max_distance = max_distance
+        self.max_tries = max_tries
+        self._readings: Dict[int, Optional[TimedReading]] = {}
+
+    def query(self, target: datetime) -> QueryResult:
+        if not self.interpolate:
+            reading = self._find(target, self.index.iter_nearest(target))
+            readings = [reading] if reading else []
+            value = reading.data.value if reading else None
+            return QueryResult(target, value, readings)
+
+        before = self._find(target, self.index.iter_at_or_before(target))
+        if before and before.timestamp == target:
+            return QueryResult(target, before.data.value, [before])
+        after = self._find(target, self.index.iter_at_or_after(target))
+        if before and after:
+            value = interpolate_value(
+                target, before.timestamp, before.data.value,
+                after.timestamp, after.data.value)
+            return QueryResult(target, value, [before, after])
+        # Only one side is available, so use it as is
+        reading = before or after
+        if reading:
+            return QueryResult(target, reading.data.value, [reading])
+        return QueryResult(target, None, [])
+
+    def _find(
+            self,
+            target: datetime,
+            indices: Iterator[int],
+    ) -> Optional[TimedReading]:
+        for index in itertools.islice(indices, self.max_tries):
+            timestamp = self.index.timestamps[index]
+            if self.max_distance is not None and (
+                    abs(timestamp - target) > self.max_distance):
+                return None
+            reading = self._read(index)
+            if reading is not None:
+                return reading
+        return None
+
+    def _read(self, index: int) -> Optional[TimedReading]:
+        if index not in self._readings:
+            data = self.read_image(self.index.filenames[index])
+            ok = data.error is None and data.value is not None
+            self._readings[index] = (
+                TimedReading(self.index.timestamps[index], data)
+                if ok else None)
+        return self._readings[index]
+
+
+def interpolate_value(
+        target: datetime,
+        time1: datetime,
+        value1: Optional[float],
+        time2: datetime,
+        value2: Optional[float],
+) -> float:
+    """
+    Interpolate meter value linearly between two readings.
+
+    The values are interpolated along the shorter way around the
+    range, see `get_value_difference`.
+
+    >>> t = datetime(2018, 8, 14)
+    >>> interpolate_value(t, t - timedelta(hours=1), 100.0,
+    ...                   t + timedelta(hours=3), 104.0)
+    101.0
+    >>> interpolate_value(t, t - timedelta(hours=1), 999.0,
+    ...                   t + timedelta(hours=1), 1.0)
+    0.0
+    """
+    assert value1 is not None and value2 is not None
+    fraction = (target - time1) / (time2 - time1)
+    difference = get_value_difference(value1, value2)
+    return (value1 + fraction * difference) % VALUE_RANGE
+
+
+def get_value_difference(value1: float, value2: float) -> float:
+    """
+    Get signed difference of two meter values.
+
+    The meter is assumed to have moved less than half of the value
+    range between the values, so that a wrap around the end of the
+    range is a small forward step and small backward jitter of the
+    readings stays negative.
+
+    >>> get_value_difference(999.0, 1.0)
+    2.0
+    >>> round(get_value_difference(948.603, 948.602), 6)
+    -0.001
+    """
+    return (
+        (value2 - value1 + VALUE_RANGE / 2) % VALUE_RANGE - VALUE_RANGE / 2)
+
+
+def parse_duration(text: str) -> timedelta:
+    """
+    Parse duration like "30s", "15m", "6h", "1d" or "2w".
+
+    >>> parse_duration('1d')
+    datetime.timedelta(days=1)
+    >>> parse_duration('1.5h')
+    datetime.timedelta(seconds=5400)
+    """
+    match = _DURATION_RE.match(text.strip())
+    if not match:
+        raise ValueError(f'Invalid duration: {text}')
+    duration = float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+    if not duration:
+        raise ValueError(f'Duration must be positive: {text}')
+    return duration
+
+
+def get_target_times(
+        start: datetime,
+        end: datetime,
+        step: timedelta,
+) -> Iterator[datetime]:
+    """
+    Get times from start to end (inclusive) with given step.
+
+    >>> [x.hour for x in get_target_times(
+    ...     datetime(2018, 8, 14), datetime(2018, 8, 14, 12),
+    ...     timedelta(hours=6))]
+    [0, 6, 12]
+    """
+    target = start
+    while target <= end:
+        yield target
+        target += step
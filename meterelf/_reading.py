@@ -1,31 +1,232 @@
 import math
-from typing import Dict, List, Tuple
+from typing import Collection, Dict, Iterable, List, Optional, Tuple
 
 import cv2
 import numpy
 
-from . import _debug
-from ._colors import BGR_BLACK, BGR_MAGENTA, HlsColor
-from ._dial_data import get_dial_data
+from . import _debug, _debug_output, _metrics
+from ._colors import BGR_BLACK, BGR_MAGENTA
+from ._dial_data import get_dial_color, get_dial_data
+from ._fast_reading import get_fast_dial_readings
 from ._image import ImageFile
 from ._params import Params as _Params
-from ._types import DialData, Image, PointAsArray, Rect
+from ._polar_reading import get_dial_positions_polar
+from ._types import DialData, Image, PointArray
 from ._utils import (
-    convert_to_bgr, crop_rect, find_non_zero, float_point_to_int,
+    convert_to_bgr, find_non_zero, float_point_to_int,
     get_angle_by_vector, get_mask_by_color, scale_image)
-from .exceptions import DialAngleDeterminingError, NeedleContoursNotFoundError
+from ._workspace import get_workspace
+from .exceptions import (
+    DialAngleDeterminingError, DialsNotFoundError, ImageProcessingError,
+    NeedleContoursNotFoundError)
 
+# Tiers of the tiered reading, recorded to the image and to the tiered
+# readings metric
+FAST_TIER = 1
+FULL_TIER = 2
 
-def get_meter_value(imgf: ImageFile) -> Dict[str, float]:
+# Structuring element for closing small gaps of the needle masks
+_KERNEL = numpy.ones((3, 3), numpy.uint8)
+
+# Change of the meter value, which is considered a jump in the digits
+# when estimating the margins to the carry thresholds
+CARRY_JUMP_LIMIT = 0.5
+
+
+def get_meter_value(
+        imgf: ImageFile,
+        annotate: Optional[bool] = None,
+        dial_names: Optional[Collection[str]] = None,
+) -> Dict[str, float]:
+    """
+    Get meter value and dial positions from an image.
+
+    If `dial_names` is given, only those dials are read and the result
+    has the meter value only if all dials were given.
+    """
+    if annotate is None:
+        annotate = _debug_output.wants_image(imgf.filename)
+    try:
+        return _get_meter_value(imgf, annotate, dial_names)
+    except ImageProcessingError:
+        if not annotate and _debug_output.wants_image(imgf.filename, True):
+            # Read again for the debug images without counting the
+            # failure twice in the metrics
+            with _metrics.capture():
+                try:
+                    _get_meter_value(imgf, True, dial_names)
+                except ImageProcessingError:
+                    pass
+        raise
+
+
+def _get_meter_value(
+        imgf: ImageFile,
+        annotate: bool,
+        dial_names: Optional[Collection[str]] = None,
+) -> Dict[str, float]:
+    debug_name = 'debug: ' + imgf.filename.rsplit('/', 1)[-1]
+    try:
+        with _metrics.STAGE_DURATION.time('locate_dials'):
+            dials_hls = imgf.get_dials_hls()
+    except DialsNotFoundError:
+        if annotate:
+            _debug_output.show(debug_name, imgf.get_bgr_image())
+        raise
+    with _metrics.STAGE_DURATION.time('read_dials'):
+        return _read_dials(imgf, dials_hls, annotate, debug_name, dial_names)
+
+
+def get_meter_value_of_dials(
+        imgf: ImageFile,
+        dials_hls: Image,
+) -> Dict[str, float]:
+    """
+    Get meter value from an already located dials area of an image.
+    """
+    return _read_dials(imgf, dials_hls, annotate=False)
+
+
+def _read_dials(
+        imgf: ImageFile,
+        dials_hls: Image,
+        annotate: bool,
+        debug_name: str = '',
+        dial_names: Optional[Collection[str]] = None,
+) -> Dict[str, float]:
+    params = imgf.params
+    if params.reading_method == 'tiered' and not annotate:
+        (dial_positions, tier) = get_dial_positions_tiered(
+            imgf, dials_hls, dial_names)
+        imgf.reading_tier = tier
+        _metrics.TIERED_READINGS.inc(params.name or '', str(tier))
+    elif params.reading_method == 'polar' and not annotate:
+        dial_positions = get_dial_positions_polar(imgf, dials_hls, dial_names)
+    else:
+        debug = convert_to_bgr(params, dials_hls) if annotate else None
+        try:
+            dial_positions = get_dial_positions(
+                imgf, dials_hls, debug, dial_names)
+        finally:
+            if debug is not None:
+                _debug_output.show(debug_name, debug, scale=2)
+
+    result = dial_positions.copy()
+    if set(dial_positions.keys()) == set(params.dial_centers.keys()):
+        result['value'] = determine_value_by_dial_positions(dial_positions)
+    return result
+
+
+def get_dial_positions_tiered(
+        imgf: ImageFile,
+        dials_hls: Image,
+        dial_names: Optional[Collection[str]] = None,
+) -> Tuple[Dict[str, float], int]:
+    """
+    Get dial positions with the tiered method.
+
+    All dials, or the dials of `dial_names` if given, are first read
+    with the fast method.  The dials whose confidence is below the
+    limit are then read with the full method.  The confidence of a fast
+    reading is the lowest of its point count score, its precision score
+    and its carry margin score.
+
+    :return: the dial positions and the highest tier used
+    """
     params = imgf.params
-    dials_hls = imgf.get_dials_hls()
+    min_confidence = params.fast_reading_min_confidence
+    fast_readings = {
+        name: reading
+        for (name, reading) in get_fast_dial_readings(
+            params, dials_hls, dial_names).items()
+        if reading.confidence >= min_confidence}
+    full_dials = [
+        x for x in (params.dial_centers if dial_names is None else dial_names)
+        if x not in fast_readings]
+    dial_positions = (
+        get_dial_positions(imgf, dials_hls, dial_names=full_dials)
+        if full_dials else {})
+    dial_positions.update(
+        (name, reading.position) for (name, reading) in fast_readings.items())
 
-    debug = convert_to_bgr(params, dials_hls) if _debug.DEBUG else dials_hls
+    margin_scores = get_carry_margin_scores(dial_positions, {
+        name: reading.uncertainty
+        for (name, reading) in fast_readings.items()})
+    uncertain_dials = [
+        name for (name, score) in margin_scores.items()
+        if score < min_confidence]
+    if uncertain_dials:
+        dial_positions.update(get_dial_positions(
+            imgf, dials_hls, dial_names=uncertain_dials))
 
+    tier = FULL_TIER if (full_dials or uncertain_dials) else FAST_TIER
+    return (dial_positions, tier)
+
+
+def get_carry_margin_scores(
+        dial_positions: Dict[str, float],
+        uncertainties: Dict[str, float],
+) -> Dict[str, float]:
+    """
+    Score the margins of the dial positions to the carry thresholds.
+
+    A dial gets score 1.0 if moving it by twice its uncertainty to
+    either direction does not make the meter value jump, 0.5 if only
+    moving it by its uncertainty is safe and 0.0 otherwise.
+
+    >>> positions = {'0.0001': 1.5, '0.001': 3.2, '0.01': 5.5, '0.1': 7.5}
+    >>> uncertainties = {'0.0001': 0.2, '0.001': 0.03}
+    >>> get_carry_margin_scores(positions, uncertainties)
+    {'0.0001': 1.0, '0.001': 1.0}
+    >>> positions['0.001'] = 3.5
+    >>> get_carry_margin_scores(positions, uncertainties)
+    {'0.0001': 1.0, '0.001': 0.5}
+    >>> positions['0.001'] = 3.54
+    >>> get_carry_margin_scores(positions, uncertainties)
+    {'0.0001': 1.0, '0.001': 0.0}
+    """
+    if len(dial_positions) != 4:
+        # Carries are determined only for meters with four dials
+        return {name: 1.0 for name in uncertainties}
+
+    value = determine_value_by_dial_positions(dial_positions)
+    finest_dial = min(dial_positions)
+
+    def is_safe_move(name: str, amount: float) -> bool:
+        moved_positions = dict(dial_positions)
+        moved_positions[name] = (dial_positions[name] + amount) % 10.0
+        moved_value = determine_value_by_dial_positions(moved_positions)
+        change = abs((moved_value - value + 500.0) % 1000.0 - 500.0)
+        expected_change = abs(amount) / 10.0 if name == finest_dial else 0.0
+        return change - expected_change < CARRY_JUMP_LIMIT
+
+    scores = {}
+    for (name, uncertainty) in uncertainties.items():
+        scores[name] = 0.0
+        for (factor, score) in [(2.0, 1.0), (1.0, 0.5)]:
+            amount = factor * uncertainty
+            if is_safe_move(name, amount) and is_safe_move(name, -amount):
+                scores[name] = score
+                break
+    return scores
+
+
+def get_dial_positions(
+        imgf: ImageFile,
+        dials_hls: Image,
+        debug: Optional[Image] = None,
+        dial_names: Optional[Iterable[str]] = None,
+) -> Dict[str, float]:
+    params = imgf.params
     dial_positions: Dict[str, float] = {}
     unreadable_dials: List[str] = []
 
-    for (dial_name, dial_data) in get_dial_data(params).items():
+    all_dial_data = get_dial_data(params)
+    dial_data_to_read = (
+        all_dial_data if dial_names is None else
+        {name: all_dial_data[name] for name in dial_names})
+
+    for (dial_name, dial_data) in dial_data_to_read.items():
         (needle_points, needle_mask) = get_needle_points(
             params, dials_hls, dial_data, debug)
 
@@ -40,7 +241,7 @@ def get_meter_value(imgf: ImageFile) -> Dict[str, float]:
         momentum_vector = (mom_sign * momentum_x, mom_sign * momentum_y)
         momentum_angle = get_angle_by_vector(momentum_vector)
 
-        if _debug.DEBUG:
+        if debug is not None:
             mom_scale = math.sqrt(momentum_x**2 + momentum_y**2)
             center = dial_data.center
             mom_x = center[0] + 24 * mom_sign * momentum_x / mom_scale
@@ -48,12 +249,14 @@ def get_meter_value(imgf: ImageFile) -> Dict[str, float]:
             cv2.circle(
                 debug, float_point_to_int((mom_x, mom_y)), 4, (0, 0, 255))
 
-        outer_points = find_non_zero(needle_mask & dial_data.circle_mask)
+        outer_points = find_non_zero(cv2.bitwise_and(
+            needle_mask, dial_data.circle_mask,
+            get_workspace(params).get('masked', needle_mask.shape)))
 
         angles_and_sqdists: List[Tuple[float, float]] = []
         for outer_point in outer_points:
             (x, y) = outer_point - dial_data.center
-            if _debug.DEBUG:
+            if debug is not None:
                 point = (outer_point[0], outer_point[1])
                 cv2.circle(debug, point, 0, (0, 128, 128))
             angle = get_angle_by_vector((x, y))
@@ -64,20 +267,23 @@ def get_meter_value(imgf: ImageFile) -> Dict[str, float]:
                     abs(abs(angle - momentum_angle) - 1))
                 if angle_dist_from_mom < 0.25:
                     angles_and_sqdists.append((angle, (x**2 + y**2)))
-                    if _debug.DEBUG:
+                    if debug is not None:
                         coords = (outer_point[0], outer_point[1])
                         cv2.circle(debug, coords, 0, (0, 255, 255))
 
-        if _debug.DEBUG:
+        if debug is not None and _debug.DEBUG:
+            # Step through the dials interactively
             debug4 = scale_image(debug, 4)
             cent = dial_data.center
             dial_center = float_point_to_int((cent[0] * 4, cent[1] * 4))
             cv2.circle(debug4, dial_center, 0, BGR_BLACK)
             cv2.circle(debug4, dial_center, 6, BGR_MAGENTA)
-            cv2.imshow('debug: ' + imgf.filename.rsplit('/', 1)[-1], debug4)
-            cv2.waitKey(0)
+            _debug_output.show(
+                'debug: ' + imgf.filename.rsplit('/', 1)[-1], debug4)
+            _debug_output.wait()
         if not angles_and_sqdists:
             unreadable_dials.append(dial_name)
+            _metrics.UNREADABLE_DIALS.inc(params.name or '', dial_name)
             continue
         min_angle = min(a for (a, _d) in angles_and_sqdists)
         angles_and_sqdists_r = [
@@ -105,61 +311,59 @@ def get_meter_value(imgf: ImageFile) -> Dict[str, float]:
         extra_info['unreadable dials'] = ', '.join(unreadable_dials)
         raise DialAngleDeterminingError(imgf.filename, extra_info=extra_info)
 
-    result = dial_positions.copy()
-
-    if set(dial_positions.keys()) == set(params.dial_centers.keys()):
-        result['value'] = determine_value_by_dial_positions(dial_positions)
-    if _debug.DEBUG:
-        cv2.imshow('debug: ' + imgf.filename.rsplit('/', 1)[-1],
-                   scale_image(debug, 2))
-    return result
+    return dial_positions
 
 
 def get_needle_points(
         params: _Params,
         dials_hls: Image,
         dial_data: DialData,
-        debug: Image,
-) -> Tuple[List[PointAsArray], Image]:
+        debug: Optional[Image] = None,
+) -> Tuple[PointArray, Image]:
+    """
+    Get points of the needle of a dial.
+
+    The returned needle mask is a buffer of the workspace, which is
+    overwritten by the next call.
+    """
+    workspace = get_workspace(params)
+    size = dials_hls.shape[0:2]
     dial_color = get_dial_color(dials_hls, dial_data)
 
     needle_mask_orig = get_mask_by_color(
-        dials_hls, dial_color, params.dial_color_range[dial_data.name])
-    kernel = numpy.ones((3, 3), numpy.uint8)
-    needle_mask_dilated = cv2.dilate(needle_mask_orig, kernel)
-    needle_mask_de = cv2.erode(needle_mask_dilated, kernel)
+        dials_hls, dial_color, params.dial_color_range[dial_data.name],
+        workspace.get('color_mask', size))
+    needle_mask_dilated = cv2.dilate(
+        needle_mask_orig, _KERNEL, workspace.get('dilated', size))
+    needle_mask_de = cv2.erode(
+        needle_mask_dilated, _KERNEL, workspace.get('eroded', size))
 
+    # Note: findContours modifies its input
     (_bw, contours, _hier) = cv2.findContours(
-        needle_mask_de & dial_data.mask,
+        cv2.bitwise_and(
+            needle_mask_de, dial_data.mask, workspace.get('contours', size)),
         cv2.RETR_EXTERNAL,
         cv2.CHAIN_APPROX_NONE)
 
     if not contours:
+        _metrics.UNREADABLE_DIALS.inc(params.name or '', dial_data.name)
         raise NeedleContoursNotFoundError(extra_info={'dial': dial_data.name})
 
     contour = sorted(contours, key=cv2.contourArea)[-1]
     if cv2.contourArea(contour) > 100:
-        if _debug.DEBUG:
+        if debug is not None:
             cv2.drawContours(debug, [contour], -1, (255, 255, 0), -1)
-        needle_mask = needle_mask_de.copy()
+        needle_mask = workspace.get('needle_mask', size)
         needle_mask.fill(0)
         cv2.drawContours(needle_mask, [contour], -1, 255, -1)
     else:
         needle_mask = needle_mask_de
 
-    needle_points = find_non_zero(needle_mask & dial_data.mask)
+    needle_points = find_non_zero(cv2.bitwise_and(
+        needle_mask, dial_data.mask, workspace.get('masked', size)))
     return (needle_points, needle_mask)
 
 
-def get_dial_color(dials_hls: Image, dial_data: DialData) -> HlsColor:
-    (c_x, c_y) = dial_data.center
-    (x, y) = (int(c_x), int(c_y))
-    dial_core = crop_rect(dials_hls, Rect((x - 2, y - 2), (x + 3, y + 3)))
-    mean_color = cv2.mean(dial_core)
-    (h, l, s) = mean_color[0:3]  # type: ignore
-    return HlsColor(int(round(h)), int(round(l)), int(round(s)))
-
-
 def determine_value_by_dial_positions(
         dial_positions: Dict[str, float],
 ) -> float:
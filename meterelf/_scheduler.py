@@ -0,0 +1,335 @@
+"""
+Scheduler of images from many feeds to shared worker processes.
+
+A feed is a source of images with its own parameters file, e.g. a
+camera.  The images of all feeds are processed by a common pool of
+worker processes, which load the parameters, templates and dial masks
+of each parameters file once and keep them for the following images.
+
+Images are submitted to a feed either as live images or as backfill.
+Live images are always dispatched before any backfill, so that a big
+backfill does not delay the readings of the live images.  Within a
+priority the feeds get a fair share of the workers in proportion to
+their weights, so that a feed with a long queue does not starve the
+others.  Only a few images per worker are dispatched to the pool at a
+time, so that the priorities apply also to images submitted while the
+workers are busy.
+
+Each feed has its own stream of results, in the order of completion.
+The queue depths and the time the images wait in the queues are
+recorded to the runtime metrics and can also be queried with
+`Scheduler.get_stats`.  The metrics of processing the images, like the
+stage durations, are captured in the workers and sent back with the
+results, so that they are recorded in the metrics of this process.
+"""
+import collections
+import threading
+import time
+from typing import (
+    TYPE_CHECKING, Deque, Dict, Iterable, Iterator, List, NamedTuple,
+    Optional, Tuple)
+
+from . import _metrics
+from ._api import MeterImageData, _MeterProcessor
+from .exceptions import ImageProcessingError
+
+if TYPE_CHECKING:
+    from multiprocessing.pool import Pool
+
+    from ._params import Params as _Params
+
+# Priorities in the order of dispatching
+LIVE = 'live'
+BACKFILL = 'backfill'
+PRIORITIES = [LIVE, BACKFILL]
+
+# Number of images dispatched to the pool per worker at a time
+DISPATCH_AHEAD = 2
+
+
+class SchedulerError(Exception):
+    pass
+
+
+class FeedStats(NamedTuple):
+    queued: Dict[str, int]  # Number of waiting images by priority
+    in_flight: int  # Number of images being processed
+    done: int  # Number of processed images
+    wait_count: int  # Number of dispatched images
+    total_wait: float  # Total time the dispatched images waited
+    max_wait: float  # Longest time a dispatched image waited
+
+    @property
+    def mean_wait(self) -> float:
+        return self.total_wait / self.wait_count if self.wait_count else 0.0
+
+
+class _Job(NamedTuple):
+    feed: '_Feed'
+    filename: str
+    priority: str
+    submit_time: float
+
+
+class _Feed:
+    def __init__(
+            self,
+            name: str,
+            params_file: str,
+            meters: List['_Params'],
+            weight: float,
+    ) -> None:
+        self.name = name
+        self.params_file = params_file
+        self.meters = meters
+        self.weight = weight
+        self.queues: Dict[str, Deque[_Job]] = {
+            x: collections.deque() for x in PRIORITIES}
+        # Virtual times of the fair share by priority, advanced by
+        # 1/weight for each dispatched image
+        self.pass_values: Dict[str, float] = {x: 0.0 for x in PRIORITIES}
+        self.results: Deque[MeterImageData] = collections.deque()
+        self.closed = False
+        self.in_flight = 0
+        self.done = 0
+        self.wait_count = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def is_finished(self) -> bool:
+        return self.closed and not self.in_flight and not any(
+            self.queues.values())
+
+
+class Scheduler:
+    """
+    Scheduler of images from many feeds to shared worker processes.
+
+    Use as a context manager or call `close` when done.
+    """
+    def __init__(self, workers: int = 1) -> None:
+        import multiprocessing
+
+        if workers < 1:
+            raise ValueError('Scheduler needs at least one worker')
+        self.workers = workers
+        self._pool: 'Pool' = multiprocessing.Pool(workers)
+        self._feeds: Dict[str, _Feed] = {}
+        self._virtual_times: Dict[str, float] = {x: 0.0 for x in PRIORITIES}
+        self._in_flight = 0
+        self._closing = False
+        self._condition = threading.Condition()
+        self._dispatcher = threading.Thread(
+            target=self._dispatch_loop, daemon=True)
+        self._dispatcher.start()
+
+    def __enter__(self) -> 'Scheduler':
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def add_feed(
+            self,
+            name: str,
+            params_file: str,
+            weight: float = 1.0,
+    ) -> None:
+        """
+        Add a feed of images read with given parameters file.
+
+        :param weight: share of the workers relative to the other feeds
+          when their images have the same priority
+        """
+        from . import _params
+
+        if weight <= 0:
+            raise ValueError('Weight of a feed must be positive')
+        meters = _params.load_meters(params_file)
+        with self._condition:
+            if name in self._feeds:
+                raise SchedulerError(f'Duplicate feed: {name}')
+            self._feeds[name] = _Feed(name, params_file, meters, weight)
+
+    def submit(
+            self,
+            feed_name: str,
+            filenames: Iterable[str],
+            priority: str = LIVE,
+    ) -> None:
+        """
+        Submit images of a feed to be processed.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f'Unknown priority: {priority}')
+        now = time.monotonic()
+        with self._condition:
+            feed = self._get_feed(feed_name)
+            if feed.closed:
+                raise SchedulerError(f'Feed is closed: {feed_name}')
+            queue = feed.queues[priority]
+            if not queue:
+                self._catch_up_pass_value(feed, priority)
+            count_before = len(queue)
+            queue.extend(
+                _Job(feed, filename, priority, now) for filename in filenames)
+            _metrics.SCHEDULER_QUEUE_DEPTH.inc(
+                feed_name, priority, amount=len(queue) - count_before)
+            self._condition.notify_all()
+
+    def close_feed(self, feed_name: str) -> None:
+        """
+        Close a feed.
+
+        The images submitted before closing are still processed, after
+        which the result stream of the feed ends.
+        """
+        with self._condition:
+            self._get_feed(feed_name).closed = True
+            self._condition.notify_all()
+
+    def results(self, feed_name: str) -> Iterator[MeterImageData]:
+        """
+        Iterate the results of a feed in the order of completion.
+
+        The iteration blocks until the next result is available and
+        ends when the feed is closed and all its images are processed.
+        """
+        with self._condition:
+            feed = self._get_feed(feed_name)
+        while True:
+            with self._condition:
+                while not feed.results and not feed.is_finished():
+                    self._condition.wait()
+                if not feed.results:
+                    return
+                data = feed.results.popleft()
+            yield data
+
+    def get_stats(self) -> Dict[str, FeedStats]:
+        with self._condition:
+            return {
+                name: FeedStats(
+                    {x: len(feed.queues[x]) for x in PRIORITIES},
+                    feed.in_flight, feed.done, feed.wait_count,
+                    feed.total_wait, feed.max_wait)
+                for (name, feed) in self._feeds.items()}
+
+    def close(self) -> None:
+        """
+        Close all feeds, wait for their images and stop the workers.
+        """
+        with self._condition:
+            if self._closing:
+                return
+            for feed in self._feeds.values():
+                feed.closed = True
+            self._closing = True
+            self._condition.notify_all()
+        self._dispatcher.join()
+        self._pool.close()
+        self._pool.join()
+
+    def _get_feed(self, feed_name: str) -> _Feed:
+        feed = self._feeds.get(feed_name)
+        if feed is None:
+            raise SchedulerError(f'No feed named {feed_name}')
+        return feed
+
+    def _catch_up_pass_value(self, feed: _Feed, priority: str) -> None:
+        """
+        Move virtual time of a feed becoming busy to the current one.
+
+        Otherwise a feed which has been idle would get the share it did
+        not use while idle in a burst, starving the others.
+        """
+        feed.pass_values[priority] = max(
+            feed.pass_values[priority], self._virtual_times[priority])
+
+    def _dispatch_loop(self) -> None:
+        max_in_flight = self.workers * DISPATCH_AHEAD
+        with self._condition:
+            while True:
+                job = None
+                if self._in_flight < max_in_flight:
+                    job = self._pop_next_job()
+                if job is not None:
+                    self._dispatch(job)
+                    continue
+                if self._closing and not self._in_flight and all(
+                        x.is_finished() for x in self._feeds.values()):
+                    return
+                self._condition.wait()
+
+    def _pop_next_job(self) -> Optional[_Job]:
+        for priority in PRIORITIES:
+            feeds = [x for x in self._feeds.values() if x.queues[priority]]
+            if feeds:
+                feed = min(feeds, key=lambda x: x.pass_values[priority])
+                self._virtual_times[priority] = feed.pass_values[priority]
+                feed.pass_values[priority] += 1.0 / feed.weight
+                return feed.queues[priority].popleft()
+        return None
+
+    def _dispatch(self, job: _Job) -> None:
+        feed = job.feed
+        wait = time.monotonic() - job.submit_time
+        feed.wait_count += 1
+        feed.total_wait += wait
+        feed.max_wait = max(feed.max_wait, wait)
+        _metrics.SCHEDULER_QUEUE_DEPTH.dec(feed.name, job.priority)
+        _metrics.SCHEDULER_WAIT.observe(wait, feed.name, job.priority)
+        feed.in_flight += 1
+        self._in_flight += 1
+        self._pool.apply_async(
+            _process_in_worker, (feed.params_file, job.filename),
+            callback=lambda output: self._complete(job, *output),
+            error_callback=lambda error: self._fail(job, error))
+
+    def _complete(
+            self,
+            job: _Job,
+            results: List[MeterImageData],
+            updates: List[_metrics.Update],
+    ) -> None:
+        _metrics.REGISTRY.apply(updates)
+        for data in results:
+            _metrics.record_result(data)
+        with self._condition:
+            job.feed.results.extend(results)
+            job.feed.in_flight -= 1
+            job.feed.done += 1
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def _fail(self, job: _Job, error: BaseException) -> None:
+        message = f'Worker failed: {type(error).__name__}: {error}'
+        _metrics.IMAGES.inc()
+        self._complete(job, [
+            MeterImageData(
+                job.filename, None,
+                ImageProcessingError(job.filename, message), {}, params.name)
+            for params in job.feed.meters], [])
+
+
+_worker_processors: Dict[str, _MeterProcessor] = {}
+
+
+def _process_in_worker(
+        params_file: str,
+        filename: str,
+) -> Tuple[List[MeterImageData], List[_metrics.Update]]:
+    """
+    Process an image in a worker process.
+
+    :return: the results and the captured metric updates
+    """
+    processor = _worker_processors.get(params_file)
+    if processor is None:
+        from . import _params
+
+        processor = _MeterProcessor(_params.load_meters(params_file), None, 1)
+        _worker_processors[params_file] = processor
+    with _metrics.capture() as updates:
+        results = processor.process(filename)
+    return (results, updates)
@@ -0,0 +1,285 @@
+import json
+import os
+import zlib
+from datetime import datetime
+from typing import (
+    IO, Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple)
+
+from . import exceptions
+from ._api import MeterImageData
+from ._filenames import get_timestamp
+from .exceptions import ImageProcessingError
+
+PARTIAL_FORMAT = 'meterelf-partial'
+PARTIAL_VERSION = 1
+
+SHARD_METHODS = ['hash', 'time']
+
+# Formats of the times written by datetime.isoformat
+_ISO_TIME_FORMATS = ['%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f']
+
+
+class MergeError(Exception):
+    def __init__(self, problems: List[str]) -> None:
+        self.problems = problems
+        super().__init__(
+            'Cannot merge partial results: ' + '; '.join(problems))
+
+
+class Shard(NamedTuple):
+    """
+    Shard of a set of image files.
+
+    The files are partitioned to `total` shards either by a stable hash
+    of the basename of the file or by splitting the time range from
+    `start` to `end` to equal parts, based on the timestamps in the
+    names of the files.  The `number` is from 1 to `total`.
+    """
+    number: int
+    total: int
+    by: str = 'hash'
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+
+    @classmethod
+    def parse(
+            cls,
+            text: str,
+            by: str = 'hash',
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+    ) -> 'Shard':
+        """
+        Parse shard from text like "2/4".
+
+        >>> Shard.parse('2/4')
+        Shard(number=2, total=4, by='hash', start=None, end=None)
+        """
+        try:
+            (number, total) = (int(x) for x in text.split('/'))
+        except ValueError:
+            raise ValueError(f'Invalid shard: {text}')
+        shard = cls(number, total, by, start, end)
+        shard.validate()
+        return shard
+
+    def validate(self) -> None:
+        if not 1 <= self.number <= self.total:
+            raise ValueError(f'Invalid shard: {self}')
+        if self.by not in SHARD_METHODS:
+            raise ValueError(f'Unknown sharding method: {self.by}')
+        if self.by == 'time':
+            if self.start is None or self.end is None:
+                raise ValueError('Sharding by time needs start and end')
+            if self.end <= self.start:
+                raise ValueError('Shard end must be later than start')
+
+    def __str__(self) -> str:
+        return f'{self.number}/{self.total}'
+
+    def contains(self, filename: str) -> bool:
+        return self.get_shard_number(filename) == self.number
+
+    def get_shard_number(self, filename: str) -> Optional[int]:
+        """
+        Get number of the shard containing given file.
+
+        Return None for files outside of the time range when sharding
+        by time.  Files without a timestamp are sharded by hash.
+        """
+        timestamp = get_timestamp(filename) if self.by == 'time' else None
+        if timestamp is None or self.start is None or self.end is None:
+            basename = os.path.basename(filename)
+            checksum = zlib.crc32(basename.encode('utf-8', 'surrogateescape'))
+            return checksum % self.total + 1
+        if not self.start <= timestamp < self.end:
+            return None
+        fraction = (timestamp - self.start) / (self.end - self.start)
+        return min(int(fraction * self.total), self.total - 1) + 1
+
+    def filter(self, filenames: Iterable[str]) -> Iterator[str]:
+        return (x for x in filenames if self.contains(x))
+
+    def get_info(self) -> Dict[str, Any]:
+        return {
+            'shard': str(self),
+            'shard_by': self.by,
+            'start': self.start.isoformat() if self.start else None,
+            'end': self.end.isoformat() if self.end else None,
+        }
+
+    @classmethod
+    def from_info(cls, info: Dict[str, Any]) -> 'Shard':
+        start = info.get('start')
+        end = info.get('end')
+        return cls.parse(
+            info['shard'], info.get('shard_by', 'hash'),
+            _parse_iso_time(start) if start else None,
+            _parse_iso_time(end) if end else None)
+
+
+def _parse_iso_time(text: str) -> datetime:
+    """
+    Parse time written by datetime.isoformat.
+
+    >>> _parse_iso_time('2018-08-14T02:13:57')
+    datetime.datetime(2018, 8, 14, 2, 13, 57)
+    >>> _parse_iso_time('2018-08-14T02:13:57.250000')
+    datetime.datetime(2018, 8, 14, 2, 13, 57, 250000)
+    """
+    for time_format in _ISO_TIME_FORMATS:
+        try:
+            return datetime.strptime(text, time_format)
+        except ValueError:
+            pass
+    raise ValueError(f'Invalid time: {text}')
+
+
+def write_partial(
+        fp: IO[str],
+        results: Iterable[MeterImageData],
+        shard: Optional[Shard] = None,
+        params_file: Optional[str] = None,
+) -> int:
+    """
+    Write results to a self-describing partial result file.
+
+    The file is in JSON lines format with a header describing the
+    shard, one line per result and a footer with the result count.
+    The footer is written last, so that a missing footer means that
+    the file is incomplete.
+
+    :return: number of results written
+    """
+    shard_info = (shard or Shard(1, 1)).get_info()
+    header = {
+        'type': 'header',
+        'format': PARTIAL_FORMAT,
+        'version': PARTIAL_VERSION,
+        'params_file': os.path.basename(params_file) if params_file else None,
+        'created': datetime.now().replace(microsecond=0).isoformat(),
+    }
+    header.update(shard_info)
+    _write_json_line(fp, header)
+    count = 0
+    for data in results:
+        _write_json_line(fp, {
+            'type': 'result',
+            'filename': data.filename,
+            'meter': data.meter,
+            'value': data.value,
+            'meter_values': data.meter_values,
+            'tier': data.tier,
+            'error': {
+                'type': type(data.error).__name__,
+                'message': data.error.get_message(),
+            } if data.error else None,
+        })
+        count += 1
+    _write_json_line(fp, {'type': 'footer', 'count': count})
+    return count
+
+
+def _write_json_line(fp: IO[str], data: Dict[str, Any]) -> None:
+    fp.write(json.dumps(data, sort_keys=True) + '\n')
+
+
+def merge_partials(filenames: Iterable[str]) -> List[MeterImageData]:
+    """
+    Merge partial result files to a single result list.
+
+    The results are ordered by the timestamps in the filenames.  Raise
+    a MergeError if the shards are inconsistent, there are missing or
+    incomplete shards, or some files are included more than once.
+    """
+    problems: List[str] = []
+    shards: Dict[int, str] = {}
+    common_info: Optional[Tuple[Any, ...]] = None
+    sources: Dict[Tuple[str, Optional[str]], str] = {}
+    results: List[MeterImageData] = []
+
+    for filename in filenames:
+        (header, entries, footer) = _read_partial(filename)
+        shard = Shard.from_info(header)
+        info = (shard.total, shard.by, shard.start, shard.end,
+                header.get('params_file'))
+        if common_info is None:
+            common_info = info
+        elif info != common_info:
+            problems.append(f'{filename}: Shard set differs from others')
+            continue
+        if shard.number in shards:
+            problems.append('{}: Shard {} already in {}'.format(
+                filename, shard, shards[shard.number]))
+            continue
+        shards[shard.number] = filename
+        if footer is None:
+            problems.append(f'{filename}: Incomplete, footer missing')
+        elif footer.get('count') != len(entries):
+            problems.append('{}: Has {} results, but footer says {}'.format(
+                filename, len(entries), footer.get('count')))
+        for entry in entries:
+            data = _entry_to_data(entry)
+            if not shard.contains(data.filename):
+                problems.append('{}: {} does not belong to shard {}'.format(
+                    filename, data.filename, shard))
+            key = (data.filename, data.meter)
+            if key in sources:
+                problems.append('{}: Duplicate {}{} (also in {})'.format(
+                    filename, data.filename,
+                    f' [{data.meter}]' if data.meter is not None else '',
+                    sources[key]))
+                continue
+            sources[key] = filename
+            results.append(data)
+
+    if common_info is not None:
+        missing = [
+            f'{x}/{common_info[0]}' for x in range(1, common_info[0] + 1)
+            if x not in shards]
+        if missing:
+            problems.append('Missing shards: ' + ', '.join(missing))
+    else:
+        problems.append('No partial result files given')
+
+    if problems:
+        raise MergeError(problems)
+
+    return sorted(results, key=_get_result_sort_key)
+
+
+def _read_partial(
+        filename: str,
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    with open(filename, 'rt') as fp:
+        lines = [json.loads(line) for line in fp if line.strip()]
+    if (not lines or lines[0].get('type') != 'header' or
+            lines[0].get('format') != PARTIAL_FORMAT):
+        raise MergeError([f'{filename}: Not a partial result file'])
+    if lines[0].get('version') != PARTIAL_VERSION:
+        raise MergeError([f'{filename}: Unsupported version'])
+    footer = lines[-1] if lines[-1].get('type') == 'footer' else None
+    entries = [x for x in lines if x.get('type') == 'result']
+    return (lines[0], entries, footer)
+
+
+def _entry_to_data(entry: Dict[str, Any]) -> MeterImageData:
+    filename = entry['filename']
+    error: Optional[ImageProcessingError] = None
+    if entry.get('error'):
+        error_class = getattr(
+            exceptions, entry['error']['type'], ImageProcessingError)
+        if not (isinstance(error_class, type) and
+                issubclass(error_class, ImageProcessingError)):
+            error_class = ImageProcessingError
+        error = error_class(filename, entry['error']['message'])
+    return MeterImageData(
+        filename, entry.get('value'), error, entry.get('meter_values', {}),
+        entry.get('meter'), entry.get('tier'))
+
+
+def _get_result_sort_key(
+        data: MeterImageData,
+) -> Tuple[bool, datetime, str]:
+    timestamp = get_timestamp(data.filename)
+    return (timestamp is None, timestamp or datetime.min, data.filename)
@@ -0,0 +1,314 @@
+"""
+Local store of meter readings.
+
+The results of the processed images can be recorded to an SQLite
+database, so that reports can be made from the stored readings without
+processing the images again.  Each reading has the timestamp from the
+name of the image, the meter value and the other meter values like the
+dial positions, the class of the error if the image could not be read,
+and a fingerprint of the parameters the image was read with.  The
+readings are indexed by meter and time for fast range queries.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import (
+    TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, NamedTuple, Optional,
+    Tuple)
+
+from ._filenames import get_timestamp
+from ._query import (
+    get_target_times, get_value_difference, interpolate_value)
+
+if TYPE_CHECKING:
+    from ._api import MeterImageData
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = '''
+CREATE TABLE readings (
+    id INTEGER PRIMARY KEY,
+    time TEXT,
+    filename TEXT NOT NULL,
+    meter TEXT NOT NULL,
+    value REAL,
+    meter_values TEXT NOT NULL,
+    error TEXT,
+    params_fingerprint TEXT
+);
+CREATE INDEX readings_by_time ON readings (meter, time);
+'''
+
+_COLUMNS = (
+    'time, filename, meter, value, meter_values, error, params_fingerprint')
+
+# Format of the times in the database, which sorts in time order
+_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# Largest backward step of the meter value considered as jitter
+MAX_JITTER = 0.05
+
+# Recorded readings are committed at least this often, in seconds
+COMMIT_INTERVAL = 1.0
+
+
+class StoreError(Exception):
+    pass
+
+
+class StoredReading(NamedTuple):
+    timestamp: Optional[datetime]
+    filename: str
+    meter: Optional[str]
+    value: Optional[float]
+    meter_values: Dict[str, float]  # Dial positions etc.
+    error: Optional[str]  # Name of the error class
+    params_fingerprint: Optional[str]
+
+
+class Consumption(NamedTuple):
+    start: datetime
+    end: datetime
+    amount: Optional[float]  # None if there are not enough readings
+
+
+class ReadingsStore:
+    """
+    Store of meter readings in an SQLite database file.
+
+    The database is created if it does not exist.  Use as a context
+    manager or call `close` when done.
+
+    The queries select the readings of a single meter by its name,
+    where None is the meter of parameters without named meters.
+    """
+    def __init__(self, filename: str) -> None:
+        self.filename = filename
+        self._db = sqlite3.connect(filename)
+        self._last_commit = time.monotonic()
+        try:
+            self._init_schema()
+        except sqlite3.DatabaseError as error:
+            self._db.close()
+            raise StoreError(
+                f'Cannot open readings store {filename}: {error}')
+
+    def __enter__(self) -> 'ReadingsStore':
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._db.commit()
+        self._db.close()
+
+    def _init_schema(self) -> None:
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if version == 0:
+            self._db.executescript(_SCHEMA)
+            self._db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self._db.commit()
+        elif version != SCHEMA_VERSION:
+            raise StoreError(
+                f'Unsupported readings store version {version}: '
+                f'{self.filename}')
+
+    def record(
+            self,
+            results: Iterable['MeterImageData'],
+            params_file: Optional[str] = None,
+    ) -> Iterator['MeterImageData']:
+        """
+        Record results to the store while iterating them.
+
+        The results are yielded on after they are recorded, so that
+        they can be printed or written elsewhere too.  Uncommitted
+        readings are committed when the store is closed.  If the
+        parameters file is given, the readings get the fingerprints of
+        its meters.
+        """
+        fingerprints = (
+            get_params_fingerprints(params_file) if params_file else {})
+        for data in results:
+            self.add(data, fingerprints.get(data.meter or ''))
+            if time.monotonic() - self._last_commit >= COMMIT_INTERVAL:
+                self.commit()
+            yield data
+        self.commit()
+
+    def add(
+            self,
+            data: 'MeterImageData',
+            params_fingerprint: Optional[str] = None,
+    ) -> None:
+        """
+        Add a result to the store.
+
+        The result is timestamped by the timestamp in its filename.
+        """
+        timestamp = get_timestamp(data.filename)
+        self._db.execute(
+            f'INSERT INTO readings ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (timestamp.strftime(_TIME_FORMAT) if timestamp else None,
+             data.filename, data.meter or '', data.value,
+             json.dumps(data.meter_values, sort_keys=True),
+             type(data.error).__name__ if data.error else None,
+             params_fingerprint))
+
+    def commit(self) -> None:
+        self._db.commit()
+        self._last_commit = time.monotonic()
+
+    def iter_range(
+            self,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None,
+            meter: Optional[str] = None,
+            *,
+            valid_only: bool = False,
+    ) -> Iterator[StoredReading]:
+        """
+        Iterate readings of a meter in time order.
+
+        Readings earlier than start or later than or equal to end are
+        skipped, as are readings without a timestamp.  With
+        `valid_only` only readings with a value are included.
+        """
+        conditions = ['meter = ?', 'time IS NOT NULL']
+        args: List[object] = [meter or '']
+        if start is not None:
+            conditions.append('time >= ?')
+            args.append(start.strftime(_TIME_FORMAT))
+        if end is not None:
+            conditions.append('time < ?')
+            args.append(end.strftime(_TIME_FORMAT))
+        if valid_only:
+            conditions.append('value IS NOT NULL')
+        cursor = self._db.execute(
+            f'SELECT {_COLUMNS} FROM readings '
+            f'WHERE {" AND ".join(conditions)} ORDER BY time, id', args)
+        for row in cursor:
+            yield _make_reading(row)
+
+    def get_latest(
+            self,
+            meter: Optional[str] = None,
+    ) -> Optional[StoredReading]:
+        """
+        Get the latest reading of a meter with a value.
+        """
+        return self._get_nearest_reading(meter, '<=', datetime.max)
+
+    def get_value_at(
+            self,
+            target: datetime,
+            meter: Optional[str] = None,
+    ) -> Optional[float]:
+        """
+        Get meter value at given time.
+
+        The value is interpolated between the nearest readings before
+        and after the time, or None if there are no such readings.
+        """
+        before = self._get_nearest_reading(meter, '<=', target)
+        if before is not None and before.timestamp == target:
+            return before.value
+        after = self._get_nearest_reading(meter, '>=', target)
+        if before is None or after is None:
+            return None
+        assert before.timestamp is not None
+        assert after.timestamp is not None
+        return interpolate_value(
+            target, before.timestamp, before.value,
+            after.timestamp, after.value)
+
+    def get_consumption(
+            self,
+            start: datetime,
+            end: datetime,
+            interval: timedelta,
+            meter: Optional[str] = None,
+    ) -> List[Consumption]:
+        """
+        Get consumption of a meter per interval from start to end.
+
+        The consumption of an interval is the difference of the meter
+        values interpolated at its boundaries.  The meter is assumed to
+        move less than half of the value range per interval.  Backward
+        steps up to `MAX_JITTER` are jitter of the readings and count
+        as no consumption, while larger ones are left negative.
+        """
+        times = list(get_target_times(start, end, interval))
+        values = [self.get_value_at(x, meter) for x in times]
+        return [
+            Consumption(
+                time1, time2,
+                _get_consumption(value1, value2)
+                if value1 is not None and value2 is not None else None)
+            for (time1, value1, time2, value2) in zip(
+                times, values, times[1:], values[1:])]
+
+    def _get_nearest_reading(
+            self,
+            meter: Optional[str],
+            operator: str,
+            target: datetime,
+    ) -> Optional[StoredReading]:
+        order = 'DESC' if operator == '<=' else 'ASC'
+        row = self._db.execute(
+            f'SELECT {_COLUMNS} FROM readings '
+            f'WHERE meter = ? AND time {operator} ? AND value IS NOT NULL '
+            f'ORDER BY time {order}, id {order} LIMIT 1',
+            (meter or '', target.strftime(_TIME_FORMAT))).fetchone()
+        return _make_reading(row) if row else None
+
+
+def get_params_fingerprints(params_file: str) -> Dict[str, str]:
+    """
+    Get fingerprints of the parameters of the meters in a file.
+
+    The fingerprint of a meter changes when its parameters or its dials
+    template change.
+
+    :return: mapping from meter name, or '' for an unnamed meter, to
+      the fingerprint
+    """
+    from . import _params
+
+    meter_data = dict(_params.load_meter_data(params_file))
+    fingerprints: Dict[str, str] = {}
+    for params in _params.load_meters(params_file):
+        digest = hashlib.sha1(json.dumps(
+            meter_data[params.name], sort_keys=True, default=str,
+        ).encode('utf-8'))
+        with open(params.dials_file, 'rb') as fp:
+            digest.update(fp.read())
+        fingerprints[params.name or ''] = digest.hexdigest()
+    return fingerprints
+
+
+def _get_consumption(value1: float, value2: float) -> float:
+    """
+    Get consumption between two meter values.
+
+    >>> _get_consumption(999.5, 0.5)
+    1.0
+    >>> _get_consumption(948.603, 948.602)
+    0.0
+    >>> round(_get_consumption(948.6, 938.6), 6)
+    -10.0
+    """
+    difference = get_value_difference(value1, value2)
+    return 0.0 if -MAX_JITTER <= difference < 0 else difference
+
+
+def _make_reading(row: Tuple[Any, ...]) -> StoredReading:
+    (time_str, filename, meter, value, meter_values, error,
+     params_fingerprint) = row
+    return StoredReading(
+        datetime.strptime(time_str, _TIME_FORMAT) if time_str else None,
+        filename, meter or None, value, json.loads(meter_values), error,
+        params_fingerprint)
@@ -0,0 +1,459 @@
+"""
+Sweep of parameter variants against images with known values.
+
+Tuning the color ranges and thresholds of a parameters file is done by
+reading a set of sample images with many variants of the parameters
+and comparing the results to the expected values.  Decoding the images
+and locating the dials dominates the processing time, but does not
+depend on the swept parameters, so the located dials areas are
+computed once and cached, optionally to a NumPy file which is memory
+mapped by the worker processes.
+
+Only the parameters which are applied after the dials have been
+located can be swept.  The "needle_color" and "needle_color_range"
+parameters are used only by the calibration and thus cannot be swept.
+"""
+import copy
+import hashlib
+import itertools
+import json
+import os
+import random
+from typing import (
+    Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple)
+
+import numpy
+import yaml
+
+from . import _params
+from ._image import ImageFile, crop_meter, load_image
+from ._reading import get_meter_value_of_dials
+from ._utils import crop_rect
+from .exceptions import ImageProcessingError
+
+SWEEPABLE_KEYS = [
+    'dials_template_match_threshold',
+    'reading_method',
+    'fast_reading_scale',
+    'fast_reading_min_confidence',
+    'polar_angle_bins',
+]
+
+SWEEPABLE_NEEDLE_KEYS = [
+    'color_range/h',
+    'color_range/l',
+    'color_range/s',
+    'dist_from_center',
+    'circle_thickness',
+    'angle_of_zero',
+]
+
+# Maximum difference of a read value to the expected value to count as
+# a match.  The same limit is used by the sample image tests.
+MAX_VALUE_DIFF = 0.005
+
+Change = Tuple[str, Any]
+
+
+class SweepError(Exception):
+    pass
+
+
+class Variation(NamedTuple):
+    key: str
+    values: List[Any]
+
+    @classmethod
+    def parse(cls, text: str) -> 'Variation':
+        """
+        Parse variation from text like "KEY=VALUES".
+
+        The values are either a comma separated list or an inclusive
+        range "START:STOP:STEP".  Needle parameters are given with keys
+        like "needle_data/0.01/circle_thickness", where "*" may be used
+        as the needle name to change all needles at once.
+
+        >>> Variation.parse('needle_data/*/color_range/h=8:12:2')
+        Variation(key='needle_data/*/color_range/h', values=[8, 10, 12])
+        >>> Variation.parse('reading_method=full,tiered')
+        Variation(key='reading_method', values=['full', 'tiered'])
+        """
+        (key, sep, values_text) = text.partition('=')
+        if not sep or not values_text:
+            raise ValueError(f'Variation must be KEY=VALUES: {text}')
+        _check_key(key)
+        if ':' in values_text:
+            values = _parse_range(values_text)
+        else:
+            values = [_parse_value(x) for x in values_text.split(',')]
+        return cls(key, values)
+
+
+class SweepResult(NamedTuple):
+    changes: Tuple[Change, ...]
+    matches: int
+    total: int
+    error_sum: float  # Sum of differences of the values read in both
+
+    def get_sort_key(self) -> Tuple[int, float]:
+        return (-self.matches, self.error_sum)
+
+    def describe_changes(self) -> str:
+        return ', '.join(f'{k}={v}' for (k, v) in self.changes) or 'baseline'
+
+
+class DialsCache(NamedTuple):
+    filenames: List[str]
+    match_values: numpy.ndarray  # NaN for images which cannot be loaded
+    dials_hls: numpy.ndarray  # Located dials areas of all images
+
+
+def build_dials_cache(
+        params: _params.Params,
+        filenames: Sequence[str],
+        cache_file: Optional[str] = None,
+) -> DialsCache:
+    """
+    Locate the dials from the images ignoring the match threshold.
+
+    If a cache file is given, the result is saved to it (and to a JSON
+    file next to it) and loaded memory mapped from there, unless the
+    file already has the data of the same images and parameters.
+    """
+    fingerprint = _get_cache_fingerprint(params, filenames)
+    if cache_file:
+        cache = _load_dials_cache(cache_file, fingerprint)
+        if cache is not None:
+            return cache
+
+    (h, w) = params.dials_template_size
+    match_values = numpy.full(len(filenames), numpy.nan)
+    dials_hls = numpy.zeros((len(filenames), h, w, 3), dtype=numpy.uint8)
+    for (n, filename) in enumerate(filenames):
+        try:
+            bgr_image = crop_meter(load_image(filename), params)
+        except ImageProcessingError:
+            continue
+        imgf = ImageFile(filename, params, bgr_image)
+        match_result = imgf.match_dials_template()
+        match_values[n] = match_result.max_val
+        dials_hls[n] = crop_rect(imgf.get_hls_image(), match_result.rect)
+
+    if not cache_file:
+        return DialsCache(list(filenames), match_values, dials_hls)
+    numpy.save(cache_file, dials_hls)
+    with open(_get_cache_info_file(cache_file), 'wt') as fp:
+        json.dump({
+            'fingerprint': fingerprint,
+            'filenames': list(filenames),
+            'match_values': [
+                None if numpy.isnan(x) else float(x) for x in match_values],
+        }, fp)
+    loaded_cache = _load_dials_cache(cache_file, fingerprint)
+    assert loaded_cache is not None
+    return loaded_cache
+
+
+def _load_dials_cache(
+        cache_file: str,
+        fingerprint: Optional[str] = None,
+) -> Optional[DialsCache]:
+    try:
+        with open(_get_cache_info_file(cache_file), 'rt') as fp:
+            info = json.load(fp)
+        if fingerprint and info.get('fingerprint') != fingerprint:
+            return None
+        dials_hls = numpy.load(cache_file, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    match_values = numpy.array([
+        numpy.nan if x is None else x for x in info['match_values']])
+    return DialsCache(info['filenames'], match_values, dials_hls)
+
+
+def _get_cache_info_file(cache_file: str) -> str:
+    return os.path.splitext(cache_file)[0] + '.json'
+
+
+def _get_cache_fingerprint(
+        params: _params.Params,
+        filenames: Sequence[str],
+) -> str:
+    files = [params.dials_file] + list(filenames)
+    stats = [os.stat(x) if os.path.exists(x) else None for x in files]
+    data = [
+        params.meter_rect, params.dials_match_method,
+        params.dials_template_size, params.hue_shift,
+        [(x, (s.st_size, s.st_mtime_ns) if s else None)
+         for (x, s) in zip(files, stats)],
+    ]
+    return hashlib.sha1(json.dumps(data).encode('utf-8')).hexdigest()
+
+
+def read_expected_values(filename: str) -> Dict[str, Optional[float]]:
+    """
+    Read expected values from a file in the output format of meterelf.
+
+    :return: mapping from image filename to its value, or None if the
+      value is expected to be unknown
+    """
+    result: Dict[str, Optional[float]] = {}
+    with open(filename, 'rt') as fp:
+        for line in fp:
+            (image_filename, sep, value_text) = line.strip().partition(': ')
+            if not sep:
+                continue
+            is_unknown = value_text.startswith('UNKNOWN')
+            result[image_filename] = None if is_unknown else float(value_text)
+    return result
+
+
+def run_sweep(
+        params_file: str,
+        expected_file: str,
+        variations: Sequence[Variation],
+        *,
+        meter: Optional[str] = None,
+        image_dir: Optional[str] = None,
+        cache_file: Optional[str] = None,
+        random_count: Optional[int] = None,
+        seed: Optional[int] = None,
+        workers: int = 1,
+) -> List[SweepResult]:
+    """
+    Evaluate variants of parameters against images with known values.
+
+    The variants are all combinations of the variation values, or
+    `random_count` randomly picked combinations of them.  The
+    unmodified parameters are always evaluated too.  The images are
+    the ones listed in the expected values file and they are looked up
+    from `image_dir`, which defaults to the directory of the
+    parameters file.
+
+    :return: results of the variants, the best first
+    """
+    (base_dir, name, data) = _get_meter_data(params_file, meter)
+    params = _params.Params(base_dir, data, name)
+    expected = read_expected_values(expected_file)
+    if image_dir is None:
+        image_dir = base_dir
+    filenames = [os.path.join(image_dir, x) for x in expected]
+    cache = build_dials_cache(params, filenames, cache_file)
+
+    variants = [()] + [
+        x for x in _iter_variants(variations, random_count, seed) if x]
+    context = _SweepContext(
+        base_dir, name, data, list(expected.values()), cache_file, cache)
+    if workers > 1 and len(variants) > 1:
+        import multiprocessing
+        with multiprocessing.Pool(
+                workers, _init_worker, (context,)) as pool:
+            results = pool.map(_evaluate_in_worker, variants)
+    else:
+        results = [context.evaluate(x) for x in variants]
+    return sorted(results, key=SweepResult.get_sort_key)
+
+
+def write_params_file(
+        filename: str,
+        params_file: str,
+        changes: Sequence[Change],
+        meter: Optional[str] = None,
+) -> None:
+    """
+    Write parameters with the changes applied to a file.
+
+    The file paths in the parameters are rewritten relative to the
+    directory of the new file.  Comments and key order of the original
+    file are not preserved.
+    """
+    (base_dir, _name, data) = _get_meter_data(params_file, meter)
+    new_data = apply_changes(data, changes)
+    new_data.pop('name', None)
+    out_dir = os.path.dirname(filename)
+    for key in ['dials_template', 'image_glob']:
+        path = os.path.join(base_dir, new_data[key])
+        new_data[key] = os.path.relpath(path, out_dir or os.curdir)
+    with open(filename, 'wt') as fp:
+        yaml.safe_dump(new_data, fp)
+
+
+def apply_changes(
+        data: Dict[Any, Any],
+        changes: Sequence[Change],
+) -> Dict[Any, Any]:
+    """
+    Apply changes to a copy of parameter data.
+    """
+    result = copy.deepcopy(data)
+    for (key, value) in changes:
+        if not key.startswith('needle_data/'):
+            result[key] = value
+            continue
+        (needle_name, needle_key) = key.split('/', 2)[1:]
+        needles = [
+            x for x in result['needle_data']
+            if needle_name in ('*', x.get('name'))]
+        if not needles:
+            raise SweepError(f'No needle named {needle_name}')
+        for needle in needles:
+            target = needle
+            path = needle_key.split('/')
+            for part in path[:-1]:
+                target = target[part]
+            target[path[-1]] = value
+    return result
+
+
+def _get_meter_data(
+        params_file: str,
+        meter: Optional[str],
+) -> Tuple[str, Optional[str], Dict[Any, Any]]:
+    base_dir = os.path.dirname(params_file)
+    meters = _params.load_meter_data(params_file)
+    if meter is None and len(meters) == 1:
+        return (base_dir, meters[0][0], meters[0][1])
+    for (name, data) in meters:
+        if name == meter:
+            return (base_dir, name, data)
+    names = ', '.join(x[0] or '' for x in meters)
+    raise SweepError(f'Select one of the meters in {params_file}: {names}')
+
+
+def _iter_variants(
+        variations: Sequence[Variation],
+        random_count: Optional[int],
+        seed: Optional[int],
+) -> Iterator[Tuple[Change, ...]]:
+    value_lists = [x.values for x in variations]
+    if random_count is None:
+        for values in itertools.product(*value_lists):
+            yield tuple(zip((x.key for x in variations), values))
+        return
+    counts = [len(x) for x in value_lists]
+    combination_count = int(numpy.prod(counts))
+    rng = random.Random(seed)
+    picked = rng.sample(
+        range(combination_count), min(random_count, combination_count))
+    for number in picked:
+        changes = []
+        for (variation, count) in zip(variations, counts):
+            (number, index) = divmod(number, count)
+            changes.append((variation.key, variation.values[index]))
+        yield tuple(changes)
+
+
+class _SweepContext:
+    def __init__(
+            self,
+            base_dir: str,
+            name: Optional[str],
+            data: Dict[Any, Any],
+            expected_values: List[Optional[float]],
+            cache_file: Optional[str],
+            cache: DialsCache,
+    ) -> None:
+        self.base_dir = base_dir
+        self.name = name
+        self.data = data
+        self.expected_values = expected_values
+        self.cache_file = cache_file
+        self.cache: Optional[DialsCache] = cache
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Worker processes map the cache file rather than get a copy
+        state = self.__dict__.copy()
+        if self.cache_file:
+            state['cache'] = None
+        return state
+
+    def get_cache(self) -> DialsCache:
+        if self.cache is None:
+            assert self.cache_file
+            self.cache = _load_dials_cache(self.cache_file)
+            if self.cache is None:
+                raise SweepError(f'Cannot load cache: {self.cache_file}')
+        return self.cache
+
+    def evaluate(self, changes: Tuple[Change, ...]) -> SweepResult:
+        data = apply_changes(self.data, changes)
+        params = _params.Params(self.base_dir, data, self.name)
+        cache = self.get_cache()
+        matches = 0
+        error_sum = 0.0
+        for (n, expected) in enumerate(self.expected_values):
+            value = self._get_value(params, cache, n)
+            if value is None or expected is None:
+                matches += int(value == expected)
+                continue
+            diff = abs(value - expected)
+            diff = min(diff, abs(diff - 1000))
+            matches += int(diff < MAX_VALUE_DIFF)
+            error_sum += diff
+        total = len(self.expected_values)
+        return SweepResult(changes, matches, total, error_sum)
+
+    def _get_value(
+            self,
+            params: _params.Params,
+            cache: DialsCache,
+            n: int,
+    ) -> Optional[float]:
+        match_value = cache.match_values[n]
+        if numpy.isnan(match_value):
+            return None
+        if match_value < params.dials_match_threshold:
+            return None
+        imgf = ImageFile(cache.filenames[n], params)
+        try:
+            meter_values = get_meter_value_of_dials(imgf, cache.dials_hls[n])
+        except ImageProcessingError:
+            return None
+        return meter_values.get('value')
+
+
+_worker_context: Optional[_SweepContext] = None
+
+
+def _init_worker(context: _SweepContext) -> None:
+    global _worker_context
+    _worker_context = context
+
+
+def _evaluate_in_worker(changes: Tuple[Change, ...]) -> SweepResult:
+    assert _worker_context is not None
+    return _worker_context.evaluate(changes)
+
+
+def _check_key(key: str) -> None:
+    if key.startswith('needle_data/'):
+        parts = key.split('/', 2)
+        if len(parts) == 3 and parts[1] and (
+                parts[2] in SWEEPABLE_NEEDLE_KEYS):
+            return
+    elif key in SWEEPABLE_KEYS:
+        return
+    raise ValueError(f'Parameter cannot be swept: {key}')
+
+
+def _parse_range(text: str) -> List[Any]:
+    parts = [_parse_value(x) for x in text.split(':')]
+    if len(parts) != 3 or not all(isinstance(x, (int, float)) for x in parts):
+        raise ValueError(f'Range must be START:STOP:STEP: {text}')
+    (start, stop, step) = parts
+    if step <= 0 or stop < start:
+        raise ValueError(f'Invalid range: {text}')
+    count = int(round((stop - start) / step)) + 1
+    values = [start + n * step for n in range(count)]
+    if all(isinstance(x, int) for x in parts):
+        return values
+    return [round(x, 10) for x in values]
+
+
+def _parse_value(text: str) -> Any:
+    for tp in (int, float):
+        try:
+            return tp(text)
+        except ValueError:
+            pass
+    return text
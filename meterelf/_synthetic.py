@@ -0,0 +1,359 @@
+"""
+Synthetic meter images with known values.
+
+The images are rendered from a parameters file: The dials template is
+drawn to the meter area as the face of the meter, the dials are
+cleared and needles of the configured needle color are drawn to the
+dial centers at the angles of known dial positions.  The lighting,
+noise, blur, JPEG quality and the location of the dials are varied
+randomly.  The value, which the dial positions give, is recorded as
+the ground truth of each image.
+
+The images are generated from a seed and their index, so that a corpus
+can be generated in parallel and regenerated identically.
+"""
+import math
+import os
+from datetime import datetime, timedelta
+from typing import (
+    Any, Dict, Iterable, Iterator, NamedTuple, Optional, Sequence, TextIO,
+    Tuple)
+
+import cv2
+import numpy
+
+from . import _params
+from ._colors import BgrColor
+from ._image import _get_dials_template
+from ._params import Params as _Params
+from ._reading import determine_value_by_dial_positions
+from ._types import Image
+from ._utils import convert_to_bgr, float_point_to_int
+
+# Lightness of the cleared dial faces
+FACE_LIGHTNESS = 215
+
+# Margin around the meter area in the generated images
+FRAME_MARGIN = 20
+
+DEFAULT_START = datetime(2018, 1, 1)
+
+# Number of fractional bits in the coordinates of the drawn shapes
+_SHIFT = 4
+
+# Files written to the corpus directory besides the images
+EXPECTED_FILENAME = 'expected.txt'
+PARAMS_FILENAME = 'params.yml'
+
+
+class Variation(NamedTuple):
+    """
+    Ranges of the random variation of the images.
+
+    The amount of each variation is picked uniformly per image from
+    the range given by the limit.
+    """
+    # Maximum offset of the dials from the center of the meter area
+    max_shift: int = 10
+    # Maximum relative change of the brightness and maximum relative
+    # difference of the brightness between the edges of the image
+    max_lighting: float = 0.15
+    # Maximum standard deviation of the Gaussian noise
+    max_noise: float = 6.0
+    # Maximum sigma of the Gaussian blur
+    max_blur: float = 0.8
+    # Lowest JPEG quality
+    min_quality: int = 75
+
+
+class SyntheticImage(NamedTuple):
+    filename: str
+    value: float
+    dial_positions: Dict[str, float]
+
+
+def get_dial_positions(
+        value: float,
+        dial_names: Sequence[str],
+) -> Dict[str, float]:
+    """
+    Get dial positions showing given meter value.
+
+    The dials are ordered by their names, so that the first one is the
+    finest dial, which shows the tenths of the value.
+
+    >>> positions = get_dial_positions(
+    ...     123.45, ['0.0001', '0.001', '0.01', '0.1'])
+    >>> {k: round(v, 3) for (k, v) in positions.items()}
+    {'0.0001': 4.5, '0.001': 3.45, '0.01': 2.345, '0.1': 1.234}
+    """
+    return {
+        name: (value * 10.0 / 10**i) % 10.0
+        for (i, name) in enumerate(sorted(dial_names))}
+
+
+def render_image(
+        params: _Params,
+        dial_positions: Dict[str, float],
+        rng: numpy.random.RandomState,
+        variation: Variation = Variation(),
+) -> Image:
+    """
+    Render BGR image of a meter with given dial positions.
+
+    The meter area of the image is at the meter rect of the parameters
+    and the dials are placed near its center.
+    """
+    template = _get_dials_template(params)
+    (t_h, t_w) = template.shape[0:2]
+    (m_x0, m_y0) = params.meter_rect.top_left
+    (m_x1, m_y1) = params.meter_rect.bottom_right
+    (width, height) = (m_x1 + FRAME_MARGIN, m_y1 + FRAME_MARGIN)
+
+    lightness = numpy.empty((height, width), dtype=numpy.float32)
+    lightness.fill(float(numpy.median(template)))
+    (shift_x, shift_y) = rng.randint(
+        -variation.max_shift, variation.max_shift + 1, size=2)
+    x0 = max(m_x0, min((m_x0 + m_x1 - t_w) // 2 + shift_x, m_x1 - t_w))
+    y0 = max(m_y0, min((m_y0 + m_y1 - t_h) // 2 + shift_y, m_y1 - t_h))
+    face = template.astype(numpy.float32)
+    for (name, dial_center) in params.dial_centers.items():
+        cv2.circle(
+            face, float_point_to_int(dial_center.center),
+            _get_outer_radius(params, name) + 2, FACE_LIGHTNESS, -1)
+    lightness[y0:y0 + t_h, x0:x0 + t_w] = face
+
+    image = cv2.cvtColor(
+        numpy.clip(lightness, 0, 255).astype(numpy.uint8),
+        cv2.COLOR_GRAY2BGR)
+    needle_bgr = _get_needle_bgr(params)
+    for (name, position) in dial_positions.items():
+        _draw_needle(params, image, name, position, (x0, y0), needle_bgr)
+
+    return _apply_variation(image, rng, variation)
+
+
+def _get_outer_radius(params: _Params, name: str) -> int:
+    dial_radius = int(round(params.dial_centers[name].diameter / 2.0))
+    return (
+        dial_radius + params.needle_dists_from_dial_center[name] +
+        params.needle_circle_mask_thickness[name])
+
+
+def _get_needle_bgr(params: _Params) -> BgrColor:
+    hls = numpy.array([[params.needle_color]], dtype=numpy.uint8)
+    bgr = convert_to_bgr(params, hls)[0, 0]
+    return BgrColor(int(bgr[0]), int(bgr[1]), int(bgr[2]))
+
+
+def _draw_needle(
+        params: _Params,
+        image: Image,
+        name: str,
+        position: float,
+        offset: Sequence[int],
+        color: BgrColor,
+) -> None:
+    dial_center = params.dial_centers[name]
+    (c_x, c_y) = (
+        dial_center.center[0] + offset[0], dial_center.center[1] + offset[1])
+    angle = 2 * math.pi * (
+        position / 10.0 + params.needle_angles_of_zero[name] / 360.0)
+    (dir_x, dir_y) = (math.sin(angle), -math.cos(angle))
+    dial_radius = dial_center.diameter / 2.0
+    ring_thickness = params.needle_circle_mask_thickness[name]
+    start_radius = _get_outer_radius(params, name) - ring_thickness
+    if name in params.negative_momentum_dials:
+        # Thin needle with a heavy counterweight, which outweighs the
+        # tip in the momentum.  The counterweight may reach the needle
+        # circle, since only the points near the tip are used there.
+        length = start_radius + ring_thickness / 2.0
+        (base_width, tip_width) = (1.0, 1.0)
+        tail_dist = start_radius * 0.7
+        tail_radius = start_radius * 0.5
+    else:
+        length = start_radius + ring_thickness - 1.0
+        (base_width, tip_width) = (max(dial_radius / 2.5, 2.0), 1.0)
+        tail_dist = dial_radius * 0.4
+        tail_radius = base_width
+    tip = (c_x + length * dir_x, c_y + length * dir_y)
+    tail = (c_x - tail_dist * dir_x, c_y - tail_dist * dir_y)
+    (side_x, side_y) = (-dir_y, dir_x)
+    polygon = numpy.array([
+        (c_x + side_x * base_width, c_y + side_y * base_width),
+        (tip[0] + side_x * tip_width, tip[1] + side_y * tip_width),
+        (tip[0] - side_x * tip_width, tip[1] - side_y * tip_width),
+        (c_x - side_x * base_width, c_y - side_y * base_width),
+    ])
+    # Draw with sub-pixel precision
+    scale = 2**_SHIFT
+    cv2.fillPoly(
+        image, [(polygon * scale).round().astype(numpy.int32)], color,
+        cv2.LINE_AA, _SHIFT)
+    for (point, radius) in [
+            ((c_x, c_y), dial_radius / 2.0 + 1),
+            (tail, tail_radius)]:
+        cv2.circle(
+            image, float_point_to_int((point[0] * scale, point[1] * scale)),
+            int(round(radius * scale)), color, -1, cv2.LINE_AA, _SHIFT)
+
+
+def _apply_variation(
+        image: Image,
+        rng: numpy.random.RandomState,
+        variation: Variation,
+) -> Image:
+    (height, width) = image.shape[0:2]
+    gain = 1.0 + rng.uniform(-variation.max_lighting, variation.max_lighting)
+    gradient_angle = rng.uniform(0, 2 * math.pi)
+    gradient = rng.uniform(0, variation.max_lighting)
+    (xs, ys) = numpy.meshgrid(
+        numpy.linspace(-0.5, 0.5, width), numpy.linspace(-0.5, 0.5, height))
+    lighting = gain * (1.0 + gradient * (
+        math.cos(gradient_angle) * xs + math.sin(gradient_angle) * ys))
+    result = image.astype(numpy.float32) * lighting[:, :, None]
+    blur = rng.uniform(0, variation.max_blur)
+    if blur > 0.1:
+        result = cv2.GaussianBlur(result, (0, 0), blur)
+    noise = rng.uniform(0, variation.max_noise)
+    result += rng.normal(0, noise, size=result.shape)
+    return numpy.clip(result + 0.5, 0, 255).astype(numpy.uint8)  # type: ignore
+
+
+def encode_jpeg(
+        image: Image,
+        rng: numpy.random.RandomState,
+        variation: Variation = Variation(),
+) -> bytes:
+    quality = rng.randint(variation.min_quality, 101)
+    (ok, data) = cv2.imencode(
+        '.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    assert ok
+    return data.tobytes()
+
+
+def generate_image(
+        params: _Params,
+        seed: int,
+        index: int,
+        variation: Variation = Variation(),
+) -> Tuple[bytes, Dict[str, float]]:
+    """
+    Generate JPEG image of a random meter value.
+
+    The image depends only on the parameters, the seed and the index.
+
+    :return: the JPEG data and the dial positions shown in the image
+    """
+    rng = numpy.random.RandomState([seed, index])
+    value = round(rng.uniform(0.0, 1000.0), 3) % 1000.0
+    dial_positions = get_dial_positions(value, list(params.dial_centers))
+    image = render_image(params, dial_positions, rng, variation)
+    return (encode_jpeg(image, rng, variation), dial_positions)
+
+
+def generate_corpus(
+        params_file: str,
+        output_dir: str,
+        count: int,
+        *,
+        meter: Optional[str] = None,
+        seed: int = 0,
+        start: datetime = DEFAULT_START,
+        interval: timedelta = timedelta(minutes=1),
+        variation: Variation = Variation(),
+        workers: int = 1,
+) -> Iterator[SyntheticImage]:
+    """
+    Generate a corpus of synthetic images to a directory.
+
+    The images are named by their timestamps, which start from `start`
+    and advance by `interval`.  The values of the images are random
+    and uniformly distributed.  The ground truth is written to file
+    "expected.txt" of the directory in the output format of meterelf,
+    so that it can be used as the expected values file of a sweep.  A
+    parameters file matching the images is written to "params.yml".
+
+    The images are generated while the returned iterator is consumed.
+    """
+    params = _params.load(params_file, meter)
+    if len(params.dial_centers) != 4:
+        raise ValueError('Ground truth needs a meter with four dials')
+    os.makedirs(output_dir, exist_ok=True)
+    abs_output_dir = os.path.abspath(output_dir)
+    from ._sweep import write_params_file
+    write_params_file(
+        os.path.join(output_dir, PARAMS_FILENAME), params_file,
+        [('image_glob', os.path.join(abs_output_dir, '*.jpg'))], meter)
+
+    context = _GeneratorContext(
+        params_file, meter, output_dir, seed, start, interval, variation)
+    with open(os.path.join(output_dir, EXPECTED_FILENAME), 'wt') as fp:
+        if workers > 1:
+            import multiprocessing
+            with multiprocessing.Pool(
+                    workers, _init_worker, (context,)) as pool:
+                yield from _write_expected(fp, pool.imap(
+                    _generate_in_worker, range(count), chunksize=16))
+        else:
+            yield from _write_expected(
+                fp, (context.generate(i) for i in range(count)))
+
+
+def _write_expected(
+        fp: TextIO,
+        images: Iterable[SyntheticImage],
+) -> Iterator[SyntheticImage]:
+    for image in images:
+        fp.write(f'{image.filename}: {image.value:07.3f}\n')
+        yield image
+
+
+class _GeneratorContext:
+    def __init__(
+            self,
+            params_file: str,
+            meter: Optional[str],
+            output_dir: str,
+            seed: int,
+            start: datetime,
+            interval: timedelta,
+            variation: Variation,
+    ) -> None:
+        self.params_file = params_file
+        self.meter = meter
+        self.output_dir = output_dir
+        self.seed = seed
+        self.start = start
+        self.interval = interval
+        self.variation = variation
+        self._params: Optional[_Params] = None
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The parameters are loaded again in the worker processes
+        return dict(self.__dict__, _params=None)
+
+    def generate(self, index: int) -> SyntheticImage:
+        if self._params is None:
+            self._params = _params.load(self.params_file, self.meter)
+        (data, dial_positions) = generate_image(
+            self._params, self.seed, index, self.variation)
+        timestamp = self.start + index * self.interval
+        filename = f'{timestamp:%Y%m%d%H%M%S}-s{index:06d}.jpg'
+        with open(os.path.join(self.output_dir, filename), 'wb') as fp:
+            fp.write(data)
+        value = determine_value_by_dial_positions(dial_positions)
+        return SyntheticImage(filename, value, dial_positions)
+
+
+_worker_context: Optional[_GeneratorContext] = None
+
+
+def _init_worker(context: _GeneratorContext) -> None:
+    global _worker_context
+    _worker_context = context
+
+
+def _generate_in_worker(index: int) -> SyntheticImage:
+    assert _worker_context is not None
+    return _worker_context.generate(index)
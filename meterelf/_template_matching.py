@@ -0,0 +1,174 @@
+"""
+Template matching engine with selectable backends.
+
+The backend is chosen with the ``dials_template_match_method`` setting
+of the parameters file:
+
+  ccoeff
+    Match with ``cv2.TM_CCOEFF`` at full resolution.  This is the
+    default.
+
+  pyramid
+    Coarse-to-fine search: Find the best match from downscaled
+    versions of the image and template and then refine it at full
+    resolution within a small neighbourhood.  Scores are comparable
+    to the ``ccoeff`` ones.
+
+  spectrum
+    Compute the ``TM_CCOEFF`` correlation in the frequency domain with
+    a spectrum of the template which is calculated once per parameters
+    and image size.  Scores are comparable to the ``ccoeff`` ones.
+
+  normed
+    Match with ``cv2.TM_CCOEFF_NORMED``.  Scores are in range from -1
+    to 1 and do not depend on the size or brightness of the image, so
+    the threshold should be given as a float, e.g. 0.5.
+"""
+from typing import Callable, Dict, List, Tuple
+from weakref import WeakKeyDictionary
+
+import cv2
+import numpy
+
+from ._params import Params as _Params
+from ._types import Image, Rect, TemplateMatchResult
+from ._utils import match_template as _match_template_ccoeff
+
+PYRAMID_LEVELS = 2
+PYRAMID_REFINE_MARGIN = 2  # in pixels of the coarsest level
+
+_Matcher = Callable[[Image, Image, _Params], TemplateMatchResult]
+
+
+def match_template(
+        img: Image,
+        template: Image,
+        params: _Params,
+) -> TemplateMatchResult:
+    matcher = _MATCHERS[params.dials_match_method]
+    return matcher(img, template, params)
+
+
+def match_template_ccoeff(
+        img: Image,
+        template: Image,
+        params: _Params,
+) -> TemplateMatchResult:
+    return _match_template_ccoeff(img, template)
+
+
+def match_template_normed(
+        img: Image,
+        template: Image,
+        params: _Params,
+) -> TemplateMatchResult:
+    res = cv2.matchTemplate(img, template, cv2.TM_CCOEFF_NORMED)
+    return _get_best_match(res, template, (0, 0))
+
+
+def match_template_pyramid(
+        img: Image,
+        template: Image,
+        params: _Params,
+) -> TemplateMatchResult:
+    templates = _get_template_pyramid(template, params)
+    small_img = img
+    for _level in range(len(templates) - 1):
+        small_img = cv2.pyrDown(small_img)
+    small_template = templates[-1]
+    (s_h, s_w) = small_template.shape[0:2]
+    if small_img.shape[0] < s_h or small_img.shape[1] < s_w:
+        return _match_template_ccoeff(img, template)
+    coarse_res = cv2.matchTemplate(
+        small_img, small_template, cv2.TM_CCOEFF_NORMED)
+    (_min_val, _max_val, _min_loc, coarse_loc) = cv2.minMaxLoc(coarse_res)
+
+    # Refine the match at full resolution around the coarse location
+    scale = 2 ** (len(templates) - 1)
+    margin = PYRAMID_REFINE_MARGIN * scale
+    (h, w) = template.shape[0:2]
+    (img_h, img_w) = img.shape[0:2]
+    x0 = min(max(coarse_loc[0] * scale - margin, 0), img_w - w)
+    y0 = min(max(coarse_loc[1] * scale - margin, 0), img_h - h)
+    x1 = min(coarse_loc[0] * scale + margin + w, img_w)
+    y1 = min(coarse_loc[1] * scale + margin + h, img_h)
+    res = cv2.matchTemplate(img[y0:y1, x0:x1], template, cv2.TM_CCOEFF)
+    return _get_best_match(res, template, (x0, y0))
+
+
+def match_template_spectrum(
+        img: Image,
+        template: Image,
+        params: _Params,
+) -> TemplateMatchResult:
+    (h, w) = template.shape[0:2]
+    (img_h, img_w) = img.shape[0:2]
+    shape = (cv2.getOptimalDFTSize(img_h), cv2.getOptimalDFTSize(img_w))
+    template_spectrum = _get_template_spectrum(template, params, shape)
+    padded_img = numpy.zeros(shape, dtype=numpy.float32)
+    padded_img[0:img_h, 0:img_w] = img
+    img_spectrum = cv2.dft(padded_img, nonzeroRows=img_h)
+    product = cv2.mulSpectrums(img_spectrum, template_spectrum, 0, conjB=True)
+    correlation = cv2.idft(product, flags=(
+        cv2.DFT_SCALE | cv2.DFT_REAL_OUTPUT))
+    res = correlation[0:(img_h - h + 1), 0:(img_w - w + 1)]
+    return _get_best_match(res, template, (0, 0))
+
+
+def _get_best_match(
+        res: Image,
+        template: Image,
+        offset: Tuple[int, int],
+) -> TemplateMatchResult:
+    (h, w) = template.shape[0:2]
+    (_min_val, max_val, _min_loc, max_loc) = cv2.minMaxLoc(res)
+    top_left = (max_loc[0] + offset[0], max_loc[1] + offset[1])
+    bottom_right = (top_left[0] + w, top_left[1] + h)
+    return TemplateMatchResult(Rect(top_left, bottom_right), max_val)
+
+
+_template_pyramid_map: 'WeakKeyDictionary[_Params, List[Image]]' = (
+    WeakKeyDictionary())
+
+
+def _get_template_pyramid(template: Image, params: _Params) -> List[Image]:
+    templates = _template_pyramid_map.get(params)
+    if templates is None:
+        templates = [template]
+        for _level in range(PYRAMID_LEVELS):
+            templates.append(cv2.pyrDown(templates[-1]))
+        _template_pyramid_map[params] = templates
+    return templates
+
+
+# Spectra of the template by parameters and padded image shape
+_template_spectrum_map: (
+    'WeakKeyDictionary[_Params, Dict[Tuple[int, int], Image]]') = (
+        WeakKeyDictionary())
+
+
+def _get_template_spectrum(
+        template: Image,
+        params: _Params,
+        shape: Tuple[int, int],
+) -> Image:
+    spectra = _template_spectrum_map.setdefault(params, {})
+    spectrum = spectra.get(shape)
+    if spectrum is None:
+        # Since the zero-mean template sums to zero, correlating it with
+        # the image gives the same result as TM_CCOEFF, which subtracts
+        # the mean from both the template and the image window
+        (h, w) = template.shape[0:2]
+        zero_mean_template = numpy.zeros(shape, dtype=numpy.float32)
+        zero_mean_template[0:h, 0:w] = template - numpy.mean(template)
+        spectrum = cv2.dft(zero_mean_template, nonzeroRows=h)
+        spectra[shape] = spectrum
+    return spectrum
+
+
+_MATCHERS: Dict[str, _Matcher] = {
+    'ccoeff': match_template_ccoeff,
+    'normed': match_template_normed,
+    'pyramid': match_template_pyramid,
+    'spectrum': match_template_spectrum,
+}
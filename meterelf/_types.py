@@ -5,6 +5,7 @@ import numpy
 Image = numpy.ndarray
 Point = Tuple[int, int]
 PointAsArray = numpy.ndarray
+PointArray = numpy.ndarray  # N x 2 array of (x, y) points
 FloatPoint = Tuple[float, float]
 Size = Tuple[int, int]
 
@@ -14,11 +15,22 @@ class DialCenter(NamedTuple):
     diameter: int
 
 
+class PolarGrid(NamedTuple):
+    # Coordinates of the samples for cv2.remap: radii x angles x (x, y)
+    remap: Image
+    # Momentum weights of the samples along the x and y axes
+    momentum_x: numpy.ndarray
+    momentum_y: numpy.ndarray
+    # Weights of the samples on the needle circle (zero elsewhere)
+    ring_weights: numpy.ndarray
+
+
 class DialData(NamedTuple):
     name: str
     center: FloatPoint
     mask: Image
     circle_mask: Image
+    polar_grid: PolarGrid
 
 
 class Rect(NamedTuple):
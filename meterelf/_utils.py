@@ -1,6 +1,6 @@
 import functools
 import math
-from typing import Iterable, List, Optional, Tuple
+from typing import Iterable, Optional, Tuple
 
 import cv2
 import numpy
@@ -8,7 +8,7 @@ import numpy
 from ._colors import HlsColor
 from ._params import Params as _Params
 from ._types import (
-    FloatPoint, Image, Point, PointAsArray, Rect, TemplateMatchResult)
+    FloatPoint, Image, Point, PointArray, Rect, TemplateMatchResult)
 
 
 def float_point_to_int(point: FloatPoint) -> Point:
@@ -42,11 +42,22 @@ def get_angle_by_vector(vector: FloatPoint) -> Optional[float]:
     return (-atan + (0.5 if y > 0 else 0.0)) % 1.0
 
 
-def find_non_zero(image: Image) -> List[PointAsArray]:
+def find_non_zero(image: Image) -> PointArray:
+    """
+    Find the non-zero points of an image.
+
+    >>> find_non_zero(numpy.array([[0, 1], [2, 0]], dtype=numpy.uint8))
+    array([[1, 0],
+           [0, 1]], dtype=int32)
+    >>> find_non_zero(numpy.zeros((2, 2), dtype=numpy.uint8)).shape
+    (0, 2)
+
+    :return: the (x, y) coordinates of the points as rows of an array
+    """
     find_result = cv2.findNonZero(image)
     if find_result is None:
-        return []
-    return [x[0] for x in find_result]
+        return numpy.empty((0, 2), dtype=numpy.int32)  # type: ignore
+    return find_result.reshape(-1, 2)
 
 
 def crop_rect(img: Image, rect: Rect) -> Image:
@@ -97,9 +108,16 @@ def match_template(img: Image, template: Image) -> TemplateMatchResult:
     return TemplateMatchResult(Rect(top_left, bottom_right), max_val)
 
 
-def convert_to_hls(image: Image, hue_shift: int = 0) -> Image:
-    unshifted_hls_image = cv2.cvtColor(image, cv2.COLOR_BGR2HLS_FULL)
-    return unshifted_hls_image + HlsColor(hue_shift, 0, 0)  # type: ignore
+def convert_to_hls(
+        image: Image,
+        hue_shift: int = 0,
+        dst: Optional[Image] = None,
+) -> Image:
+    hls_image = cv2.cvtColor(image, cv2.COLOR_BGR2HLS_FULL, dst)
+    if hue_shift:
+        # Hue wraps around, since the arrays are of unsigned bytes
+        numpy.add(hls_image, HlsColor(hue_shift, 0, 0), out=hls_image)
+    return hls_image
 
 
 def convert_to_bgr(
@@ -114,6 +132,7 @@ def get_mask_by_color(
         hls_image: Image,
         color: HlsColor,
         color_range: HlsColor,
+        dst: Optional[Image] = None,
 ) -> Image:
     (color_min, color_max) = color.get_range(color_range)
-    return cv2.inRange(hls_image, color_min, color_max)
+    return cv2.inRange(hls_image, color_min, color_max, dst)
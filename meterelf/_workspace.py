@@ -0,0 +1,85 @@
+"""
+Preallocated buffers for processing images.
+
+Processing an image needs many temporary arrays of the same shapes:
+the HLS image of the meter, its lightness channel and several masks
+for each dial.  A workspace keeps these arrays between the images, so
+that the image processing functions can write to them with the `dst`
+arguments of OpenCV and the `out` arguments of NumPy instead of
+allocating new arrays for every image.
+
+There is a workspace per parameters object and thread, since the
+meters of an image may be processed concurrently.  The buffers are
+overwritten when the next image is processed with the same parameters
+in the same thread, so anything which needs to outlive the processing
+of an image must be copied from them.  The use counts of the buffers
+tell whether a buffer has been handed out again since it was filled.
+"""
+import threading
+from typing import Dict, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+import numpy
+
+from ._params import Params as _Params
+from ._types import Image
+
+# Buffers of the size of the meter area: name and number of channels
+METER_BUFFERS = [('hls', 3), ('lightness', 1)]
+
+# Single channel buffers of the size of the dials area
+DIALS_BUFFERS = [
+    'color_mask', 'dilated', 'eroded', 'contours', 'needle_mask', 'masked']
+
+_local = threading.local()
+
+
+def get_workspace(params: _Params) -> 'Workspace':
+    workspaces: Optional['WeakKeyDictionary[_Params, Workspace]'] = getattr(
+        _local, 'workspaces', None)
+    if workspaces is None:
+        workspaces = _local.workspaces = WeakKeyDictionary()
+    workspace = workspaces.get(params)
+    if workspace is None:
+        workspace = Workspace(params)
+        workspaces[params] = workspace
+    return workspace
+
+
+class Workspace:
+    def __init__(self, params: _Params) -> None:
+        self._buffers: Dict[str, Image] = {}
+        self._use_counts: Dict[str, int] = {}
+        ((x0, y0), (x1, y1)) = params.meter_rect
+        meter_size = (y1 - y0, x1 - x0)
+        for (name, channels) in METER_BUFFERS:
+            self.get(name, meter_size, channels)
+        for name in DIALS_BUFFERS:
+            self.get(name, params.dials_template_size)
+
+    def get(
+            self,
+            name: str,
+            size: Tuple[int, ...],
+            channels: int = 1,
+    ) -> Image:
+        """
+        Get buffer of given name, size (h, w) and number of channels.
+
+        The buffer is reallocated if the size or channels differ from
+        the previous buffer of the name, e.g. when an image is smaller
+        than the meter area.
+        """
+        shape = tuple(size[0:2]) + ((channels,) if channels > 1 else ())
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = numpy.empty(shape, dtype=numpy.uint8)
+            self._buffers[name] = buffer
+        self._use_counts[name] = self.get_use_count(name) + 1
+        return buffer
+
+    def get_use_count(self, name: str) -> int:
+        """
+        Get the number of times the buffer of given name has been got.
+        """
+        return self._use_counts.get(name, 0)
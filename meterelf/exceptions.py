@@ -36,6 +36,10 @@ class ImageLoadingError(ImageProcessingError, IOError):
     default_message = "Unable to load image"
 
 
+class FrameOverrunError(ImageLoadingError):
+    default_message = "Frame was overwritten while processing"
+
+
 class ImageAnalyzingError(ImageProcessingError, ValueError):
     default_message = "Failed to analyze image"
 
@@ -23,6 +23,10 @@ def imread(
     ...
 
 
+def imdecode(buf: _Array, flags: _ImreadFlag) -> Optional[_Array]:
+    ...
+
+
 def imwrite(
         filename: str,
         img: _Array,
@@ -31,6 +35,17 @@ def imwrite(
     ...
 
 
+IMWRITE_JPEG_QUALITY: int
+
+
+def imencode(
+        ext: str,
+        img: _Array,
+        params: Sequence[int] = ...,
+) -> Tuple[bool, _Array]:
+    ...
+
+
 def imshow(name: str, image: _Array) -> None:
     ...
 
@@ -42,6 +57,7 @@ def waitKey(delay: int = ...) -> int:
 _ColorSpace = NewType('_ColorSpace', int)
 COLOR_BGR2HLS_FULL: _ColorSpace
 COLOR_HLS2BGR_FULL: _ColorSpace
+COLOR_GRAY2BGR: _ColorSpace
 
 
 def cvtColor(
@@ -68,12 +84,26 @@ def mean(src: _Array, mask: Optional[_Array] = ...) -> _Color:
     ...
 
 
-def inRange(src: _Array, lowerb: _Array, upperb: _Array) -> _Array:
+def inRange(
+        src: _Array,
+        lowerb: _Array,
+        upperb: _Array,
+        dst: Optional[_Array] = ...,
+) -> _Array:
+    ...
+
+
+def extractChannel(
+        src: _Array,
+        coi: int,
+        dst: Optional[_Array] = ...,
+) -> _Array:
     ...
 
 
 _TemplateMatchMethod = NewType('_TemplateMatchMethod', int)
 TM_CCOEFF: _TemplateMatchMethod
+TM_CCOEFF_NORMED: _TemplateMatchMethod
 
 
 def matchTemplate(
@@ -85,6 +115,55 @@ def matchTemplate(
     ...
 
 
+def pyrDown(
+        src: _Array,
+        dst: Optional[_Array] = ...,
+        dstsize: _Size = ...,
+        borderType: int = ...,
+) -> _Array:
+    ...
+
+
+def getOptimalDFTSize(vecsize: int) -> int:
+    ...
+
+
+_DftFlag = NewType('_DftFlag', int)
+DFT_INVERSE: _DftFlag
+DFT_SCALE: _DftFlag
+DFT_ROWS: _DftFlag
+DFT_COMPLEX_OUTPUT: _DftFlag
+DFT_REAL_OUTPUT: _DftFlag
+
+
+def dft(
+        src: _Array,
+        dst: Optional[_Array] = ...,
+        flags: int = ...,
+        nonzeroRows: int = ...,
+) -> _Array:
+    ...
+
+
+def idft(
+        src: _Array,
+        dst: Optional[_Array] = ...,
+        flags: int = ...,
+        nonzeroRows: int = ...,
+) -> _Array:
+    ...
+
+
+def mulSpectrums(
+        a: _Array,
+        b: _Array,
+        flags: int,
+        c: Optional[_Array] = ...,
+        conjB: bool = ...,
+) -> _Array:
+    ...
+
+
 def minMaxLoc(
         src: _Array,
         mask: Optional[_Array] = ...,
@@ -205,6 +284,20 @@ def addWeighted(
     ...
 
 
+LINE_AA: int
+
+
+def fillPoly(
+        img: _Array,
+        pts: List[_Array],
+        color: _Color,
+        lineType: int = ...,
+        shift: int = ...,
+        offset: _Point = ...,
+) -> None:
+    ...
+
+
 def circle(
         img: _Array,
         center: _Point,
@@ -229,6 +322,29 @@ def floodFill(
     ...
 
 
+def remap(
+        src: _Array,
+        map1: _Array,
+        map2: Optional[_Array],
+        interpolation: _Interpolation,
+        dst: Optional[_Array] = ...,
+        borderMode: _BorderType = ...,
+        borderValue: _Color = ...,
+) -> _Array:
+    ...
+
+
+def GaussianBlur(
+        src: _Array,
+        ksize: _Size,
+        sigmaX: float,
+        dst: Optional[_Array] = ...,
+        sigmaY: float = ...,
+        borderType: _BorderType = ...,
+) -> _Array:
+    ...
+
+
 def resize(
         src: _Array,
         dsize: _Size,
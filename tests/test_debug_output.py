@@ -0,0 +1,84 @@
+import os
+import threading
+from unittest.mock import patch
+
+import numpy
+import pytest
+
+from meterelf import _debug, _debug_output, get_meter_values
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+
+params_fn = os.path.join(project_dir, 'sample-images1', 'params.yml')
+
+FILENAMES = [
+    '20180814021309-01-e01.jpg',  # Dials not found
+    '20180814021357-00-e01.jpg',
+    '20180814215230-01-e136.jpg',
+]
+
+
+@pytest.fixture
+def sink(tmpdir):
+    sink = _debug_output.DebugImageSink(str(tmpdir))
+    with patch.object(_debug_output, '_sink', new=sink):
+        yield sink
+    sink.close()
+
+
+def process_files(sink):
+    paths = [os.path.join(project_dir, 'sample-images1', x) for x in FILENAMES]
+    with patch('cv2.imshow') as imshow_mock:
+        results = list(get_meter_values(params_fn, paths))
+    sink.close()
+    imshow_mock.assert_not_called()
+    return results
+
+
+def test_writes_all_images(sink):
+    results = process_files(sink)
+    assert [x.value is not None for x in results] == [False, True, True]
+    assert sorted(os.listdir(sink.directory)) == [
+        'debug_' + x + '.png' for x in FILENAMES]
+    assert sink.dropped_count == 0
+
+
+def test_writes_only_failures(sink):
+    sink.failures_only = True
+    process_files(sink)
+    assert os.listdir(sink.directory) == [
+        'debug_20180814021309-01-e01.jpg.png']
+
+
+def test_sampling_is_deterministic():
+    sink = _debug_output.DebugImageSink('.', sample_rate=0.25)
+    filenames = ['{:05d}.jpg'.format(x) for x in range(1000)]
+    wanted = [x for x in filenames if sink.wants_image(x)]
+    assert 200 < len(wanted) < 300
+    assert wanted == [x for x in filenames if sink.wants_image(x)]
+    assert all(sink.wants_image(x, failed=True) for x in wanted)
+    sink.close()
+
+
+def test_submit_does_not_block_when_queue_is_full(tmpdir):
+    image = numpy.zeros((10, 10, 3), dtype=numpy.uint8)
+    release = threading.Event()
+    with patch('cv2.imwrite', side_effect=(lambda *args: release.wait())):
+        sink = _debug_output.DebugImageSink(str(tmpdir), queue_size=2)
+        results = [sink.submit('image{}'.format(x), image) for x in range(5)]
+        release.set()
+        sink.close()
+    # First image is taken by the writer thread and then two more fit to
+    # the queue, but the rest should be dropped
+    assert results.count(False) == sink.dropped_count
+    assert 2 <= sink.dropped_count <= 3
+
+
+@pytest.mark.parametrize('value', ['abc', '1.5', '-0.1', 'nan'])
+def test_invalid_debug_sample(value):
+    with pytest.warns(UserWarning) as record:
+        assert _debug.parse_debug_sample(value) == (1.0, False)
+    assert str(record[0].message) == (
+        f'Invalid DEBUG_SAMPLE {value!r}, sampling all images: '
+        'Must be "failures" or a number from 0 to 1')
@@ -0,0 +1,114 @@
+import os
+
+import cv2
+import pytest
+import yaml
+
+from meterelf import _main, get_meter_values, get_meter_values_from_ring
+from meterelf._api import get_angular_velocity
+from meterelf._frame_ring import FrameRingWriter
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+sample_dir = os.path.join(project_dir, 'sample-images1')
+params_file = os.path.join(sample_dir, 'params.yml')
+
+IMAGE_FILES = [
+    os.path.join(sample_dir, x) for x in [
+        '20180814021357-00-e01.jpg',
+        '20180814023853-00-e08.jpg',
+        '20180819172814-01-e657.jpg',
+    ]]
+
+
+@pytest.fixture(params=['full', 'tiered', 'polar'])
+def params_files(request, tmpdir):
+    """
+    Parameters of a reading method and same with unreadable 0.01 dial.
+    """
+    with open(params_file, 'rt') as fp:
+        data = yaml.safe_load(fp)
+    data['dials_template'] = os.path.join(sample_dir, data['dials_template'])
+    data['reading_method'] = request.param
+    good_path = tmpdir.join('good.yml')
+    good_path.write(yaml.safe_dump(data))
+    data['needle_data'][2]['color_range'] = {'h': 0, 'l': 0, 's': 0}
+    blind_path = tmpdir.join('blind.yml')
+    blind_path.write(yaml.safe_dump(data))
+    return (str(good_path), str(blind_path))
+
+
+def test_read_only_given_dials(params_files):
+    (good_params_file, blind_params_file) = params_files
+    expected = list(get_meter_values(good_params_file, IMAGE_FILES))
+    assert all(x.error is None for x in expected)
+    assert all(x.value is None for x in get_meter_values(
+        blind_params_file, IMAGE_FILES))
+    results = list(get_meter_values(
+        blind_params_file, IMAGE_FILES, dials=['0.001', '0.0001']))
+    for (data, expected_data) in zip(results, expected):
+        assert data.error is None
+        assert data.value is None
+        positions = expected_data.meter_values
+        assert data.meter_values['0.0001'] == positions['0.0001']
+        assert data.meter_values['0.001'] == positions['0.001']
+        assert '0.01' not in data.meter_values
+
+
+def test_value_is_given_with_all_dials():
+    expected = list(get_meter_values(params_file, IMAGE_FILES))
+    results = list(get_meter_values(
+        params_file, IMAGE_FILES, dials=['0.0001', '0.001', '0.01', '0.1']))
+    assert [x.value for x in results] == [x.value for x in expected]
+
+
+def test_angular_velocity_between_files():
+    results = list(get_meter_values(
+        params_file, IMAGE_FILES, dials=['0.0001']))
+    assert 'angular_velocity' not in results[0].meter_values
+    positions = [x.meter_values['0.0001'] for x in results]
+    assert results[1].meter_values['angular_velocity'] == pytest.approx(
+        get_angular_velocity(positions[0], positions[1], 1496.0))
+    assert results[2].meter_values['angular_velocity'] == pytest.approx(
+        get_angular_velocity(positions[1], positions[2], 485361.0))
+
+
+def test_angular_velocity_between_frames(tmpdir):
+    ring_file = str(tmpdir.join('frames.ring'))
+    images = [cv2.imread(x) for x in IMAGE_FILES[:2]]
+    (height, width) = images[0].shape[0:2]
+    writer = FrameRingWriter.create(ring_file, width, height, 4)
+    for (i, image) in enumerate(images + images[:1]):
+        writer.write(image, timestamp=1534212837.0 + 0.25 * i)
+    results = list(get_meter_values_from_ring(
+        params_file, ring_file, dials=['0.0001']))
+    positions = [x.meter_values['0.0001'] for x in results]
+    velocities = [x.meter_values.get('angular_velocity') for x in results]
+    assert velocities == [
+        None,
+        pytest.approx(get_angular_velocity(positions[0], positions[1], 0.25)),
+        pytest.approx(get_angular_velocity(positions[1], positions[2], 0.25)),
+    ]
+
+
+def test_unknown_dial():
+    with pytest.raises(ValueError) as excinfo:
+        list(get_meter_values(params_file, IMAGE_FILES, dials=['0.5']))
+    assert str(excinfo.value) == 'Unknown dial: 0.5'
+
+
+def test_main_with_dials(capsys):
+    _main.main(['meterelf', params_file, *IMAGE_FILES, '--dials', '0.0001'])
+    lines = capsys.readouterr().out.splitlines()
+    assert [x.split(': ')[0] for x in lines] == IMAGE_FILES
+    assert lines[0].endswith(': 0.0001=1.256')
+    assert lines[1].endswith(' deg/s)')
+    assert lines[1].split(': ')[1].startswith('0.0001=7.998 (')
+
+
+def test_main_with_unknown_dials(capsys):
+    with pytest.raises(SystemExit):
+        _main.main([
+            'meterelf', params_file, *IMAGE_FILES, '--dials', '0.0001,x,y'])
+    assert capsys.readouterr().err.endswith(
+        'error: argument --dials: unknown dials: x, y\n')
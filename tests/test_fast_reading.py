@@ -0,0 +1,134 @@
+import os
+from glob import glob
+
+import pytest
+import yaml
+
+from meterelf import _metrics, _params, get_meter_values
+from meterelf._fast_reading import get_fast_dial_readings
+from meterelf._image import ImageFile
+from meterelf._reading import (
+    FAST_TIER, FULL_TIER, get_dial_positions, get_meter_value)
+from meterelf.exceptions import ImageProcessingError
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+
+
+def load_params(sample_dir, **overrides):
+    params = _params.load(os.path.join(project_dir, sample_dir, 'params.yml'))
+    for (name, value) in overrides.items():
+        setattr(params, name, value)
+    return params
+
+
+def get_image_files(params, sample_dir):
+    pattern = os.path.join(project_dir, sample_dir, '*.jpg')
+    for filename in sorted(glob(pattern)):
+        yield ImageFile(filename, params)
+
+
+def get_tier_counts():
+    return {
+        tier: _metrics.TIERED_READINGS.get('', str(tier))
+        for tier in [FAST_TIER, FULL_TIER]}
+
+
+def values_match(value, expected):
+    diff = abs(value - expected)
+    return min(diff, abs(diff - 1000)) < 0.005
+
+
+@pytest.mark.parametrize('sample_dir,scale', [
+    ('sample-images1', 1),
+    ('sample-images2', 1),
+    ('sample-images1', 2),
+])
+def test_tiered_reading_gives_same_values_as_full(sample_dir, scale):
+    full_params = load_params(sample_dir)
+    tiered_params = load_params(
+        sample_dir, reading_method='tiered', fast_reading_scale=scale)
+    tiers = []
+    for imgf in get_image_files(full_params, sample_dir):
+        try:
+            expected = get_meter_value(imgf, annotate=False)
+        except ImageProcessingError:
+            continue
+        tiered_imgf = ImageFile(imgf.filename, tiered_params, imgf.bgr_image)
+        counts = get_tier_counts()
+        result = get_meter_value(tiered_imgf, annotate=False)
+        assert values_match(result['value'], expected['value']), imgf.filename
+        assert set(result) == set(expected)
+        new_counts = get_tier_counts()
+        (tier,) = [x for x in counts if new_counts[x] == counts[x] + 1]
+        assert tiered_imgf.reading_tier == tier
+        tiers.append(tier)
+    if scale == 1:
+        assert tiers.count(FAST_TIER) > len(tiers) / 3
+
+
+def test_fast_readings_are_close_to_full_readings():
+    params = load_params('sample-images1')
+    for imgf in get_image_files(params, 'sample-images1'):
+        try:
+            dials_hls = imgf.get_dials_hls()
+            expected = get_dial_positions(imgf, dials_hls)
+        except ImageProcessingError:
+            continue
+        readings = get_fast_dial_readings(params, dials_hls)
+        for (name, reading) in readings.items():
+            if reading.confidence < params.fast_reading_min_confidence:
+                continue
+            diff = abs((reading.position - expected[name] + 5) % 10 - 5)
+            assert diff < 3 * reading.uncertainty + 0.01, (
+                imgf.filename, name)
+
+
+def test_full_reading_is_not_counted_as_tiered():
+    params = load_params('sample-images1')
+    imgf = ImageFile(os.path.join(
+        project_dir, 'sample-images1', '20180814021357-00-e01.jpg'), params)
+    counts = get_tier_counts()
+    assert set(get_meter_value(imgf, annotate=False)) == {
+        '0.0001', '0.001', '0.01', '0.1', 'value'}
+    assert get_tier_counts() == counts
+    assert imgf.reading_tier is None
+
+
+def write_params(tmpdir, **overrides):
+    sample_dir = os.path.join(project_dir, 'sample-images1')
+    with open(os.path.join(sample_dir, 'params.yml'), 'rt') as fp:
+        data = yaml.safe_load(fp)
+    data['dials_template'] = os.path.join(sample_dir, data['dials_template'])
+    data.update(overrides)
+    path = tmpdir.join('params.yml')
+    path.write(yaml.safe_dump(data))
+    return str(path)
+
+
+@pytest.mark.parametrize('reading_method', ['full', 'tiered'])
+def test_results_have_reading_tier(tmpdir, reading_method):
+    params_file = write_params(tmpdir, reading_method=reading_method)
+    filenames = sorted(glob(os.path.join(
+        project_dir, 'sample-images1', '2018081421*.jpg')))
+    results = [
+        x for x in get_meter_values(params_file, filenames)
+        if x.error is None]
+    assert results
+    tiers = {x.tier for x in results}
+    if reading_method == 'tiered':
+        assert tiers <= {FAST_TIER, FULL_TIER}
+        assert FAST_TIER in tiers
+    else:
+        assert tiers == {None}
+
+
+def test_invalid_reading_method():
+    sample_dir = os.path.join(project_dir, 'sample-images1')
+    with open(os.path.join(sample_dir, 'params.yml'), 'rt') as fp:
+        data = yaml.safe_load(fp)
+    data['reading_method'] = 'guess'
+    with pytest.raises(_params.LoadError) as excinfo:
+        _params.Params(sample_dir, data)
+    assert str(excinfo.value) == (
+        'reading_method must be one of: full, tiered, polar')
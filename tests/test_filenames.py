@@ -0,0 +1,119 @@
+import io
+import os
+from datetime import datetime
+
+import pytest
+
+from meterelf import _filenames, _main
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+
+FILENAMES = [
+    '20180814021357-00-e01.jpg',
+    '20181001_005430-01-e255.jpg',
+    '20180814021310-00-e02.jpg',
+    'dials_gray.png',
+    'no-timestamp.jpg',
+    '.hidden.jpg',
+]
+
+
+@pytest.fixture
+def image_dir(tmpdir):
+    for filename in FILENAMES:
+        tmpdir.join(filename).write('')
+    tmpdir.mkdir('subdir.jpg')
+    return tmpdir
+
+
+def test_scan_image_files(image_dir):
+    image_glob = os.path.join(str(image_dir), '*.jpg')
+    result = _filenames.scan_image_files(image_glob)
+    assert not isinstance(result, list)
+    assert sorted(os.path.basename(x) for x in result) == [
+        '20180814021310-00-e02.jpg',
+        '20180814021357-00-e01.jpg',
+        '20181001_005430-01-e255.jpg',
+        'no-timestamp.jpg',
+    ]
+
+
+def test_scan_image_files_sorted_by_time(image_dir):
+    image_glob = os.path.join(str(image_dir), '*.jpg')
+    result = _filenames.scan_image_files(image_glob, sort_by_time=True)
+    assert [os.path.basename(x) for x in result] == [
+        '20180814021310-00-e02.jpg',
+        '20180814021357-00-e01.jpg',
+        '20181001_005430-01-e255.jpg',
+        'no-timestamp.jpg',
+    ]
+
+
+def test_scan_image_files_with_magic_in_directory(image_dir):
+    image_glob = os.path.join(str(image_dir), '*', '*.jpg')
+    image_dir.join('subdir.jpg', '20180101000000.jpg').write('')
+    result = list(_filenames.scan_image_files(image_glob))
+    assert [os.path.basename(x) for x in result] == ['20180101000000.jpg']
+
+
+def test_filter_by_time():
+    result = _filenames.filter_by_time(
+        FILENAMES,
+        start=datetime(2018, 8, 14, 2, 13, 10),
+        end=datetime(2018, 8, 14, 2, 13, 57))
+    assert list(result) == ['20180814021310-00-e02.jpg']
+
+
+def test_filter_by_time_without_limits():
+    assert list(_filenames.filter_by_time(FILENAMES)) == FILENAMES
+
+
+def test_read_filenames():
+    fp = io.StringIO('a.jpg\n\nb c.jpg\r\nd.jpg')
+    assert list(_filenames.read_filenames(fp)) == ['a.jpg', 'b c.jpg', 'd.jpg']
+
+
+def test_parse_time_invalid():
+    with pytest.raises(ValueError) as excinfo:
+        _filenames.parse_time('2018-13-01')
+    assert str(excinfo.value) == 'Invalid time: 2018-13-01'
+
+
+def test_main_with_files_from_stdin(capsys, monkeypatch):
+    sample_dir = os.path.join(project_dir, 'sample-images1')
+    monkeypatch.chdir(sample_dir)
+    monkeypatch.setattr('sys.stdin', io.StringIO(
+        '20180814021357-00-e01.jpg\n'
+        '20180814023853-00-e08.jpg\n'))
+    _main.main(['meterelf', 'params.yml', '--files-from', '-'])
+    captured = capsys.readouterr()
+    assert captured.out == (
+        '20180814021357-00-e01.jpg: 905.126\n'
+        '20180814023853-00-e08.jpg: 932.800\n')
+
+
+def test_main_with_scan(capsys, monkeypatch):
+    sample_dir = os.path.join(project_dir, 'sample-images1')
+    monkeypatch.chdir(sample_dir)
+    _main.main([
+        'meterelf', 'params.yml', '--scan', '--sort-by-time',
+        '--start', '2018-08-19T17:00', '--end', '2018-08-19 19:20'])
+    captured = capsys.readouterr()
+    assert captured.out == (
+        '20180819172814-01-e657.jpg: 964.627\n'
+        '20180819191907-01-e685.jpg: 022.179\n')
+
+
+def test_main_sort_by_time_requires_scan(capsys):
+    with pytest.raises(SystemExit):
+        _main.main(['meterelf', 'params.yml', 'a.jpg', '--sort-by-time'])
+    captured = capsys.readouterr()
+    assert 'argument --sort-by-time: allowed only with --scan' in captured.err
+
+
+def test_main_with_invalid_time(capsys):
+    with pytest.raises(SystemExit):
+        _main.main(['meterelf', 'params.yml', '--start', 'yesterday'])
+    captured = capsys.readouterr()
+    assert 'argument --start: Invalid time: yesterday' in captured.err
@@ -0,0 +1,157 @@
+import os
+
+import cv2
+import numpy
+import pytest
+
+from meterelf import _main, get_meter_values, get_meter_values_from_ring
+from meterelf._frame_ring import (
+    FrameRingReader, FrameRingWriter, RingFormatError)
+from meterelf.exceptions import FrameOverrunError
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+sample_dir = os.path.join(project_dir, 'sample-images1')
+params_file = os.path.join(sample_dir, 'params.yml')
+
+IMAGE_FILES = [
+    '20180814021357-00-e01.jpg',
+    '20180814023853-00-e08.jpg',
+    '20180819172814-01-e657.jpg',
+]
+
+
+def make_frame(value, shape=(4, 6, 3)):
+    return numpy.full(shape, value, dtype=numpy.uint8)
+
+
+@pytest.fixture
+def ring_file(tmpdir):
+    return str(tmpdir.join('frames.ring'))
+
+
+def test_read_written_frames(ring_file):
+    with FrameRingWriter.create(ring_file, 6, 4, slot_count=3) as writer:
+        writer.write(make_frame(1), timestamp=1000.0)
+        writer.write(make_frame(2), timestamp=1001.0)
+    with FrameRingReader(ring_file) as reader:
+        frames = list(reader.iter_frames())
+        assert [(x.sequence, x.timestamp, x.dropped) for x in frames] == [
+            (1, 1000.0, 0), (2, 1001.0, 0)]
+        assert [int(x.image[0, 0, 0]) for x in frames] == [1, 2]
+        assert not frames[0].image.flags.writeable
+        assert reader.read() is None
+
+
+def test_reader_reports_dropped_frames(ring_file):
+    writer = FrameRingWriter.create(ring_file, 6, 4, slot_count=2)
+    reader = FrameRingReader(ring_file)
+    for value in range(1, 6):
+        writer.write(make_frame(value))
+    frames = list(reader.iter_frames())
+    assert [(x.sequence, x.dropped) for x in frames] == [(4, 3), (5, 0)]
+    assert reader.dropped_count == 3
+
+
+def test_reader_detects_overwritten_frame(ring_file):
+    writer = FrameRingWriter.create(ring_file, 6, 4, slot_count=2)
+    reader = FrameRingReader(ring_file)
+    writer.write(make_frame(1))
+    frame = reader.read()
+    assert reader.is_intact(frame)
+    writer.write(make_frame(2))
+    writer.write(make_frame(3))
+    assert not reader.is_intact(frame)
+    assert int(frame.image[0, 0, 0]) == 3
+
+
+def test_reader_can_start_at_latest(ring_file):
+    writer = FrameRingWriter.create(ring_file, 6, 4, slot_count=4)
+    for value in range(1, 4):
+        writer.write(make_frame(value))
+    reader = FrameRingReader(ring_file, start_at='latest')
+    assert [x.sequence for x in reader.iter_frames()] == [3]
+
+
+def test_writer_continues_sequence(ring_file):
+    FrameRingWriter.create(ring_file, 6, 4, slot_count=2).write(make_frame(1))
+    assert FrameRingWriter(ring_file).write(make_frame(2)) == 2
+
+
+def test_writer_rejects_wrong_shape(ring_file):
+    writer = FrameRingWriter.create(ring_file, 6, 4, slot_count=2)
+    with pytest.raises(ValueError):
+        writer.write(make_frame(1, shape=(6, 4, 3)))
+
+
+def test_invalid_ring_file(tmpdir):
+    path = tmpdir.join('not-a-ring')
+    path.write('x' * 100)
+    with pytest.raises(RingFormatError):
+        FrameRingReader(str(path))
+
+
+def write_sample_frames(ring_file, slot_count=4):
+    images = [
+        cv2.imread(os.path.join(sample_dir, x)) for x in IMAGE_FILES]
+    (height, width) = images[0].shape[0:2]
+    writer = FrameRingWriter.create(ring_file, width, height, slot_count)
+    for image in images:
+        writer.write(image)
+    return writer
+
+
+def test_get_meter_values_from_ring(ring_file):
+    write_sample_frames(ring_file)
+    expected = get_meter_values(
+        params_file, [os.path.join(sample_dir, x) for x in IMAGE_FILES])
+    results = get_meter_values_from_ring(params_file, ring_file)
+    for (data, expected_data) in zip(results, expected):
+        assert data.filename.endswith('-frame{:010d}'.format(
+            IMAGE_FILES.index(os.path.basename(expected_data.filename)) + 1))
+        assert data.error is None
+        assert data.meter_values == expected_data.meter_values
+
+
+class OverwritingCalibrator:
+    """
+    Calibrator, which makes the writer lap the reader on first image.
+    """
+    def __init__(self, writer, frame_count):
+        self.writer = writer
+        self.frame_count = frame_count
+
+    def add_image(self, imgf):
+        frame = cv2.imread(os.path.join(sample_dir, IMAGE_FILES[0]))
+        for _i in range(self.frame_count):
+            self.writer.write(frame)
+        self.frame_count = 0
+
+
+def test_get_meter_values_from_ring_detects_overrun(ring_file):
+    writer = write_sample_frames(ring_file, slot_count=3)
+    dropped_frames = []
+    results = list(get_meter_values_from_ring(
+        params_file, ring_file,
+        calibrator=OverwritingCalibrator(writer, 3),
+        on_dropped=dropped_frames.append))
+    assert isinstance(results[0].error, FrameOverrunError)
+    assert results[0].meter_values == {}
+    assert [x.filename[-2:] for x in results] == ['01', '04', '05', '06']
+    assert [(x.sequence, x.dropped) for x in dropped_frames] == [(4, 2)]
+
+
+def test_main_with_ring(ring_file, capsys):
+    write_sample_frames(ring_file, slot_count=2)
+    _main.main(['meterelf', params_file, '--ring', ring_file])
+    captured = capsys.readouterr()
+    lines = captured.out.splitlines()
+    assert len(lines) == 2
+    assert lines[0].endswith('-frame0000000002: 932.800')
+    assert lines[1].endswith('-frame0000000003: 964.627')
+    assert captured.err == ''
+
+
+def test_main_with_ring_and_files():
+    with pytest.raises(SystemExit):
+        _main.main(['meterelf', params_file, 'a.jpg', '--ring', 'x.ring'])
@@ -0,0 +1,118 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from meterelf import _main, get_meter_values, get_meter_values_from_pack
+from meterelf._image_pack import (
+    ImagePackReader, ImagePackWriter, PackFormatError, pack_images)
+from meterelf._sharding import Shard
+from meterelf.exceptions import ImageLoadingError
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+sample_dir = os.path.join(project_dir, 'sample-images1')
+params_file = os.path.join(sample_dir, 'params.yml')
+
+IMAGE_FILES = [
+    os.path.join(sample_dir, x) for x in [
+        '20180814021309-01-e01.jpg',
+        '20180814021357-00-e01.jpg',
+        '20180814023853-00-e08.jpg',
+        '20180819172814-01-e657.jpg',
+    ]]
+
+
+@pytest.fixture
+def pack_file(tmpdir):
+    return str(tmpdir.join('images.pack'))
+
+
+def read_bytes(filename):
+    with open(filename, 'rb') as fp:
+        return fp.read()
+
+
+def test_pack_and_read(pack_file):
+    assert pack_images(pack_file, IMAGE_FILES[:2]) == 2
+    assert pack_images(pack_file, IMAGE_FILES[2:]) == 2
+    with ImagePackReader(pack_file) as reader:
+        entries = list(reader.iter_entries())
+        assert [x.name for x in entries] == [
+            os.path.basename(x) for x in IMAGE_FILES]
+        assert entries[1].timestamp == datetime(2018, 8, 14, 2, 13, 57)
+        for (entry, filename) in zip(entries, IMAGE_FILES):
+            assert reader.get_data(entry).tobytes() == read_bytes(filename)
+        selected = reader.iter_entries(
+            datetime(2018, 8, 14, 2, 13, 57), datetime(2018, 8, 19))
+        assert [x.name for x in selected] == [
+            os.path.basename(x) for x in IMAGE_FILES[1:3]]
+
+
+def test_entry_without_timestamp(pack_file):
+    with ImagePackWriter(pack_file) as writer:
+        writer.add('dials.png', b'x')
+    with ImagePackReader(pack_file) as reader:
+        (entry,) = reader.iter_entries()
+        assert entry.timestamp is None
+        assert list(reader.iter_entries(start=datetime(2018, 1, 1))) == []
+        with pytest.raises(ImageLoadingError):
+            reader.load_image(entry)
+
+
+def test_interrupted_append_is_recovered(pack_file):
+    pack_images(pack_file, IMAGE_FILES[:2])
+    with ImagePackReader(pack_file) as reader:
+        index_offset = reader.data_end
+    # Write a partial record over the index like an interrupted append
+    with open(pack_file, 'r+b') as fp:
+        fp.seek(index_offset)
+        fp.write(b'MEFE' + b'\xff' * 14)
+    with ImagePackReader(pack_file) as reader:
+        assert len(reader.entries) == 2
+        assert reader.data_end == index_offset
+    pack_images(pack_file, IMAGE_FILES[2:3])
+    with ImagePackReader(pack_file) as reader:
+        assert [x.name for x in reader.entries] == [
+            os.path.basename(x) for x in IMAGE_FILES[:3]]
+        assert reader.get_data(reader.entries[2]).tobytes() == read_bytes(
+            IMAGE_FILES[2])
+
+
+def test_invalid_pack_file(tmpdir):
+    path = tmpdir.join('invalid.pack')
+    path.write('not a pack')
+    with pytest.raises(PackFormatError) as excinfo:
+        ImagePackReader(str(path))
+    assert str(excinfo.value) == f'Not an image pack file: {path}'
+
+
+def test_get_meter_values_from_pack(pack_file):
+    pack_images(pack_file, IMAGE_FILES)
+    expected = list(get_meter_values(params_file, IMAGE_FILES))
+    results = list(get_meter_values_from_pack(params_file, pack_file))
+    assert [x.filename for x in results] == [
+        os.path.basename(x) for x in IMAGE_FILES]
+    for (data, expected_data) in zip(results, expected):
+        assert data.value == expected_data.value
+        assert data.meter_values == expected_data.meter_values
+        assert type(data.error) is type(expected_data.error)
+    shard = Shard.parse('1/2')
+    results = list(get_meter_values_from_pack(
+        params_file, pack_file, shard=shard))
+    assert [x.filename for x in results] == [
+        os.path.basename(x) for x in IMAGE_FILES if shard.contains(x)]
+
+
+def test_main_with_pack(pack_file, capsys):
+    _main.main(['meterelf', 'pack', pack_file, *IMAGE_FILES[2:]])
+    assert capsys.readouterr().out == f'Packed 2 images to {pack_file}\n'
+    _main.main(['meterelf', params_file, '--pack', pack_file])
+    assert capsys.readouterr().out == (
+        '20180814023853-00-e08.jpg: 932.800\n'
+        '20180819172814-01-e657.jpg: 964.627\n')
+
+
+def test_main_with_pack_and_files(pack_file):
+    with pytest.raises(SystemExit):
+        _main.main(['meterelf', params_file, 'a.jpg', '--pack', pack_file])
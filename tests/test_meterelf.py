@@ -5,8 +5,11 @@ from glob import glob
 from unittest.mock import patch
 
 import pytest
+import yaml
 
-from meterelf import _calibration, _debug, _main, _params
+from meterelf import _calibration, _debug, _main, _params, get_meter_values
+from meterelf._types import DialCenter
+from meterelf.exceptions import DialsNotFoundError, NeedleContoursNotFoundError
 
 mydir = os.path.abspath(os.path.dirname(__file__))
 project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
@@ -144,6 +147,101 @@ EXPECTED_CENTER_DATA = [
 ]
 
 
+def get_sample_files():
+    return sorted(glob(os.path.join(project_dir, 'sample-images1', '*.jpg')))
+
+
+def count_located(results):
+    return sum(not isinstance(x.error, DialsNotFoundError) for x in results)
+
+
+def test_incremental_calibrator_without_drift():
+    calibrator = _calibration.IncrementalCalibrator(update_interval=20)
+    files = get_sample_files()
+    with cwd_as(project_dir):
+        params = _params.load(params_fn)
+        results = list(get_meter_values(params_fn, files, calibrator))
+    assert count_located(results) < len(files)
+    assert calibrator.image_count == count_located(results)
+    assert calibrator.reference_centers == params.dial_centers
+
+
+def test_incremental_calibrator_detects_drift():
+    alerts = []
+    calibrator = _calibration.IncrementalCalibrator(
+        update_interval=20,
+        reference_centers={
+            '0.0001': DialCenter((37.3, 63.4), 16),
+            '0.001': DialCenter((94.0, 86.0), 15),
+            '0.01': DialCenter((130.0, 71.9), 11),  # Moved by 5 pixels
+            '0.1': DialCenter((160.9, 36.5), 12),
+        },
+        on_drift=alerts.append)
+    with cwd_as(project_dir):
+        list(get_meter_values(params_fn, get_sample_files(), calibrator))
+
+    assert len(alerts) == 1
+    alert = alerts[0]
+    assert alert.image_count % calibrator.update_interval == 0
+    assert abs(alert.offsets['0.01'] - 5.5) < 0.1
+    assert max(alert.offsets['0.0001'], alert.offsets['0.1']) < 0.2
+    assert calibrator.reference_centers == alert.proposed_centers
+    needle_data = alert.get_needle_data()
+    names = [x['name'] for x in needle_data]
+    assert names == ['0.0001', '0.001', '0.01', '0.1']
+    for (data, expected) in zip(needle_data, EXPECTED_CENTER_DATA):
+        (expected_x, expected_y, expected_d) = expected
+        assert abs(data['center'][0] - expected_x) < 0.5
+        assert abs(data['center'][1] - expected_y) < 0.5
+        assert abs(data['diameter'] - expected_d) <= 1
+
+
+def write_blind_params(tmpdir):
+    """
+    Write parameters with which reading every image fails.
+    """
+    with open(os.path.join(project_dir, params_fn), 'rt') as fp:
+        data = yaml.safe_load(fp)
+    sample_dir = os.path.join(project_dir, 'sample-images1')
+    data['dials_template'] = os.path.join(sample_dir, data['dials_template'])
+    # Make the 0.01 dial unreadable
+    data['needle_data'][2]['color_range'] = {'h': 0, 'l': 0, 's': 0}
+    path = tmpdir.join('params.yml')
+    path.write(yaml.safe_dump(data))
+    return str(path)
+
+
+def test_incremental_calibrator_gets_unreadable_images(tmpdir):
+    blind_params_fn = write_blind_params(tmpdir)
+    alerts = []
+    calibrator = _calibration.IncrementalCalibrator(
+        update_interval=20,
+        reference_centers={
+            '0.0001': DialCenter((37.3, 63.4), 16),
+            '0.001': DialCenter((94.0, 86.0), 15),
+            '0.01': DialCenter((130.0, 71.9), 11),  # Moved by 5 pixels
+            '0.1': DialCenter((160.9, 36.5), 12),
+        },
+        on_drift=alerts.append)
+    results = list(get_meter_values(
+        blind_params_fn, get_sample_files(), calibrator))
+    assert all(x.error is not None for x in results)
+    assert calibrator.image_count == count_located(results)
+    assert len(alerts) == 1
+    assert abs(alerts[0].offsets['0.01'] - 5.5) < 0.5
+
+
+def test_calibrator_error_does_not_hide_reading_error(tmpdir):
+    calibrator = _calibration.IncrementalCalibrator()
+    image = os.path.join(
+        project_dir, 'sample-images1', '20180814021357-00-e01.jpg')
+    with patch.object(
+            calibrator, 'add_image', side_effect=RuntimeError('broken')):
+        (result,) = get_meter_values(
+            write_blind_params(tmpdir), [image], calibrator)
+    assert isinstance(result.error, NeedleContoursNotFoundError)
+
+
 @pytest.mark.parametrize('filename', [
     '20180814021309-01-e01.jpg',
     '20180814021310-00-e02.jpg',
@@ -0,0 +1,178 @@
+import os
+import urllib.error
+import urllib.request
+from unittest.mock import patch
+
+import pytest
+import yaml
+
+from meterelf import _debug_output, _main, _metrics, get_meter_values
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+sample_dir = os.path.join(project_dir, 'sample-images1')
+
+IMAGE_FILES = [
+    os.path.join(sample_dir, '20180814021309-01-e01.jpg'),
+    os.path.join(sample_dir, '20180814021357-00-e01.jpg'),
+    os.path.join(sample_dir, '20180814023853-00-e08.jpg'),
+]
+
+
+def test_render_counter_and_histogram():
+    registry = _metrics.MetricsRegistry()
+    counter = registry.counter('x_total', 'Number of x.', ['kind'])
+    histogram = registry.histogram(
+        'y_seconds', 'Duration of y.', buckets=[0.1, 1])
+    counter.inc('a')
+    counter.inc('b"', amount=2)
+    counter.inc('a')
+    histogram.observe(0.1)
+    histogram.observe(0.5)
+    histogram.observe(3)
+    assert registry.render() == (
+        '# HELP x_total Number of x.\n'
+        '# TYPE x_total counter\n'
+        'x_total{kind="a"} 2\n'
+        'x_total{kind="b\\""} 2\n'
+        '# HELP y_seconds Duration of y.\n'
+        '# TYPE y_seconds histogram\n'
+        'y_seconds_bucket{le="0.1"} 1\n'
+        'y_seconds_bucket{le="1"} 2\n'
+        'y_seconds_bucket{le="+Inf"} 3\n'
+        'y_seconds_sum 3.6\n'
+        'y_seconds_count 3\n')
+
+
+def test_gauge():
+    registry = _metrics.MetricsRegistry()
+    gauge = registry.gauge('z', 'Depth of z.', ['queue'])
+    gauge.inc('a', amount=3)
+    gauge.dec('a')
+    gauge.set(5, 'b')
+    assert gauge.get('a') == 2
+    assert registry.render() == (
+        '# HELP z Depth of z.\n'
+        '# TYPE z gauge\n'
+        'z{queue="a"} 2\n'
+        'z{queue="b"} 5\n')
+
+
+def test_metric_without_samples_cannot_be_created():
+    class Incomplete(_metrics._Metric):
+        type_name = 'untyped'
+
+    with pytest.raises(TypeError):
+        Incomplete('w', 'Incomplete w.')
+
+
+def test_wrong_labels():
+    registry = _metrics.MetricsRegistry()
+    counter = registry.counter('x_total', 'Number of x.', ['kind'])
+    with pytest.raises(ValueError) as excinfo:
+        counter.inc()
+    assert str(excinfo.value) == 'x_total takes labels: kind'
+    with pytest.raises(ValueError):
+        registry.counter('x_total', 'Again')
+
+
+def test_timer():
+    registry = _metrics.MetricsRegistry()
+    histogram = registry.histogram('t_seconds', 'Duration.', ['stage'])
+    with histogram.time('a'):
+        pass
+    assert histogram.get_count('a') == 1
+    assert histogram.get_count('b') == 0
+
+
+def test_api_updates_metrics():
+    images_before = _metrics.IMAGES.get()
+    readings_before = _metrics.READINGS.get('')
+    errors_before = _metrics.ERRORS.get('', 'DialsNotFoundError')
+    loads_before = _metrics.STAGE_DURATION.get_count('load')
+    params_file = os.path.join(sample_dir, 'params.yml')
+    list(get_meter_values(params_file, IMAGE_FILES))
+    assert _metrics.IMAGES.get() - images_before == 3
+    assert _metrics.READINGS.get('') - readings_before == 2
+    assert (
+        _metrics.ERRORS.get('', 'DialsNotFoundError') - errors_before == 1)
+    assert _metrics.STAGE_DURATION.get_count('load') - loads_before == 3
+
+
+def write_blind_params(tmpdir):
+    with open(os.path.join(sample_dir, 'params.yml'), 'rt') as fp:
+        data = yaml.safe_load(fp)
+    data['dials_template'] = os.path.join(sample_dir, data['dials_template'])
+    data['meters'] = [{'name': 'blind'}]
+    data['needle_data'][2]['color_range'] = {'h': 0, 'l': 0, 's': 0}
+    path = tmpdir.join('params.yml')
+    path.write(yaml.safe_dump(data))
+    return path
+
+
+def test_unreadable_dials_are_counted(tmpdir):
+    path = write_blind_params(tmpdir)
+    before = _metrics.UNREADABLE_DIALS.get('blind', '0.01')
+    errors_before = _metrics.ERRORS.get(
+        'blind', 'NeedleContoursNotFoundError')
+    list(get_meter_values(str(path), IMAGE_FILES[1:]))
+    assert _metrics.UNREADABLE_DIALS.get('blind', '0.01') - before == 2
+    assert _metrics.ERRORS.get(
+        'blind', 'NeedleContoursNotFoundError') - errors_before == 2
+
+
+def test_debug_rerun_is_not_counted(tmpdir):
+    path = write_blind_params(tmpdir)
+    sink = _debug_output.DebugImageSink(str(tmpdir), failures_only=True)
+    before = _metrics.UNREADABLE_DIALS.get('blind', '0.01')
+    reads_before = _metrics.STAGE_DURATION.get_count('read_dials')
+    with patch.object(_debug_output, '_sink', new=sink):
+        list(get_meter_values(str(path), IMAGE_FILES[1:2]))
+    sink.close()
+    assert os.listdir(str(tmpdir)) != ['params.yml']
+    assert _metrics.UNREADABLE_DIALS.get('blind', '0.01') - before == 1
+    assert _metrics.STAGE_DURATION.get_count('read_dials') - reads_before == 1
+
+
+def test_captured_updates_are_applied_later():
+    registry = _metrics.MetricsRegistry()
+    counter = registry.counter('x_total', 'Number of x.')
+    gauge = registry.gauge('z', 'Depth of z.')
+    histogram = registry.histogram('y_seconds', 'Duration of y.')
+    with _metrics.capture() as updates:
+        counter.inc()
+        gauge.set(4)
+        histogram.observe(0.5)
+    assert (counter.get(), gauge.get(), histogram.get_count()) == (0, 0, 0)
+    registry.apply(updates)
+    assert (counter.get(), gauge.get(), histogram.get_count()) == (1, 4, 1)
+
+
+def test_main_writes_metrics_file(tmpdir, capsys):
+    metrics_file = str(tmpdir.join('meterelf.prom'))
+    params_file = os.path.join(sample_dir, 'params.yml')
+    _main.main([
+        'meterelf', params_file, IMAGE_FILES[1],
+        '--metrics-file', metrics_file, '--metrics-interval', '0.01'])
+    with open(metrics_file, 'rt') as fp:
+        content = fp.read()
+    assert '# TYPE meterelf_images_total counter\n' in content
+    assert 'meterelf_stage_duration_seconds_count{stage="meter"} ' in content
+    assert not os.path.exists(metrics_file + '.tmp')
+
+
+def test_metrics_server():
+    server = _metrics.start_metrics_server(0)
+    try:
+        url = 'http://127.0.0.1:{}/metrics'.format(server.server_port)
+        with urllib.request.urlopen(url) as response:
+            content_type = response.headers['Content-Type']
+            body = response.read().decode('utf-8')
+        assert content_type.startswith('text/plain; version=0.0.4')
+        assert body == _metrics.REGISTRY.render()
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            urllib.request.urlopen(url + '/other')
+        assert excinfo.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,104 @@
+import os
+
+import cv2
+import pytest
+import yaml
+
+from meterelf import _main, _params, get_meter_values
+from meterelf.exceptions import DialsNotFoundError, ImageLoadingError
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+sample_dir = os.path.join(project_dir, 'sample-images1')
+
+IMAGE_FILES = [
+    os.path.join(sample_dir, '20180814021357-00-e01.jpg'),
+    os.path.join(sample_dir, '20180814023853-00-e08.jpg'),
+]
+
+
+@pytest.fixture
+def params_file(tmpdir):
+    with open(os.path.join(sample_dir, 'params.yml'), 'rt') as fp:
+        data = yaml.safe_load(fp)
+    data['dials_template'] = os.path.join(sample_dir, data['dials_template'])
+    data['meters'] = [
+        {'name': 'cold'},
+        {'name': 'hot', 'dials_template_match_threshold': 10**12},
+        {'name': 'warm', 'hue_shift': 0},
+    ]
+    path = tmpdir.join('params.yml')
+    path.write(yaml.safe_dump(data))
+    return str(path)
+
+
+def test_load_meters(params_file):
+    meters = _params.load_meters(params_file)
+    assert [x.name for x in meters] == ['cold', 'hot', 'warm']
+    assert [x.hue_shift for x in meters] == [128, 128, 0]
+    assert meters[1].dials_match_threshold == 10**12
+
+
+def test_load_single_meter_from_multiple(params_file):
+    assert _params.load(params_file, 'hot').name == 'hot'
+    with pytest.raises(_params.LoadError) as excinfo:
+        _params.load(params_file)
+    assert str(excinfo.value) == (
+        f'Select one of the meters in {params_file}: cold, hot, warm')
+    with pytest.raises(_params.LoadError):
+        _params.load(params_file, 'lukewarm')
+
+
+def test_load_meters_without_meters():
+    meters = _params.load_meters(os.path.join(sample_dir, 'params.yml'))
+    assert [x.name for x in meters] == [None]
+
+
+def test_duplicate_meter_names(tmpdir):
+    path = tmpdir.join('params.yml')
+    path.write(yaml.safe_dump({'meters': [{'name': 'a'}, {'name': 'a'}]}))
+    with pytest.raises(_params.LoadError) as excinfo:
+        _params.load_meters(str(path))
+    assert str(excinfo.value) == 'Duplicate meter name: a'
+
+
+@pytest.mark.parametrize('meter_workers', [1, 3])
+def test_get_meter_values_decodes_once(
+        params_file, monkeypatch, meter_workers):
+    imread_calls = []
+    real_imread = cv2.imread
+
+    def imread(filename, *args):
+        imread_calls.append(filename)
+        return real_imread(filename, *args)
+
+    monkeypatch.setattr('meterelf._image.cv2.imread', imread)
+    results = list(get_meter_values(
+        params_file, IMAGE_FILES, meter_workers=meter_workers))
+    assert [x for x in imread_calls if x.endswith('.jpg')] == IMAGE_FILES
+    assert [(os.path.basename(x.filename), x.meter) for x in results] == [
+        ('20180814021357-00-e01.jpg', 'cold'),
+        ('20180814021357-00-e01.jpg', 'hot'),
+        ('20180814021357-00-e01.jpg', 'warm'),
+        ('20180814023853-00-e08.jpg', 'cold'),
+        ('20180814023853-00-e08.jpg', 'hot'),
+        ('20180814023853-00-e08.jpg', 'warm'),
+    ]
+    assert ['{:.3f}'.format(x.value) for x in results[::3]] == [
+        '905.126', '932.800']
+    assert all(isinstance(x.error, DialsNotFoundError) for x in results[1::3])
+
+
+def test_get_meter_values_with_unreadable_file(params_file):
+    results = list(get_meter_values(params_file, ['nonexisting.jpg']))
+    assert [x.meter for x in results] == ['cold', 'hot', 'warm']
+    assert all(isinstance(x.error, ImageLoadingError) for x in results)
+
+
+def test_main_with_multiple_meters(params_file, capsys):
+    _main.main(['meterelf', params_file, IMAGE_FILES[0], '-j', '2'])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == IMAGE_FILES[0] + ' [cold]: 905.126'
+    assert lines[1].startswith(
+        IMAGE_FILES[0] + ' [hot]: UNKNOWN Dials not found')
+    assert lines[2].startswith(IMAGE_FILES[0] + ' [warm]: ')
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+import yaml
+
+from meterelf import _params
+from meterelf._dial_data import get_dial_data
+from meterelf._image import ImageFile
+from meterelf._polar_reading import get_dial_positions_polar, read_dial_polar
+from meterelf._reading import get_meter_value
+from meterelf.exceptions import DialAngleDeterminingError, ImageProcessingError
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+
+# Minimum share of the images for which the polar reading must give
+# the same value as in the expected output of the sample images, and
+# a value within 0.05 of it
+MIN_AGREEMENT = 0.85
+MIN_CLOSE_AGREEMENT = 0.95
+
+
+def load_params(sample_dir, **overrides):
+    params = _params.load(os.path.join(project_dir, sample_dir, 'params.yml'))
+    for (name, value) in overrides.items():
+        setattr(params, name, value)
+    return params
+
+
+def read_expected_values(sample_dir):
+    path = os.path.join(mydir, sample_dir + '_stdout.txt')
+    with open(path, 'rt') as fp:
+        lines = [line.rstrip().split(': ', 1) for line in fp]
+    return {
+        filename: float(value) for (filename, value) in lines
+        if not value.startswith('UNKNOWN')}
+
+
+def values_match(value, expected, max_diff=0.005):
+    diff = abs(value - expected)
+    return min(diff, abs(diff - 1000)) < max_diff
+
+
+@pytest.mark.parametrize('sample_dir', ['sample-images1', 'sample-images2'])
+def test_polar_reading_agrees_with_sample_outputs(sample_dir):
+    params = load_params(sample_dir, reading_method='polar')
+    expected_values = read_expected_values(sample_dir)
+    matches = 0
+    close_matches = 0
+    for (filename, expected) in expected_values.items():
+        path = os.path.join(project_dir, sample_dir, filename)
+        try:
+            result = get_meter_value(ImageFile(path, params), annotate=False)
+        except ImageProcessingError:
+            continue
+        matches += values_match(result['value'], expected)
+        close_matches += values_match(result['value'], expected, 0.05)
+    assert matches >= MIN_AGREEMENT * len(expected_values)
+    assert close_matches >= MIN_CLOSE_AGREEMENT * len(expected_values)
+
+
+def test_angle_bins():
+    filename = os.path.join(
+        project_dir, 'sample-images1', '20180814021357-00-e01.jpg')
+    positions = []
+    for bins in [90, 360, 720]:
+        params = load_params('sample-images1', polar_angle_bins=bins)
+        imgf = ImageFile(filename, params)
+        positions.append(get_dial_positions_polar(imgf, imgf.get_dials_hls()))
+    for name in positions[0]:
+        values = [x[name] for x in positions]
+        assert max(values) - min(values) < 0.1, name
+
+
+def test_unreadable_dial():
+    params = load_params('sample-images1')
+    params.dial_color_range['0.01'] = params.dial_color_range['0.01'] * 0
+    imgf = ImageFile(os.path.join(
+        project_dir, 'sample-images1', '20180814021357-00-e01.jpg'), params)
+    dials_hls = imgf.get_dials_hls()
+    dial_data = get_dial_data(params)['0.01']
+    assert read_dial_polar(params, dials_hls, dial_data) is None
+    with pytest.raises(DialAngleDeterminingError) as excinfo:
+        get_dial_positions_polar(imgf, dials_hls)
+    assert excinfo.value.extra_info == {'unreadable dials': '0.01'}
+
+
+def test_too_few_angle_bins():
+    sample_dir = os.path.join(project_dir, 'sample-images1')
+    with open(os.path.join(sample_dir, 'params.yml'), 'rt') as fp:
+        data = yaml.safe_load(fp)
+    data['polar_angle_bins'] = 10
+    with pytest.raises(_params.LoadError) as excinfo:
+        _params.Params(sample_dir, data)
+    assert str(excinfo.value) == 'polar_angle_bins must be at least 36'
@@ -0,0 +1,172 @@
+import os
+from datetime import datetime, timedelta
+
+import cv2
+import pytest
+
+from meterelf import _main, get_meter_values_at
+from meterelf._api import MeterImageData
+from meterelf._query import (
+    SparseQuery, TimeIndex, interpolate_value, parse_duration)
+from meterelf.exceptions import DialsNotFoundError
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+sample_dir = os.path.join(project_dir, 'sample-images1')
+params_file = os.path.join(sample_dir, 'params.yml')
+
+FILENAMES = [
+    'x/20180101000000.jpg',
+    'x/20180101010000.jpg',
+    'x/20180101020000.jpg',
+    'x/20180101030000.jpg',
+    'x/template.png',
+]
+
+VALUES = {
+    'x/20180101000000.jpg': 998.0,
+    'x/20180101010000.jpg': None,
+    'x/20180101020000.jpg': None,
+    'x/20180101030000.jpg': 2.0,
+}
+
+
+def make_query(**kwargs):
+    read_files = []
+
+    def read_image(filename):
+        read_files.append(filename)
+        value = VALUES[filename]
+        error = DialsNotFoundError(filename) if value is None else None
+        return MeterImageData(filename, value, error, {})
+
+    query = SparseQuery(TimeIndex(FILENAMES), read_image, **kwargs)
+    return (query, read_files)
+
+
+def t(hour, minute=0):
+    return datetime(2018, 1, 1, hour, minute)
+
+
+def test_time_index():
+    index = TimeIndex(reversed(FILENAMES))
+    assert len(index) == 4
+    assert index.filenames == FILENAMES[:4]
+    assert list(index.iter_nearest(t(1, 40))) == [2, 1, 3, 0]
+    assert list(index.iter_nearest(t(1, 30))) == [1, 2, 0, 3]
+    assert list(index.iter_nearest(t(5))) == [3, 2, 1, 0]
+    assert list(index.iter_at_or_before(t(2))) == [2, 1, 0]
+    assert list(index.iter_at_or_after(t(2))) == [2, 3]
+    assert list(index.iter_at_or_after(t(4))) == []
+
+
+def test_walks_to_neighbours_on_failure():
+    (query, read_files) = make_query()
+    result = query.query(t(1, 40))
+    assert result.value == 2.0
+    assert [x.data.filename for x in result.readings] == [FILENAMES[3]]
+    assert not result.interpolated
+    assert read_files == [FILENAMES[2], FILENAMES[1], FILENAMES[3]]
+
+
+def test_images_are_read_once():
+    (query, read_files) = make_query()
+    query.query(t(0, 10))
+    query.query(t(0, 20))
+    assert read_files == [FILENAMES[0]]
+
+
+def test_max_tries_and_distance():
+    (query, read_files) = make_query(max_tries=2)
+    assert query.query(t(1, 40)).value is None
+    assert read_files == [FILENAMES[2], FILENAMES[1]]
+    (query, read_files) = make_query(max_distance=timedelta(minutes=30))
+    assert query.query(t(1, 40)).value is None
+    assert read_files == [FILENAMES[2]]
+
+
+def test_interpolation():
+    (query, _read_files) = make_query(interpolate=True)
+    result = query.query(t(1, 30))
+    assert result.interpolated
+    assert result.value == pytest.approx(0.0)
+    assert [x.timestamp for x in result.readings] == [t(0), t(3)]
+    result = query.query(t(0))
+    assert result.value == 998.0
+    assert not result.interpolated
+    result = query.query(t(4))
+    assert result.value == 2.0
+    assert [x.timestamp for x in result.readings] == [t(3)]
+
+
+def test_interpolation_with_backward_jitter():
+    value = interpolate_value(t(4, 30), t(4), 948.603, t(5), 948.602)
+    assert value == pytest.approx(948.6025)
+
+
+def test_interpolation_across_range_end():
+    value = interpolate_value(t(4, 15), t(4), 999.5, t(5), 1.5)
+    assert value == pytest.approx(0.0)
+    value = interpolate_value(t(4, 30), t(4), 0.002, t(5), 999.998)
+    assert value == pytest.approx(0.0)
+
+
+def test_parse_duration():
+    assert parse_duration('15m') == timedelta(minutes=15)
+    assert parse_duration('2w') == timedelta(days=14)
+    for text in ['', '1', 'm', '0s', '1y']:
+        with pytest.raises(ValueError):
+            parse_duration(text)
+
+
+def test_get_meter_values_at_reads_only_needed_images(monkeypatch):
+    read_files = []
+    imread = cv2.imread
+
+    def counting_imread(filename, *args):
+        if filename.endswith('.jpg'):
+            read_files.append(os.path.basename(filename))
+        return imread(filename, *args)
+
+    monkeypatch.setattr(cv2, 'imread', counting_imread)
+    filenames = [
+        os.path.join(sample_dir, x) for x in sorted(os.listdir(sample_dir))]
+    results = list(get_meter_values_at(
+        params_file, [datetime(2018, 8, 14, 2, 13, 8)], filenames=filenames))
+    assert read_files == [
+        '20180814021309-01-e01.jpg',
+        '20180814021310-00-e02.jpg',
+        '20180814021357-00-e01.jpg',
+    ]
+    assert len(results) == 1
+    assert results[0].value == pytest.approx(905.126, abs=0.001)
+
+
+def test_main_query(capsys, monkeypatch):
+    monkeypatch.chdir(sample_dir)
+    _main.main([
+        'meterelf', 'query', 'params.yml', '--interpolate',
+        '--start', '2018-08-15', '--end', '2018-08-16', '--every', '1d'])
+    assert capsys.readouterr().out.splitlines() == [
+        '2018-08-15 00:00:00: 280.091 '
+        '(20180814220725-01-e141.jpg .. 20180815012802-00-e150.jpg)',
+        '2018-08-16 00:00:00: 524.011 '
+        '(20180815222010-00-e251.jpg .. 20180816010432-00-e262.jpg)',
+    ]
+
+
+def test_main_query_unknown(capsys, monkeypatch):
+    monkeypatch.chdir(sample_dir)
+    _main.main([
+        'meterelf', 'query', 'params.yml', '--at', '2018-08-14T02:13:10',
+        '--max-tries', '1'])
+    assert capsys.readouterr().out == (
+        '2018-08-14 02:13:10: UNKNOWN No readable images\n')
+
+
+def test_main_query_needs_targets(capsys):
+    with pytest.raises(SystemExit):
+        _main.main(['meterelf', 'query', params_file])
+    with pytest.raises(SystemExit):
+        _main.main(['meterelf', 'query', params_file, '--every', '1d'])
+    assert '--every: requires --start and --end' in capsys.readouterr().err
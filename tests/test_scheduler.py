@@ -0,0 +1,119 @@
+import os
+
+import pytest
+import yaml
+
+from meterelf import _metrics, get_meter_values
+from meterelf._scheduler import BACKFILL, LIVE, Scheduler, SchedulerError
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+sample_dir = os.path.join(project_dir, 'sample-images1')
+params_file = os.path.join(sample_dir, 'params.yml')
+
+IMAGE_FILES = [
+    os.path.join(sample_dir, x) for x in [
+        '20180814021309-01-e01.jpg',
+        '20180814021357-00-e01.jpg',
+        '20180814074748-00-e07.jpg',
+        '20180814074957-01-e07.jpg',
+    ]]
+
+
+@pytest.fixture(scope='module')
+def scheduler():
+    with Scheduler(workers=2) as scheduler:
+        yield scheduler
+
+
+def test_results_of_feeds(scheduler):
+    scheduler.add_feed('cam1', params_file)
+    scheduler.add_feed('cam2', params_file)
+    scheduler.submit('cam1', IMAGE_FILES[:2], BACKFILL)
+    scheduler.submit('cam2', IMAGE_FILES[2:])
+    scheduler.submit('cam1', IMAGE_FILES[2:3])
+    scheduler.close_feed('cam1')
+    scheduler.close_feed('cam2')
+    expected = {
+        x.filename: x for x in get_meter_values(params_file, IMAGE_FILES)}
+    results1 = list(scheduler.results('cam1'))
+    results2 = list(scheduler.results('cam2'))
+    assert sorted(x.filename for x in results1) == sorted(IMAGE_FILES[:3])
+    assert sorted(x.filename for x in results2) == sorted(IMAGE_FILES[2:])
+    for data in results1 + results2:
+        assert data.value == expected[data.filename].value
+        assert type(data.error) is type(expected[data.filename].error)
+    stats = scheduler.get_stats()
+    assert stats['cam1'].queued == {LIVE: 0, BACKFILL: 0}
+    assert stats['cam1'].in_flight == 0
+    assert stats['cam1'].done == stats['cam1'].wait_count == 3
+    assert stats['cam1'].max_wait >= stats['cam1'].mean_wait >= 0
+    assert _metrics.SCHEDULER_WAIT.get_count('cam1', BACKFILL) == 2
+    assert _metrics.SCHEDULER_QUEUE_DEPTH.get('cam1', BACKFILL) == 0
+
+
+def test_worker_metrics_are_recorded(scheduler):
+    images_before = _metrics.IMAGES.get()
+    loads_before = _metrics.STAGE_DURATION.get_count('load')
+    locates_before = _metrics.STAGE_DURATION.get_count('locate_dials')
+    scheduler.add_feed('metrics', params_file)
+    scheduler.submit('metrics', IMAGE_FILES)
+    scheduler.close_feed('metrics')
+    list(scheduler.results('metrics'))
+    assert _metrics.IMAGES.get() - images_before == 4
+    assert _metrics.STAGE_DURATION.get_count('load') - loads_before == 4
+    assert (
+        _metrics.STAGE_DURATION.get_count('locate_dials') -
+        locates_before == 4)
+
+
+def test_live_first_and_fair_share(scheduler):
+    for (name, weight) in [('a', 1), ('b', 1), ('c', 2)]:
+        scheduler.add_feed(name, params_file, weight)
+    # Hold the lock of the scheduler to see the order of dispatching
+    with scheduler._condition:
+        scheduler.submit('a', ['a1', 'a2', 'a3', 'a4'], BACKFILL)
+        scheduler.submit('b', ['b1', 'b2'], BACKFILL)
+        scheduler.submit('a', ['a5'], LIVE)
+        order = [scheduler._pop_next_job().filename for _ in range(7)]
+        scheduler.submit('c', ['c1', 'c2', 'c3'], BACKFILL)
+        scheduler.submit('a', ['a6', 'a7'], BACKFILL)
+        order += [scheduler._pop_next_job().filename for _ in range(5)]
+        assert scheduler._pop_next_job() is None
+    assert order == [
+        'a5', 'a1', 'b1', 'a2', 'b2', 'a3', 'a4',
+        'c1', 'c2', 'a6', 'c3', 'a7']
+
+
+def test_worker_failure(scheduler, tmp_path):
+    with open(params_file, 'rt') as fp:
+        data = yaml.safe_load(fp)
+    data['dials_template'] = os.path.join(sample_dir, data['dials_template'])
+    path = tmp_path / 'params.yml'
+    path.write_text(yaml.safe_dump(data))
+    scheduler.add_feed('broken', str(path))
+    path.unlink()
+    scheduler.submit('broken', IMAGE_FILES[1:2])
+    scheduler.close_feed('broken')
+    (result,) = list(scheduler.results('broken'))
+    assert result.value is None
+    assert result.error.get_message().startswith(
+        'Worker failed: LoadError: Cannot load YAML data from ')
+
+
+def test_invalid_use(scheduler):
+    scheduler.add_feed('x', params_file)
+    with pytest.raises(SchedulerError) as excinfo:
+        scheduler.add_feed('x', params_file)
+    assert str(excinfo.value) == 'Duplicate feed: x'
+    with pytest.raises(SchedulerError) as excinfo:
+        scheduler.submit('y', IMAGE_FILES)
+    assert str(excinfo.value) == 'No feed named y'
+    with pytest.raises(ValueError) as excinfo:
+        scheduler.submit('x', IMAGE_FILES, 'urgent')
+    assert str(excinfo.value) == 'Unknown priority: urgent'
+    scheduler.close_feed('x')
+    with pytest.raises(SchedulerError) as excinfo:
+        scheduler.submit('x', IMAGE_FILES)
+    assert str(excinfo.value) == 'Feed is closed: x'
+    assert list(scheduler.results('x')) == []
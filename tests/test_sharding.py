@@ -0,0 +1,132 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from meterelf import _main, _sharding
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+
+IMAGE_FILES = [
+    '20180814021310-00-e02.jpg',
+    '20180814021357-00-e01.jpg',
+    '20180814023853-00-e08.jpg',
+    '20180814074748-00-e07.jpg',
+    '20180819172814-01-e657.jpg',
+    '20180819191907-01-e685.jpg',
+]
+
+
+def test_hash_shards_partition_files():
+    filenames = ['{:04d}.jpg'.format(x) for x in range(100)]
+    shards = [_sharding.Shard(i, 3) for i in range(1, 4)]
+    parts = [list(shard.filter(filenames)) for shard in shards]
+    assert sorted(sum(parts, [])) == filenames
+    assert all(parts)
+
+
+def test_hash_shard_ignores_directory():
+    shard = _sharding.Shard(2, 5)
+    assert (shard.get_shard_number('a/b/20180814021357.jpg') ==
+            shard.get_shard_number('20180814021357.jpg'))
+
+
+def test_time_shards():
+    start = datetime(2018, 8, 14)
+    end = datetime(2018, 8, 20)
+    shards = [_sharding.Shard(i, 2, 'time', start, end) for i in (1, 2)]
+    assert [list(x.filter(IMAGE_FILES)) for x in shards] == [
+        IMAGE_FILES[:4], IMAGE_FILES[4:]]
+    assert shards[0].get_shard_number('20180820000000.jpg') is None
+
+
+@pytest.mark.parametrize('text', ['0/2', '3/2', '1', 'a/b'])
+def test_parse_invalid_shard(text):
+    with pytest.raises(ValueError):
+        _sharding.Shard.parse(text)
+
+
+def test_parse_time_shard_without_range():
+    with pytest.raises(ValueError) as excinfo:
+        _sharding.Shard.parse('1/2', 'time')
+    assert str(excinfo.value) == 'Sharding by time needs start and end'
+
+
+@pytest.mark.parametrize('microsecond', [0, 250000])
+def test_shard_info_round_trip(microsecond):
+    start = datetime(2018, 8, 14, 2, 13, 57, microsecond)
+    shard = _sharding.Shard(1, 2, 'time', start, datetime(2018, 8, 20))
+    assert _sharding.Shard.from_info(shard.get_info()) == shard
+
+
+def run_shards(tmpdir, monkeypatch, count, extra_args=()):
+    monkeypatch.chdir(os.path.join(project_dir, 'sample-images1'))
+    partial_files = []
+    for number in range(1, count + 1):
+        partial_file = str(tmpdir.join(f'part{number}.jsonl'))
+        _main.main(
+            ['meterelf', 'params.yml'] + IMAGE_FILES[::-1] +
+            ['--shard', f'{number}/{count}', '-o', partial_file] +
+            list(extra_args))
+        partial_files.append(partial_file)
+    return partial_files
+
+
+@pytest.mark.parametrize('extra_args', [
+    [],
+    ['--shard-by', 'time', '--start', '2018-08-14', '--end', '2018-08-20'],
+])
+def test_merge_shards(tmpdir, monkeypatch, capsys, extra_args):
+    partial_files = run_shards(tmpdir, monkeypatch, 3, extra_args)
+    _main.main(['meterelf', 'params.yml'] + IMAGE_FILES)
+    unsharded_output = capsys.readouterr().out
+    _main.main(['meterelf', 'merge'] + partial_files[::-1])
+    captured = capsys.readouterr()
+    assert captured.out == unsharded_output
+    assert captured.out.splitlines()[0].startswith(
+        '20180814021310-00-e02.jpg: UNKNOWN Dials not found')
+    assert captured.out.splitlines()[1:] == [
+        '20180814021357-00-e01.jpg: 905.126',
+        '20180814023853-00-e08.jpg: 932.800',
+        '20180814074748-00-e07.jpg: 972.797',
+        '20180819172814-01-e657.jpg: 964.627',
+        '20180819191907-01-e685.jpg: 022.179',
+    ]
+
+
+def test_merge_reports_missing_and_duplicate_shards(
+        tmpdir, monkeypatch, capsys):
+    partial_files = run_shards(tmpdir, monkeypatch, 3)
+    with pytest.raises(SystemExit):
+        _main.main(['meterelf', 'merge'] + partial_files[:2] * 2)
+    captured = capsys.readouterr()
+    assert 'Shard 1/3 already in {}'.format(partial_files[0]) in captured.err
+    assert 'Missing shards: 3/3' in captured.err
+
+
+def test_merge_reports_incomplete_and_duplicate_results(tmpdir):
+    partial_file = str(tmpdir.join('part.jsonl'))
+    with open(partial_file, 'wt') as fp:
+        _sharding.write_partial(fp, [
+            _sharding.MeterImageData('a.jpg', 1.0, None, {'value': 1.0}),
+        ])
+    with open(partial_file, 'rt') as fp:
+        lines = fp.readlines()
+    with open(partial_file, 'wt') as fp:
+        fp.writelines(lines[:2] * 2)
+    with pytest.raises(_sharding.MergeError) as excinfo:
+        _sharding.merge_partials([partial_file])
+    assert excinfo.value.problems == [
+        f'{partial_file}: Incomplete, footer missing',
+        f'{partial_file}: Duplicate a.jpg (also in {partial_file})',
+    ]
+
+
+def test_merge_keeps_reading_tier(tmpdir):
+    partial_file = str(tmpdir.join('part.jsonl'))
+    data = _sharding.MeterImageData(
+        'a.jpg', 1.0, None, {'value': 1.0}, 'main', 2)
+    with open(partial_file, 'wt') as fp:
+        _sharding.write_partial(fp, [data])
+    assert _sharding.merge_partials([partial_file]) == [data]
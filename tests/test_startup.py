@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+
+HEAVY_MODULES = ['cv2', 'numpy', 'yaml']
+
+CHECK_MODULES_CODE = '''
+import sys
+{code}
+print(' '.join(sorted(x for x in {modules!r} if x in sys.modules)))
+'''
+
+
+def run_python(code):
+    return subprocess.run(
+        [sys.executable, '-c', code], cwd=project_dir,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+
+
+def get_loaded_heavy_modules(code):
+    full_code = CHECK_MODULES_CODE.format(code=code, modules=HEAVY_MODULES)
+    return run_python(full_code).stdout.split()
+
+
+def test_import_does_not_load_heavy_modules():
+    assert get_loaded_heavy_modules('import meterelf, meterelf._main') == []
+
+
+def test_usage_error_does_not_load_heavy_modules():
+    code = (
+        'from meterelf import _main\n'
+        'try:\n'
+        '    _main.main(["meterelf"])\n'
+        'except SystemExit:\n'
+        '    pass\n')
+    assert get_loaded_heavy_modules(code) == []
+
+
+def test_image_processing_loads_heavy_modules():
+    code = (
+        'import os\n'
+        'from meterelf import get_meter_values\n'
+        'image = os.path.join("sample-images1", "20180814021357-00-e01.jpg")\n'
+        'params_file = os.path.join("sample-images1", "params.yml")\n'
+        'list(get_meter_values(params_file, [image]))\n')
+    assert get_loaded_heavy_modules(code) == HEAVY_MODULES
@@ -0,0 +1,146 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+import yaml
+
+from meterelf import MeterImageData, _main, get_meter_values
+from meterelf._store import (
+    ReadingsStore, StoreError, get_params_fingerprints)
+from meterelf.exceptions import DialsNotFoundError
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+sample_dir = os.path.join(project_dir, 'sample-images1')
+params_file = os.path.join(sample_dir, 'params.yml')
+
+IMAGE_FILES = [
+    os.path.join(sample_dir, x) for x in [
+        '20180814021309-01-e01.jpg',
+        '20180814021357-00-e01.jpg',
+        '20180814023853-00-e08.jpg',
+        '20180819172814-01-e657.jpg',
+    ]]
+
+
+@pytest.fixture
+def store_file(tmpdir):
+    return str(tmpdir.join('readings.db'))
+
+
+def make_data(time_str, value, meter=None, error=None):
+    return MeterImageData(
+        f'{time_str}-00-e01.jpg', value, error,
+        {'value': value} if value is not None else {}, meter)
+
+
+def test_record_and_query(store_file):
+    results = list(get_meter_values(params_file, IMAGE_FILES))
+    with ReadingsStore(store_file) as store:
+        assert list(store.record(results, params_file)) == results
+    fingerprint = get_params_fingerprints(params_file)['']
+    with ReadingsStore(store_file) as store:
+        readings = list(store.iter_range())
+        assert [x.filename for x in readings] == IMAGE_FILES
+        assert readings[0].timestamp == datetime(2018, 8, 14, 2, 13, 9)
+        assert readings[0].value is None
+        assert readings[0].error == 'DialsNotFoundError'
+        assert readings[1].meter is None
+        assert readings[1].value == results[1].value
+        assert readings[1].meter_values == results[1].meter_values
+        assert {x.params_fingerprint for x in readings} == {fingerprint}
+        selected = store.iter_range(
+            datetime(2018, 8, 14, 2, 13, 9), datetime(2018, 8, 14, 2, 38, 53),
+            valid_only=True)
+        assert [x.filename for x in selected] == IMAGE_FILES[1:2]
+        assert store.get_latest().filename == IMAGE_FILES[3]
+        assert store.get_latest('other') is None
+
+
+def test_value_and_consumption(store_file):
+    with ReadingsStore(store_file) as store:
+        for data in [
+                make_data('20180814000000', 998.0),
+                make_data('20180814010000', None, error=DialsNotFoundError()),
+                make_data('20180814020000', 1.0),
+                make_data('20180814040000', 5.0),
+                make_data('20180814010000', 500.0, meter='other')]:
+            store.add(data)
+        start = datetime(2018, 8, 14)
+        assert store.get_value_at(start) == 998.0
+        assert store.get_value_at(start + timedelta(hours=3)) == 3.0
+        assert store.get_value_at(start - timedelta(hours=1)) is None
+        assert store.get_value_at(
+            start + timedelta(hours=1), 'other') == 500.0
+        consumption = store.get_consumption(
+            start, start + timedelta(hours=6), timedelta(hours=2))
+        assert [(x.start.hour, x.end.hour) for x in consumption] == [
+            (0, 2), (2, 4), (4, 6)]
+        assert [x.amount for x in consumption] == [
+            pytest.approx(3.0), pytest.approx(4.0), None]
+
+
+def test_consumption_with_jitter_and_rollover(store_file):
+    with ReadingsStore(store_file) as store:
+        for data in [
+                make_data('20180814000000', 948.603),
+                make_data('20180814010000', 948.602),
+                make_data('20180814020000', 999.5),
+                make_data('20180814030000', 0.25)]:
+            store.add(data)
+        start = datetime(2018, 8, 14)
+        consumption = store.get_consumption(
+            start, start + timedelta(hours=3), timedelta(hours=1))
+        assert [x.amount for x in consumption] == [
+            0.0, pytest.approx(50.898), pytest.approx(0.75)]
+
+
+def test_params_fingerprints_change_with_params(tmpdir):
+    with open(params_file, 'rt') as fp:
+        data = yaml.safe_load(fp)
+    data['dials_template'] = os.path.join(sample_dir, data['dials_template'])
+    path = tmpdir.join('params.yml')
+    path.write(yaml.safe_dump(data))
+    fingerprint = get_params_fingerprints(str(path))['']
+    assert get_params_fingerprints(str(path))[''] == fingerprint
+    data['needle_data'][0]['angle_of_zero'] = -4.0
+    path.write(yaml.safe_dump(data))
+    assert get_params_fingerprints(str(path))[''] != fingerprint
+
+
+def test_invalid_store_file(tmpdir):
+    path = tmpdir.join('invalid.db')
+    path.write('x' * 200)
+    with pytest.raises(StoreError) as excinfo:
+        ReadingsStore(str(path))
+    assert str(excinfo.value).startswith(
+        f'Cannot open readings store {path}: ')
+
+
+def test_main_with_store(store_file, capsys):
+    _main.main(['meterelf', params_file, *IMAGE_FILES, '--store', store_file])
+    printed = capsys.readouterr().out
+    assert len(printed.splitlines()) == 4
+    _main.main(['meterelf', 'readings', store_file, '--start', '2018-08-14'])
+    assert capsys.readouterr().out == (
+        '2018-08-14 02:13:09: UNKNOWN DialsNotFoundError '
+        '(20180814021309-01-e01.jpg)\n'
+        '2018-08-14 02:13:57: 905.126 (20180814021357-00-e01.jpg)\n'
+        '2018-08-14 02:38:53: 932.800 (20180814023853-00-e08.jpg)\n'
+        '2018-08-19 17:28:14: 964.627 (20180819172814-01-e657.jpg)\n')
+    _main.main(['meterelf', 'latest', store_file])
+    assert capsys.readouterr().out == (
+        '2018-08-19 17:28:14: 964.627 (20180819172814-01-e657.jpg)\n')
+    _main.main([
+        'meterelf', 'consumption', store_file, '--start', '2018-08-14',
+        '--end', '2018-08-15', '--every', '12h'])
+    assert capsys.readouterr().out == (
+        '2018-08-14 00:00:00 .. 2018-08-14 12:00:00: '
+        'UNKNOWN Not enough readings\n'
+        '2018-08-14 12:00:00 .. 2018-08-15 00:00:00: 2.833\n')
+
+
+def test_main_latest_without_readings(store_file, capsys):
+    with pytest.raises(SystemExit):
+        _main.main(['meterelf', 'latest', store_file])
+    assert capsys.readouterr().err == 'No readings\n'
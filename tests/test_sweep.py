@@ -0,0 +1,153 @@
+import os
+
+import numpy
+import pytest
+
+from meterelf import _main, _params, _sweep
+from meterelf._sweep import Variation
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+params_file = os.path.join(project_dir, 'sample-images1', 'params.yml')
+
+EXPECTED = [
+    '20180814021309-01-e01.jpg: UNKNOWN Dials not found (match val = 0.0)',
+    '20180814021357-00-e01.jpg: 905.126',
+    '20180814074748-00-e07.jpg: 972.797',
+    '20180814074957-01-e07.jpg: 000.002',
+    '20180816101722-01-e281.jpg: 587.598',
+    '20180819204026-01-e706.jpg: 362.432',
+]
+
+
+@pytest.fixture
+def expected_file(tmp_path):
+    path = tmp_path / 'expected.txt'
+    path.write_text(''.join(line + '\n' for line in EXPECTED))
+    return str(path)
+
+
+def test_baseline_matches_expected_values(expected_file):
+    results = _sweep.run_sweep(params_file, expected_file, [])
+    assert len(results) == 1
+    assert results[0].changes == ()
+    assert results[0].matches == results[0].total == len(EXPECTED)
+    assert results[0].describe_changes() == 'baseline'
+
+
+def test_variants_are_ranked(expected_file):
+    variations = [Variation.parse(
+        'dials_template_match_threshold=20000000,900000000')]
+    results = _sweep.run_sweep(params_file, expected_file, variations)
+    assert [x.changes for x in results] == [
+        (), (('dials_template_match_threshold', 20000000),),
+        (('dials_template_match_threshold', 900000000),)]
+    assert results[-1].matches == 1  # Only the unknown one matches
+
+
+def test_parallel_sweep_gives_same_results(expected_file, tmp_path):
+    variations = [
+        Variation.parse('needle_data/*/circle_thickness=2,10'),
+        Variation.parse('needle_data/0.1/color_range/h=5,15')]
+    cache_file = str(tmp_path / 'cache.npy')
+    results = _sweep.run_sweep(
+        params_file, expected_file, variations, cache_file=cache_file)
+    parallel_results = _sweep.run_sweep(
+        params_file, expected_file, variations, cache_file=cache_file,
+        workers=2)
+    assert len(results) == 5
+    assert sorted(parallel_results) == sorted(results)
+
+
+def test_random_search_is_repeatable(expected_file):
+    variations = [
+        Variation.parse('needle_data/*/dist_from_center=2:6:1'),
+        Variation.parse('needle_data/*/angle_of_zero=-5.0:-4.0:0.5')]
+    results1 = _sweep.run_sweep(
+        params_file, expected_file, variations, random_count=4, seed=42)
+    results2 = _sweep.run_sweep(
+        params_file, expected_file, variations, random_count=4, seed=42)
+    assert len(results1) == 5
+    assert len({x.changes for x in results1}) == 5
+    assert results1 == results2
+
+
+def test_dials_cache_is_reused(tmp_path, monkeypatch):
+    params = _params.load(params_file)
+    filenames = [
+        os.path.join(project_dir, 'sample-images1', line.split(':')[0])
+        for line in EXPECTED]
+    cache_file = str(tmp_path / 'cache.npy')
+    cache = _sweep.build_dials_cache(params, filenames, cache_file)
+    assert isinstance(cache.dials_hls, numpy.memmap)
+    assert cache.dials_hls.shape == (len(filenames), 119, 188, 3)
+
+    def fail(filename):
+        raise AssertionError('Image should not be loaded')
+
+    monkeypatch.setattr(_sweep, 'load_image', fail)
+    cache2 = _sweep.build_dials_cache(params, filenames, cache_file)
+    assert cache2.filenames == cache.filenames
+    numpy.testing.assert_array_equal(cache2.match_values, cache.match_values)
+    numpy.testing.assert_array_equal(cache2.dials_hls, cache.dials_hls)
+    with pytest.raises(AssertionError):
+        _sweep.build_dials_cache(params, filenames[:2], cache_file)
+
+
+def test_write_params_file(tmp_path):
+    filename = str(tmp_path / 'best.yml')
+    changes = [('needle_data/0.01/circle_thickness', 7),
+               ('dials_template_match_threshold', 21000000)]
+    _sweep.write_params_file(filename, params_file, changes)
+    params = _params.load(filename)
+    assert params.needle_circle_mask_thickness['0.01'] == 7
+    assert params.needle_circle_mask_thickness['0.1'] == 9
+    assert params.dials_match_threshold == 21000000
+    assert os.path.samefile(
+        params.dials_file,
+        os.path.join(project_dir, 'sample-images1', 'dials_gray.png'))
+
+
+@pytest.mark.parametrize('text,error', [
+    ('hue_shift=1,2', 'Parameter cannot be swept: hue_shift'),
+    ('needle_color_range/h=1,2',
+     'Parameter cannot be swept: needle_color_range/h'),
+    ('needle_data/0.1/center=1', 'Parameter cannot be swept: '
+     'needle_data/0.1/center'),
+    ('reading_method', 'Variation must be KEY=VALUES: reading_method'),
+    ('fast_reading_scale=1:2', 'Range must be START:STOP:STEP: 1:2'),
+    ('fast_reading_scale=3:1:1', 'Invalid range: 3:1:1'),
+])
+def test_invalid_variation(text, error):
+    with pytest.raises(ValueError) as excinfo:
+        Variation.parse(text)
+    assert str(excinfo.value) == error
+
+
+def test_float_range():
+    variation = Variation.parse('fast_reading_min_confidence=0.3:0.5:0.1')
+    assert variation.values == [0.3, 0.4, 0.5]
+
+
+def test_unknown_needle(expected_file):
+    variations = [Variation.parse('needle_data/0.5/circle_thickness=3')]
+    with pytest.raises(_sweep.SweepError) as excinfo:
+        _sweep.run_sweep(params_file, expected_file, variations)
+    assert str(excinfo.value) == 'No needle named 0.5'
+
+
+def test_main_sweep(expected_file, tmp_path, capsys):
+    out_dir = str(tmp_path / 'out')
+    _main.main([
+        'meterelf', 'sweep', params_file, expected_file,
+        '-v', 'dials_template_match_threshold=20000000,900000000',
+        '--top', '2', '-o', out_dir])
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith('1: 6/6 error=0.00')
+    assert lines[0].endswith(' baseline -> {}/params-1.yml'.format(out_dir))
+    assert lines[1].startswith('2: 6/6 ')
+    assert lines[1].endswith(
+        ' dials_template_match_threshold=20000000'
+        ' -> {}/params-2.yml'.format(out_dir))
+    assert sorted(os.listdir(out_dir)) == ['params-1.yml', 'params-2.yml']
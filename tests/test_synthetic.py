@@ -0,0 +1,89 @@
+import os
+
+import pytest
+import yaml
+
+from meterelf import _main, _params, _synthetic, get_meter_values
+from meterelf._filenames import scan_image_files
+from meterelf._reading import determine_value_by_dial_positions
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+params_file = os.path.join(project_dir, 'sample-images1', 'params.yml')
+
+# Largest allowed difference of a read value to the ground truth
+MAX_READING_ERROR = 0.02
+
+
+@pytest.mark.parametrize('value', [0.0, 0.05, 9.95, 123.456, 999.9])
+def test_dial_positions_give_the_value(value):
+    positions = _synthetic.get_dial_positions(
+        value, ['0.0001', '0.001', '0.01', '0.1'])
+    result = determine_value_by_dial_positions(positions)
+    assert result == pytest.approx(value, abs=1e-9)
+
+
+@pytest.mark.parametrize('reading_method', ['full', 'tiered', 'polar'])
+def test_generated_images_are_read_correctly(tmp_path, reading_method):
+    out_dir = str(tmp_path / 'out')
+    images = list(_synthetic.generate_corpus(params_file, out_dir, 20))
+    expected = {x.filename: x.value for x in images}
+    synth_params_file = os.path.join(out_dir, 'params.yml')
+    with open(synth_params_file, 'rt') as fp:
+        data = yaml.safe_load(fp)
+    data['reading_method'] = reading_method
+    with open(synth_params_file, 'wt') as fp:
+        yaml.safe_dump(data, fp)
+    params = _params.load(synth_params_file)
+    filenames = sorted(scan_image_files(params.image_glob))
+    assert [os.path.basename(x) for x in filenames] == sorted(expected)
+    for result in get_meter_values(synth_params_file, filenames):
+        assert result.error is None
+        difference = abs(
+            (result.value - expected[os.path.basename(result.filename)]
+             + 500.0) % 1000.0 - 500.0)
+        assert difference < MAX_READING_ERROR
+
+
+def test_generation_is_repeatable(tmp_path):
+    images1 = list(_synthetic.generate_corpus(
+        params_file, str(tmp_path / 'a'), 6, seed=3))
+    images2 = list(_synthetic.generate_corpus(
+        params_file, str(tmp_path / 'b'), 6, seed=3, workers=2))
+    assert images1 == images2
+    for image in images1:
+        data1 = (tmp_path / 'a' / image.filename).read_bytes()
+        data2 = (tmp_path / 'b' / image.filename).read_bytes()
+        assert data1 == data2
+    assert ((tmp_path / 'a' / 'expected.txt').read_text() ==
+            (tmp_path / 'b' / 'expected.txt').read_text())
+
+
+def test_needs_four_dials(tmp_path):
+    with open(params_file, 'rt') as fp:
+        data = yaml.safe_load(fp)
+    data['dials_template'] = os.path.join(
+        os.path.dirname(params_file), data['dials_template'])
+    del data['needle_data'][0]
+    path = tmp_path / 'params.yml'
+    path.write_text(yaml.safe_dump(data))
+    with pytest.raises(ValueError) as excinfo:
+        list(_synthetic.generate_corpus(str(path), str(tmp_path / 'out'), 1))
+    assert str(excinfo.value) == 'Ground truth needs a meter with four dials'
+
+
+def test_main_synth(tmp_path, capsys):
+    out_dir = str(tmp_path / 'out')
+    _main.main([
+        'meterelf', 'synth', params_file, out_dir, '-n', '3',
+        '--start', '2018-08-14T02:00', '--every', '15m'])
+    assert capsys.readouterr().out == f'Generated 3 images to {out_dir}\n'
+    assert sorted(os.listdir(out_dir)) == [
+        '20180814020000-s000000.jpg',
+        '20180814021500-s000001.jpg',
+        '20180814023000-s000002.jpg',
+        'expected.txt',
+        'params.yml',
+    ]
+    lines = (tmp_path / 'out' / 'expected.txt').read_text().splitlines()
+    assert [x.split(': ')[0] for x in lines] == sorted(os.listdir(out_dir))[:3]
@@ -0,0 +1,88 @@
+import os
+from glob import glob
+
+import cv2
+import pytest
+
+from meterelf import _params, _template_matching
+from meterelf._image import ImageFile, _get_dials_template
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+
+SAMPLE_DIRS = ['sample-images1', 'sample-images2']
+
+UNMATCHABLE_IMAGES = {
+    '20180814021309-01-e01.jpg',
+    '20180814021310-00-e02.jpg',
+}
+
+
+def get_lightness_images(params, sample_dir):
+    pattern = os.path.join(project_dir, sample_dir, '*.jpg')
+    for filename in sorted(glob(pattern)):
+        hls_image = ImageFile(filename, params).get_hls_image()
+        yield (os.path.basename(filename), cv2.split(hls_image)[1])
+
+
+def load_params(sample_dir):
+    return _params.load(os.path.join(project_dir, sample_dir, 'params.yml'))
+
+
+@pytest.mark.parametrize('method', ['normed', 'pyramid', 'spectrum'])
+@pytest.mark.parametrize('sample_dir', SAMPLE_DIRS)
+def test_backend_finds_same_dials_as_ccoeff(sample_dir, method):
+    params = load_params(sample_dir)
+    template = _get_dials_template(params)
+    for (filename, img) in get_lightness_images(params, sample_dir):
+        if filename in UNMATCHABLE_IMAGES:
+            continue
+        expected = _template_matching.match_template_ccoeff(
+            img, template, params)
+        params.dials_match_method = method
+        result = _template_matching.match_template(img, template, params)
+        assert result.rect == expected.rect, filename
+        if method != 'normed':
+            assert result.max_val == pytest.approx(expected.max_val, 1e-4)
+        else:
+            assert 0.5 < result.max_val <= 1.0
+
+
+@pytest.mark.parametrize('filename', sorted(UNMATCHABLE_IMAGES))
+def test_normed_scores_of_unmatchable_images(filename):
+    params = load_params('sample-images1')
+    params.dials_match_method = 'normed'
+    params.dials_match_threshold = 0.5
+    template = _get_dials_template(params)
+    imgf = ImageFile(
+        os.path.join(project_dir, 'sample-images1', filename), params)
+    lightness = cv2.split(imgf.get_hls_image())[1]
+    result = _template_matching.match_template(lightness, template, params)
+    assert result.max_val < params.dials_match_threshold
+
+
+def test_params_with_normed_method_has_float_threshold(tmpdir):
+    params_file = tmpdir.join('params.yml')
+    with open(os.path.join(project_dir, 'sample-images1', 'params.yml')) as fp:
+        params_text = fp.read()
+    params_text = params_text.replace(
+        'dials_template: "dials_gray.png"',
+        'dials_template: "{}"'.format(os.path.join(
+            project_dir, 'sample-images1', 'dials_gray.png')))
+    params_text = params_text.replace(
+        'dials_template_match_threshold: 20000000',
+        'dials_template_match_method: normed\n'
+        'dials_template_match_threshold: 0.5')
+    params_file.write(params_text)
+    params = _params.load(str(params_file))
+    assert params.dials_match_method == 'normed'
+    assert params.dials_match_threshold == 0.5
+
+
+def test_params_with_unknown_method():
+    data = {'dials_template_match_method': 'foobar'}
+    getter = _params.TypeCheckedGetter(data)
+    with pytest.raises(_params.LoadError) as excinfo:
+        getter.choice('dials_template_match_method', ['ccoeff', 'normed'])
+    assert str(excinfo.value) == (
+        'dials_template_match_method must be one of: ccoeff, normed')
@@ -0,0 +1,90 @@
+import os
+import threading
+import tracemalloc
+
+from meterelf import _params
+from meterelf._image import ImageFile, crop_meter, load_image
+from meterelf._reading import get_meter_value
+from meterelf._workspace import get_workspace
+
+mydir = os.path.abspath(os.path.dirname(__file__))
+project_dir = os.path.abspath(os.path.join(mydir, os.path.pardir))
+sample_dir = os.path.join(project_dir, 'sample-images1')
+params_file = os.path.join(sample_dir, 'params.yml')
+
+IMAGE_FILES = [
+    '20180814021357-00-e01.jpg',
+    '20180814074748-00-e07.jpg',
+    '20180816101722-01-e281.jpg',
+]
+
+# Maximum size of the memory allocated while reading a decoded image,
+# when the buffers of the workspace have been allocated.  Without the
+# workspace it is about 450 kB.
+MAX_STEADY_STATE_PEAK = 64 * 1024
+
+
+def load_meter_images(params):
+    return [
+        crop_meter(load_image(os.path.join(sample_dir, x)), params)
+        for x in IMAGE_FILES]
+
+
+def test_buffers_are_reused():
+    params = _params.load(params_file)
+    images = load_meter_images(params)
+    workspace = get_workspace(params)
+    hls_buffer = workspace.get('hls', images[0].shape[0:2], 3)
+    values = []
+    for image in images:
+        imgf = ImageFile('image', params, image)
+        values.append(get_meter_value(imgf, annotate=False)['value'])
+        assert imgf.get_hls_image() is hls_buffer
+    assert get_workspace(params) is workspace
+    assert [round(x, 3) for x in values] == [905.126, 972.797, 587.598]
+
+
+def test_earlier_image_is_not_changed_by_next_image():
+    params = _params.load(params_file)
+    images = load_meter_images(params)
+    first = ImageFile('first', params, images[0])
+    expected_hls = first.get_hls_image().copy()
+    expected_value = get_meter_value(first, annotate=False)['value']
+    second = ImageFile('second', params, images[1])
+    get_meter_value(second, annotate=False)
+    assert (first.get_hls_image() == expected_hls).all()
+    assert get_meter_value(first, annotate=False)['value'] == expected_value
+
+
+def test_steady_state_allocations():
+    params = _params.load(params_file)
+    images = load_meter_images(params)
+    for image in images:
+        get_meter_value(ImageFile('image', params, image), annotate=False)
+    tracemalloc.start()
+    try:
+        for image in images * 3:
+            get_meter_value(
+                ImageFile('image', params, image), annotate=False)
+        (_current, peak) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < MAX_STEADY_STATE_PEAK
+
+
+def test_smaller_image_gets_own_buffer():
+    params = _params.load(params_file)
+    image = load_meter_images(params)[0][5:, 5:]
+    imgf = ImageFile('image', params, image)
+    assert round(get_meter_value(imgf, annotate=False)['value'], 3) == 905.126
+    assert imgf.get_hls_image().shape == image.shape
+
+
+def test_threads_have_own_workspaces():
+    params = _params.load(params_file)
+    workspaces = []
+    thread = threading.Thread(
+        target=lambda: workspaces.append(get_workspace(params)))
+    thread.start()
+    thread.join()
+    assert workspaces[0] is not get_workspace(params)